@@ -1,38 +1,226 @@
 import openai
 import os
-from typing import Dict, Any
+import json
+from typing import Dict, Any, List, NamedTuple, Optional
 import re
+import time
 from datetime import datetime
 
+from classification_cache import ClassificationCache, classification_cache, fingerprint
+from email_preprocessor import PreparedEmail, estimate_tokens, prepare_email
+from rule_engine import compiled_rules
+from circuit_breaker import CircuitBreaker
+from rate_limiter import RateLimiter, openai_rate_limiter, request_priority
+
+# Seconds an email may spend waiting on the model when the caller gives no
+# deadline of its own.
+CLASSIFIER_TIMEOUT_SECONDS = float(os.getenv("CLASSIFIER_TIMEOUT_SECONDS", "10"))
+# The SDK retries twice by default, which triples the worst case.
+CLASSIFIER_MAX_RETRIES = int(os.getenv("CLASSIFIER_MAX_RETRIES", "0"))
+CLASSIFIER_BREAKER_FAILURES = int(os.getenv("CLASSIFIER_BREAKER_FAILURES", "5"))
+CLASSIFIER_BREAKER_RESET_SECONDS = float(os.getenv("CLASSIFIER_BREAKER_RESET_SECONDS", "30"))
+# What happens to unruled mail while the model is unavailable: 'forward'
+# (forward it), 'rules_only' (quarantine it) or 'queue' (classify it later).
+CLASSIFIER_DEGRADED_POLICY = os.getenv("CLASSIFIER_DEGRADED_POLICY", "forward")
+CLASSIFIER_DEFER_SECONDS = float(os.getenv("CLASSIFIER_DEFER_SECONDS", "300"))
+
+# Completion tokens allowed per email in a batched request.
+CLASSIFIER_BATCH_TOKENS_PER_EMAIL = int(os.getenv("CLASSIFIER_BATCH_TOKENS_PER_EMAIL", "80"))
+
+SYSTEM_PROMPT = "You are an AI assistant that classifies emails as important or junk. Respond with a JSON object containing 'action' (forward/delete), 'confidence' (0-1), and 'reasoning'."
+BATCH_SYSTEM_PROMPT = "You are an AI assistant that classifies emails as important or junk. Respond with a JSON array holding one object per email with 'id', 'action' (forward/delete), 'confidence' (0-1), and 'reasoning'."
+
+CLASSIFICATION_CRITERIA = """Classification Criteria:
+FORWARD if:
+- Account verification/confirmation emails
+- Order confirmations or shipping notifications
+- Important service updates or security alerts
+- Event tickets or confirmations
+- Password reset requests
+- Payment receipts
+
+DELETE if:
+- Marketing/promotional emails
+- Newsletters
+- Spam or suspicious content
+- Unrelated promotional offers
+- Generic advertising"""
+
+class ClassifierUnavailable(Exception):
+    """The model could not be asked in time (deadline, open circuit or API error)."""
+
+class ClassificationRequest(NamedTuple):
+    sender_email: str
+    subject: str
+    prepared: PreparedEmail
+    temp_email_purpose: Optional[str]
+    cache_key: str
+
 class AIEmailClassifier:
-    def __init__(self):
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, cache: ClassificationCache = classification_cache, breaker: CircuitBreaker = None,
+                 rate_limiter: RateLimiter = openai_rate_limiter):
+        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=CLASSIFIER_MAX_RETRIES)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker or CircuitBreaker(
+            "openai", CLASSIFIER_BREAKER_FAILURES, CLASSIFIER_BREAKER_RESET_SECONDS
+        )
+        
+    def prepare_request(self, sender_email: str, subject: str, body: str, temp_email_purpose: str = None,
+                        headers: str = None) -> ClassificationRequest:
+        prepared = prepare_email(body, headers)
+        # Keyed on what the model would see, so copies that differ only in
+        # markup or tracking links share a decision.
+        cache_key = fingerprint(sender_email, subject, prepared.render(), temp_email_purpose)
+        return ClassificationRequest(sender_email, subject, prepared, temp_email_purpose, cache_key)
+    
+    def classify_email(self, sender_email: str, subject: str, body: str, temp_email_purpose: str = None,
+                       headers: str = None, deadline: float = None) -> Dict[str, Any]:
+        """deadline is a time.monotonic() value; without one the call gets
+        CLASSIFIER_TIMEOUT_SECONDS."""
+        request = self.prepare_request(sender_email, subject, body, temp_email_purpose, headers)
+        cached = self.cache.get(request.cache_key)
+        if cached:
+            return cached
+        return self._classify_one(request, deadline)
+    
+    def classify_batch(self, requests: List[ClassificationRequest], check_cache: bool = True,
+                       deadline: float = None) -> List[Dict[str, Any]]:
+        """Classify several emails with one completion call.
+        
+        Emails the model does not answer for (or answers malformed) are
+        retried one by one, so every request gets a result.
+        """
+        results: List[Optional[Dict[str, Any]]] = [
+            self.cache.get(request.cache_key) if check_cache else None for request in requests
+        ]
+        # Identical emails (same fingerprint) are only asked about once.
+        pending: Dict[str, List[int]] = {}
+        for index, result in enumerate(results):
+            if result is None:
+                pending.setdefault(requests[index].cache_key, []).append(index)
         
-    def classify_email(self, sender_email: str, subject: str, body: str, temp_email_purpose: str = None) -> Dict[str, Any]:
+        batch = [requests[indexes[0]] for indexes in pending.values()]
+        if len(batch) == 1:
+            decided = [self._classify_one(batch[0], deadline)]
+        elif batch:
+            try:
+                content = self._complete(
+                    [
+                        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                        {"role": "user", "content": self._build_batch_prompt(batch)}
+                    ],
+                    CLASSIFIER_BATCH_TOKENS_PER_EMAIL * len(batch),
+                    deadline,
+                    "high" if any(self._priority(request) == "high" for request in batch) else "normal"
+                )
+            except ClassifierUnavailable as e:
+                # Retrying one by one would only pile more calls onto a
+                # failing upstream.
+                decided = [self.degraded_result(str(e)) for _ in batch]
+            else:
+                # Emails the model skipped or garbled get their own call.
+                decisions = self._parse_batch_response(content, len(batch))
+                decided = []
+                for number, request in enumerate(batch, 1):
+                    result = decisions.get(number)
+                    if result is None:
+                        result = self._classify_one(request, deadline)
+                    else:
+                        self.cache.set(request.cache_key, result)
+                    decided.append(result)
+        else:
+            decided = []
+        
+        for indexes, result in zip(pending.values(), decided):
+            for index in indexes:
+                results[index] = dict(result)
+        return results
+    
+    def _classify_one(self, request: ClassificationRequest, deadline: float = None) -> Dict[str, Any]:
         try:
-            prompt = self._build_classification_prompt(sender_email, subject, body, temp_email_purpose)
+            prompt = self._build_classification_prompt(request.sender_email, request.subject, request.prepared,
+                                                       request.temp_email_purpose)
             
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are an AI assistant that classifies emails as important or junk. Respond with a JSON object containing 'action' (forward/delete), 'confidence' (0-1), and 'reasoning'."},
+            content = self._complete(
+                [
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=200,
-                temperature=0.1
+                200,
+                deadline,
+                self._priority(request)
             )
             
-            result = self._parse_ai_response(response.choices[0].message.content)
+            result = self._parse_ai_response(content)
+            if result.get("action") in ("forward", "delete"):
+                self.cache.set(request.cache_key, result)
             return result
             
         except Exception as e:
-            return {
-                "action": "forward",
-                "confidence": 0.5,
-                "reasoning": f"AI classification failed: {str(e)}. Defaulting to forward for safety."
-            }
+            return self.degraded_result(str(e))
+    
+    def _complete(self, messages: List[Dict[str, str]], max_tokens: int, deadline: float = None,
+                  priority: str = "normal") -> str:
+        """One completion call, bounded by the deadline, the shared rate limit
+        and the circuit breaker. A 429 is waited out if the deadline allows."""
+        deadline = deadline or time.monotonic() + CLASSIFIER_TIMEOUT_SECONDS
+        estimated_tokens = sum(estimate_tokens(message["content"]) for message in messages) + max_tokens
+        while True:
+            if deadline - time.monotonic() <= 0:
+                raise ClassifierUnavailable("deadline exceeded")
+            if not self.rate_limiter.acquire(estimated_tokens, priority, deadline):
+                raise ClassifierUnavailable("rate limit budget exhausted before the deadline")
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise ClassifierUnavailable("deadline exceeded")
+            if not self.breaker.allow():
+                raise ClassifierUnavailable("circuit breaker open")
+            
+            started = time.monotonic()
+            try:
+                raw_response = self.client.chat.completions.with_raw_response.create(
+                    model="gpt-3.5-turbo",
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.1,
+                    timeout=timeout
+                )
+            except openai.RateLimitError as e:
+                # The API is up, just saturated: pause every worker rather
+                # than counting it against the breaker.
+                self.breaker.record_success(time.monotonic() - started)
+                self.rate_limiter.penalize(e.response.headers)
+                continue
+            except Exception as e:
+                self.breaker.record_failure(time.monotonic() - started, f"{type(e).__name__}: {str(e)}")
+                raise ClassifierUnavailable(str(e)) from e
+            self.breaker.record_success(time.monotonic() - started)
+            
+            self.rate_limiter.observe(raw_response.headers)
+            response = raw_response.parse()
+            usage = getattr(response, "usage", None)
+            self.rate_limiter.settle(estimated_tokens, usage.total_tokens if usage else None)
+            return response.choices[0].message.content
+    
+    @staticmethod
+    def _priority(request: ClassificationRequest) -> str:
+        return request_priority(request.subject, request.prepared.body)
+    
+    @staticmethod
+    def degraded_result(error: str) -> Dict[str, Any]:
+        # Forwarding is the historical fallback; callers apply
+        # CLASSIFIER_DEGRADED_POLICY to results marked degraded, using
+        # "reason" to word their own outcome.
+        return {
+            "action": "forward",
+            "confidence": 0.5,
+            "reasoning": f"AI classification failed: {error}. Defaulting to forward for safety.",
+            "degraded": True,
+            "reason": error
+        }
     
-    def _build_classification_prompt(self, sender_email: str, subject: str, body: str, temp_email_purpose: str = None) -> str:
+    def _build_classification_prompt(self, sender_email: str, subject: str, prepared: PreparedEmail, temp_email_purpose: str = None) -> str:
         prompt = f"""Classify this email as either important (should be forwarded) or junk (should be deleted).
 
 Context:
@@ -42,32 +230,36 @@ Context:
 Email Details:
 From: {sender_email}
 Subject: {subject}
-Body: {body[:500]}...
+{prepared.render()}
 
-Classification Criteria:
-FORWARD if:
-- Account verification/confirmation emails
-- Order confirmations or shipping notifications
-- Important service updates or security alerts
-- Event tickets or confirmations
-- Password reset requests
-- Payment receipts
-
-DELETE if:
-- Marketing/promotional emails
-- Newsletters
-- Spam or suspicious content
-- Unrelated promotional offers
-- Generic advertising
+{CLASSIFICATION_CRITERIA}
 
 Respond with JSON format:
 {{"action": "forward" or "delete", "confidence": 0.0-1.0, "reasoning": "brief explanation"}}"""
         
         return prompt
     
+    def _build_batch_prompt(self, requests: List[ClassificationRequest]) -> str:
+        emails = "\n\n".join(
+            f"""### Email {number}
+Purpose of temp email: {request.temp_email_purpose or 'Not specified'}
+From: {request.sender_email}
+Subject: {request.subject}
+{request.prepared.render()}"""
+            for number, request in enumerate(requests, 1)
+        )
+        return f"""Classify each of the following emails as either important (should be forwarded) or junk (should be deleted).
+Every email was sent to a temporary email address created for the stated purpose.
+
+{CLASSIFICATION_CRITERIA}
+
+{emails}
+
+Respond with a JSON array containing one object per email:
+[{{"id": 1, "action": "forward" or "delete", "confidence": 0.0-1.0, "reasoning": "brief explanation"}}, ...]"""
+    
     def _parse_ai_response(self, response_text: str) -> Dict[str, Any]:
         try:
-            import json
             json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
             if json_match:
                 return json.loads(json_match.group())
@@ -90,19 +282,35 @@ Respond with JSON format:
             "reasoning": response_text[:200]
         }
     
-    def apply_user_rules(self, sender_email: str, subject: str, body: str, forwarding_rules: list) -> Dict[str, Any]:
-        for rule in forwarding_rules:
-            if not rule.is_active:
-                continue
-                
-            keywords = [kw.strip().lower() for kw in rule.keywords.split(',')]
-            content_to_check = f"{sender_email} {subject} {body}".lower()
-            
-            if any(keyword in content_to_check for keyword in keywords):
-                return {
-                    "action": rule.action,
-                    "confidence": 1.0,
-                    "reasoning": f"Matched user rule: {rule.keywords}"
-                }
+    def _parse_batch_response(self, response_text: str, count: int) -> Dict[int, Dict[str, Any]]:
+        """Map 1-based email numbers to well-formed decisions; anything else is left out."""
+        array_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+        if not array_match:
+            return {}
+        try:
+            items = json.loads(array_match.group())
+        except ValueError:
+            return {}
         
-        return None
\ No newline at end of file
+        decisions = {}
+        for position, item in enumerate(items if isinstance(items, list) else [], 1):
+            if not isinstance(item, dict) or item.get("action") not in ("forward", "delete"):
+                continue
+            number = item.get("id", position)
+            if not isinstance(number, int) or not 1 <= number <= count or number in decisions:
+                continue
+            try:
+                confidence = min(max(float(item.get("confidence", 0.7)), 0.0), 1.0)
+            except (TypeError, ValueError):
+                confidence = 0.7
+            decisions[number] = {
+                "action": item["action"],
+                "confidence": confidence,
+                "reasoning": str(item.get("reasoning", ""))[:500]
+            }
+        return decisions
+    
+    def apply_user_rules(self, sender_email: str, subject: str, body: str, forwarding_rules: list) -> Dict[str, Any]:
+        if not forwarding_rules:
+            return None
+        return compiled_rules.get(forwarding_rules).apply(sender_email, subject, body)
\ No newline at end of file
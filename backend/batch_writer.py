@@ -0,0 +1,105 @@
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models import EmailLog, OutboundEmail
+import dashboard_stats
+import sender_reputation
+from metrics import INBOUND_STAGE_SECONDS
+
+
+class BatchWriter:
+    """Collects the writes for a webhook batch and applies them in one commit.
+
+    Log rows (and their outbox messages) go in with executemany INSERTs and
+    stats counters are aggregated per user/address. If the batch fails as a
+    whole, each row is retried in its own savepoint so one bad row only
+    loses itself.
+
+    Events deferred for later classification are only collected here; the
+    caller enqueues them after flush().
+
+    Each log may carry a source (the queue uses the event id) so callers
+    can tell which rows were lost when the row-by-row retry drops some.
+    """
+
+    def __init__(self):
+        self.logs: List[Tuple[int, Dict[str, Any], Dict[str, Any], Hashable]] = []
+        self.deferred: List[dict] = []
+
+    def add_log(self, user_id: int, outbound: Dict[str, Any] = None, **fields):
+        """Queue an EmailLog row, plus the outbox message it produced if any."""
+        self.logs.append((user_id, fields, outbound, None))
+
+    def defer(self, event: dict):
+        self.deferred.append(event)
+
+    def extend(self, other: "BatchWriter", source: Hashable = None):
+        """Take over everything another writer collected, tagging its logs with source."""
+        self.logs.extend((user_id, fields, outbound, source) for user_id, fields, outbound, _ in other.logs)
+        self.deferred.extend(other.deferred)
+        other.logs, other.deferred = [], []
+
+    def flush(self, db: Session, before_commit: Callable[[Session, List[Hashable]], Any] = None) -> int:
+        """Write everything collected so far. Returns the number of logs written.
+
+        before_commit(db, lost_sources) runs inside the same transaction, for
+        bookkeeping that must land atomically with the batch; lost_sources
+        lists the sources of logs that could not be written.
+        """
+        logs = self.logs
+        self.logs = []
+        if not logs and before_commit is None:
+            return 0
+
+        try:
+            with INBOUND_STAGE_SECONDS.time("commit"):
+                self._write(db, logs)
+                if before_commit:
+                    before_commit(db, [])
+                db.commit()
+            written = len(logs)
+        except Exception as e:
+            db.rollback()
+            print(f"Batch write failed, retrying row by row: {str(e)}")
+            written = 0
+            lost_sources = []
+            for log in logs:
+                try:
+                    with db.begin_nested():
+                        self._write(db, [log])
+                    written += 1
+                except Exception as row_error:
+                    print(f"Error writing email log: {str(row_error)}")
+                    lost_sources.append(log[3])
+            if before_commit:
+                before_commit(db, lost_sources)
+            db.commit()
+
+        return written
+
+    def _write(self, db: Session, logs: List[Tuple[int, Dict[str, Any], Dict[str, Any], Hashable]]):
+        if not logs:
+            return
+        rows = [fields for _, fields, _, _ in logs]
+        outbound = [message for _, _, message, _ in logs if message]
+        if not outbound:
+            db.execute(insert(EmailLog), rows)
+        else:
+            # Outbox messages point at their log row, so the ids are needed.
+            if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+                log_ids = db.execute(
+                    insert(EmailLog).returning(EmailLog.id, sort_by_parameter_order=True), rows
+                ).scalars().all()
+            else:
+                log_ids = [db.execute(insert(EmailLog).values(**fields)).inserted_primary_key[0] for fields in rows]
+            db.execute(insert(OutboundEmail), [
+                dict(message, email_log_id=log_id)
+                for (_, _, message, _), log_id in zip(logs, log_ids) if message
+            ])
+        dashboard_stats.record_email_logs(db, Counter(
+            (user_id, fields["temp_email_id"], fields["action_taken"]) for user_id, fields, _, _ in logs
+        ))
+        sender_reputation.record_email_logs(db, [fields for _, fields, _, _ in logs])
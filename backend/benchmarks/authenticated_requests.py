@@ -0,0 +1,84 @@
+"""Latency and DB queries of authenticated dashboard requests, with and without the principal cache.
+
+Run from backend/:  python benchmarks/authenticated_requests.py [--requests 2000]
+Uses a throwaway SQLite database and the in-process app.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROUNDS = 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--path", default="/api/dashboard/stats")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("SENDGRID_API_KEY", "SG.benchmark")
+
+    from sqlalchemy import event
+    import main as app_main
+    from database import SessionLocal, engine
+    from models import User, UserStats
+    from routers.auth import create_access_token
+
+    db = SessionLocal()
+    user = User(email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    db.add(UserStats(user_id=user.id))
+    db.commit()
+    tokens = {
+        "legacy token (sub only)": create_access_token({"sub": user.email}),
+        "token with uid": create_access_token({"sub": user.email, "uid": user.id}),
+    }
+    db.close()
+
+    queries = [0]
+    event.listen(engine, "before_cursor_execute", lambda *_: queries.__setitem__(0, queries[0] + 1))
+    asyncio.run(measure(app_main.app, args, tokens, queries))
+
+
+async def measure(app, args, tokens, queries):
+    import httpx
+    from principal_cache import principal_cache
+
+    cache_ttl = principal_cache.ttl_seconds or 60
+    configurations = [(name, ttl) for name in tokens for ttl in (0, cache_ttl)]
+    results = {configuration: [0.0, 0] for configuration in configurations}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        # Configurations take turns in short rounds so drift in the process
+        # (allocator, SQLite WAL) is spread evenly across them.
+        for round_number in range(ROUNDS + 1):
+            for name, ttl in configurations:
+                principal_cache.ttl_seconds = ttl
+                principal_cache.clear()
+                headers = {"Authorization": f"Bearer {tokens[name]}"}
+                queries[0] = 0
+                start = time.perf_counter()
+                for _ in range(args.requests // ROUNDS):
+                    response = await client.get(args.path, headers=headers)
+                    assert response.status_code == 200, response.text
+                if round_number:  # the first round is warmup
+                    results[(name, ttl)][0] += time.perf_counter() - start
+                    results[(name, ttl)][1] += queries[0]
+    principal_cache.ttl_seconds = cache_ttl
+
+    requests = args.requests // ROUNDS * ROUNDS
+    for (name, ttl), (elapsed, query_count) in results.items():
+        print(f"{name:<26} cache {'on ' if ttl else 'off'}  "
+              f"{elapsed / requests * 1e6:8.0f} us/request  {query_count / requests:.2f} queries/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Per-email write cost of the webhook path: commit per email vs one commit per batch.
+
+Run from backend/:  python benchmarks/group_commit.py [--database-url URL]
+Defaults to a throwaway SQLite file so fsync cost is included.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batches", type=int, default=10)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+
+    from models import Base, EmailLog, TempEmail, TempEmailStats, User, UserStats
+    from batch_writer import BatchWriter
+    import dashboard_stats
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    user = User(email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    db.add(UserStats(user_id=user.id))
+    temp_emails = [TempEmail(user_id=user.id, address=f"bench-{i}@example.com") for i in range(10)]
+    db.add_all(temp_emails)
+    db.flush()
+    db.add_all(TempEmailStats(temp_email_id=t.id, user_id=user.id) for t in temp_emails)
+    db.commit()
+    temp_email_ids = [t.id for t in temp_emails]
+    user_id = user.id
+    db.close()
+
+    def log_fields(i):
+        return dict(
+            temp_email_id=temp_email_ids[i % len(temp_email_ids)],
+            sender_email=f"sender{i % 7}@example.com",
+            subject=f"Subject {i}",
+            body_preview="x" * 200,
+            action_taken="forward" if i % 3 else "delete",
+            ai_confidence_score=0.9,
+            ai_reasoning="benchmark"
+        )
+
+    def per_email_commit():
+        db = Session()
+        for i in range(args.batch_size):
+            fields = log_fields(i)
+            db.add(EmailLog(**fields))
+            dashboard_stats.record_email_log(db, user_id, fields["temp_email_id"], fields["action_taken"])
+            db.commit()
+        db.close()
+
+    def group_commit():
+        db = Session()
+        writer = BatchWriter()
+        for i in range(args.batch_size):
+            writer.add_log(user_id, **log_fields(i))
+        writer.flush(db)
+        db.close()
+
+    print(f"{database_url} | {args.batches} batches of {args.batch_size} emails")
+    results = {}
+    for name, run in (("commit per email", per_email_commit), ("group commit", group_commit)):
+        run()  # warm-up
+        started = time.perf_counter()
+        for _ in range(args.batches):
+            run()
+        elapsed = time.perf_counter() - started
+        results[name] = elapsed / (args.batches * args.batch_size) * 1e6
+        print(f"  {name:<18} {results[name]:10.1f} us/email")
+    print(f"  speedup            {results['commit per email'] / results['group commit']:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Local stand-ins for the OpenAI and SendGrid HTTP APIs.
+
+Both run in background threads and speak just enough of each API for the
+real SDK clients: point OPENAI_BASE_URL and SENDGRID_API_URL at them.
+Latency, error rates and the error status are configurable so slow,
+failing or throttling (429) upstreams can be replayed.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_subject_re = re.compile(r"^Subject: (.*)$", re.MULTILINE)
+# Subjects containing these are classified as junk by the stub model.
+JUNK_WORDS = ("sale", "offer", "newsletter", "deal", "% off")
+
+
+class StubServer:
+    def __init__(self, handler_class, latency_ms: float = 0, error_rate: float = 0, seed: int = 0,
+                 error_status: int = 500):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(handler_class):
+            server_stub = stub
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def admit(self) -> bool:
+        """Count a request, apply latency, and decide whether it fails."""
+        with self._lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+            # Up to 50% jitter either way, so requests do not march in step.
+            delay = self.latency * (0.5 + self.random.random())
+        if delay:
+            time.sleep(delay)
+        return not failed
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_stub: StubServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _respond(self, status: int, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_error(self, payload):
+        status = self.server_stub.error_status
+        self._respond(status, payload, {"Retry-After": "1"} if status == 429 else None)
+
+
+def _decide(subject: str):
+    junk = any(word in subject.lower() for word in JUNK_WORDS)
+    return {"action": "delete" if junk else "forward", "confidence": 0.92, "reasoning": "stub classification"}
+
+
+class OpenAIHandler(_Handler):
+    def do_POST(self):
+        request = json.loads(self._body() or b"{}")
+        if not self.server_stub.admit():
+            self._respond_error({"error": {"message": "stub upstream error", "type": "server_error"}})
+            return
+
+        messages = request.get("messages") or [{"content": ""}]
+        prompt = messages[-1]["content"]
+        subjects = _subject_re.findall(prompt)
+        if "JSON array" in messages[0]["content"]:
+            content = json.dumps([dict(_decide(subject), id=number) for number, subject in enumerate(subjects, 1)])
+        else:
+            content = json.dumps(_decide(subjects[0] if subjects else ""))
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        self._respond(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+
+class SendGridHandler(_Handler):
+    def do_POST(self):
+        self._body()
+        if not self.server_stub.admit():
+            self._respond_error({"errors": [{"message": "stub upstream error"}]})
+            return
+        self._respond(202)
+
+
+def start_openai_stub(latency_ms: float = 0, error_rate: float = 0, seed: int = 0) -> StubServer:
+    return StubServer(OpenAIHandler, latency_ms, error_rate, seed).start()
+
+
+def start_sendgrid_stub(latency_ms: float = 0, error_rate: float = 0, seed: int = 0) -> StubServer:
+    return StubServer(SendGridHandler, latency_ms, error_rate, seed).start()
@@ -0,0 +1,305 @@
+"""End-to-end load test of POST /api/webhooks/sendgrid.
+
+Run from backend/:  python benchmarks/webhook_load.py [--save results.json] [--baseline baseline.json]
+
+The app runs in-process against a throwaway SQLite database (or
+--database-url) with local OpenAI and SendGrid stand-ins, and replays
+synthetic SendGrid batches mixing rule hits, unknown addresses, campaign
+copies and HTML bodies of several sizes. Reports emails per second,
+request latency percentiles and DB queries, model calls and sends per
+email. With --baseline, exits 1 if throughput, p95 latency or queries per
+email regressed by more than --tolerance.
+
+Settings the app reads from the environment (WEBHOOK_MODE,
+FORWARDING_MODE, CLASSIFIER_BATCH_SIZE, ...) can be set as usual; in
+queue mode the clock runs until the queue has drained. The OpenAI rate
+limit budget is off unless OPENAI_RPM_LIMIT/OPENAI_TPM_LIMIT are set.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream_stubs import start_openai_stub, start_sendgrid_stub
+
+WORDS = (
+    "account order update team account service delivery product support message week please thanks "
+    "today review details customer offer new time information available request change access help "
+    "report schedule event ticket payment plan member program share news story update price save"
+).split()
+IMPORTANT_SUBJECTS = ("Confirm your account", "Your order has shipped", "Security alert", "Event ticket",
+                      "Password reset", "Payment received")
+JUNK_SUBJECTS = ("Weekend sale", "Exclusive offer", "Our monthly newsletter", "Deal of the day", "30% off")
+RULE_KEYWORDS = ("invoice", "receipt")
+
+
+def percentile(ordered, fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+
+
+class EventGenerator:
+    def __init__(self, args, addresses):
+        self.args = args
+        self.addresses = addresses
+        self.random = random.Random(args.seed)
+        self.html_sizes = [int(size) * 1024 for size in args.html_kb.split(",")]
+        self.campaigns = []
+        self.sequence = 0
+
+    def words(self, count: int) -> str:
+        return " ".join(self.random.choice(WORDS) for _ in range(count))
+
+    def body(self, size: int, name: str) -> str:
+        if size == 0:
+            return f"Hi {name},\n{self.words(60)}\n\nThanks"
+        paragraphs = [f"<p>Hi {name},</p>"]
+        length = 0
+        while length < size:
+            paragraph = (f'<p style="font-family:Arial">{self.words(40)} '
+                         f'<a href="https://links.example.com/c/{self.random.getrandbits(64):x}">{self.words(3)}</a></p>')
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        paragraphs.append('<img src="https://t.example.com/o.gif" width="1" height="1">')
+        return f"<html><head><style>p {{ margin: 0 }}</style></head><body>{''.join(paragraphs)}</body></html>"
+
+    def event(self):
+        self.sequence += 1
+        name = f"user{self.sequence}"
+        to_email = self.random.choice(self.addresses)
+        kind = self.random.random()
+        if kind < self.args.unknown_rate:
+            to_email = f"unknown-{self.sequence}@example.com"
+        elif kind < self.args.unknown_rate + self.args.campaign_rate and self.campaigns:
+            # Another personalised copy of a recent campaign.
+            subject, size, sender = self.random.choice(self.campaigns)
+            return self._event(to_email, sender, subject, self.body(size, name), size)
+        subject = self.random.choice(JUNK_SUBJECTS + IMPORTANT_SUBJECTS)
+        if self.random.random() < self.args.rule_hit_rate:
+            subject = f"Your {self.random.choice(RULE_KEYWORDS)} #{self.sequence}"
+        else:
+            subject = f"{subject}: {self.words(3)}"
+        size = self.random.choice(self.html_sizes)
+        sender = f"sender{self.random.randrange(self.args.senders)}@sender{self.random.randrange(50)}.example.com"
+        if len(self.campaigns) < 20:
+            self.campaigns.append((subject, size, sender))
+        return self._event(to_email, sender, subject, self.body(size, name), size)
+
+    @staticmethod
+    def _event(to_email, sender, subject, body, size):
+        event = {"event": "inbound", "to": [{"email": to_email}], "from": sender, "subject": subject}
+        event["html" if size else "text"] = body
+        return event
+
+    def batch(self):
+        return [self.event() for _ in range(self.args.batch_size)]
+
+
+def seed_database(args):
+    from database import SessionLocal
+    from models import ForwardingRule, TempEmail, TempEmailStats, User, UserStats
+
+    db = SessionLocal()
+    addresses = []
+    try:
+        for index in range(args.users):
+            user = User(email=f"bench{index}@example.com", hashed_password="x")
+            db.add(user)
+            db.flush()
+            db.add(UserStats(user_id=user.id))
+            db.add(ForwardingRule(user_id=user.id, keywords=", ".join(RULE_KEYWORDS), action="forward"))
+            temp_emails = [
+                TempEmail(user_id=user.id, address=f"bench{index}-{number}@example.com", purpose="shopping")
+                for number in range(args.addresses_per_user)
+            ]
+            db.add_all(temp_emails)
+            db.flush()
+            db.add_all(TempEmailStats(temp_email_id=temp_email.id, user_id=user.id) for temp_email in temp_emails)
+            addresses.extend(temp_email.address for temp_email in temp_emails)
+        db.commit()
+    finally:
+        db.close()
+    return addresses
+
+
+class QueryCounter:
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+async def run(args, database_url, openai_stub, sendgrid_stub):
+    import httpx
+    import main
+    import database
+    import work_queue
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    addresses = seed_database(args)
+    generator = EventGenerator(args, addresses)
+    warmup = [generator.batch() for _ in range(args.warmup)]
+    batches = [generator.batch() for _ in range(args.batches)]
+    queue_mode = main.webhooks.WEBHOOK_MODE == "queue"
+    # Polls the queue through its own engine so they are not counted.
+    Monitor = sessionmaker(bind=create_engine(database_url))
+
+    async def drain():
+        while queue_mode:
+            monitor = Monitor()
+            try:
+                if work_queue.queue_stats(monitor)["depth"] == 0:
+                    return
+            finally:
+                monitor.close()
+            await asyncio.sleep(0.05)
+
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for batch in warmup:
+                await client.post("/api/webhooks/sendgrid", json=batch)
+            await drain()
+
+            queries = QueryCounter(database.engine, database.get_async_engine().sync_engine)
+            openai_before = openai_stub.stats()["requests"]
+            sendgrid_before = sendgrid_stub.stats()["requests"]
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+            failures = 0
+
+            async def post(batch):
+                nonlocal failures
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/api/webhooks/sendgrid", json=batch)
+                    latencies.append(time.perf_counter() - started)
+                    failures += response.status_code != 200
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(batch) for batch in batches))
+            await drain()
+            elapsed = time.perf_counter() - started
+    finally:
+        await main.app.router.shutdown()
+
+    emails = args.batches * args.batch_size
+    latencies.sort()
+    return {
+        "emails": emails,
+        "seconds": round(elapsed, 3),
+        "emails_per_second": round(emails / elapsed, 1),
+        "request_latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": percentile(latencies, 1.0)
+        },
+        "db_queries_per_email": round(queries.count / emails, 2),
+        "openai_requests_per_email": round((openai_stub.stats()["requests"] - openai_before) / emails, 3),
+        "sendgrid_requests_per_email": round((sendgrid_stub.stats()["requests"] - sendgrid_before) / emails, 3),
+        "failed_requests": failures
+    }
+
+
+def compare(results, baseline, tolerance: float):
+    """Regressions of results against baseline, as printable lines."""
+    checks = (
+        ("emails_per_second", results["emails_per_second"], baseline["emails_per_second"], -1),
+        ("p95 latency ms", results["request_latency_ms"]["p95"], baseline["request_latency_ms"]["p95"], 1),
+        ("db_queries_per_email", results["db_queries_per_email"], baseline["db_queries_per_email"], 1),
+    )
+    regressions = []
+    for name, current, previous, direction in checks:
+        if previous and direction * (current - previous) / previous > tolerance:
+            regressions.append(f"{name}: {previous} -> {current}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured batches sent first")
+    parser.add_argument("--concurrency", type=int, default=4, help="webhook requests in flight")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--addresses-per-user", type=int, default=5)
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--rule-hit-rate", type=float, default=0.2)
+    parser.add_argument("--unknown-rate", type=float, default=0.1)
+    parser.add_argument("--campaign-rate", type=float, default=0.2)
+    parser.add_argument("--html-kb", default="0,2,20", help="comma-separated HTML body sizes, 0 for plain text")
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--sendgrid-latency-ms", type=float, default=100)
+    parser.add_argument("--sendgrid-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    openai_stub = start_openai_stub(args.openai_latency_ms, args.openai_error_rate, args.seed)
+    sendgrid_stub = start_sendgrid_stub(args.sendgrid_latency_ms, args.sendgrid_error_rate, args.seed)
+
+    tmp_dir = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["OPENAI_BASE_URL"] = f"{openai_stub.url}/v1"
+    os.environ["SENDGRID_API_URL"] = f"{sendgrid_stub.url}/v3/mail/send"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("SENDGRID_API_KEY", "SG.benchmark")
+    os.environ.setdefault("OPENAI_RATE_LIMIT_FILE", os.path.join(tmp_dir, "ratelimit.json"))
+    # The stub enforces no limits; the default account budget would make the
+    # run measure the rate limiter rather than the app.
+    os.environ.setdefault("OPENAI_RPM_LIMIT", "0")
+    os.environ.setdefault("OPENAI_TPM_LIMIT", "0")
+    os.environ.setdefault("LOCAL_CLASSIFIER_SNAPSHOT_PATH", os.path.join(tmp_dir, "local_classifier.npz"))
+    os.environ.setdefault("QUEUE_POLL_INTERVAL", "0.05")
+
+    try:
+        results = asyncio.run(run(args, database_url, openai_stub, sendgrid_stub))
+    finally:
+        openai_stub.stop()
+        sendgrid_stub.stop()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("save", "baseline", "database_url")}
+    config.update({name: os.getenv(name) for name in ("WEBHOOK_MODE", "FORWARDING_MODE", "CLASSIFIER_BATCH_SIZE")
+                   if os.getenv(name)})
+    report = {"config": config, "results": results}
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("Warning: baseline was recorded with a different configuration")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import asyncio
+import itertools
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Set
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from email_preprocessor import html_to_text
+
+# Emails are compared against what arrived in the last CAMPAIGN_WINDOW_SECONDS.
+CAMPAIGN_WINDOW_SECONDS = int(os.getenv("CAMPAIGN_WINDOW_SECONDS", "21600"))
+CAMPAIGN_INDEX_SIZE = int(os.getenv("CAMPAIGN_INDEX_SIZE", "50000"))
+# Estimated Jaccard similarity of word bigrams above which two emails are
+# copies of one campaign.
+CAMPAIGN_MIN_SIMILARITY = float(os.getenv("CAMPAIGN_MIN_SIMILARITY", "0.7"))
+# Shorter emails carry too little text to tell templates apart.
+CAMPAIGN_MIN_TOKENS = int(os.getenv("CAMPAIGN_MIN_TOKENS", "20"))
+# Campaigns a user received fewer copies of than this are not shown to them.
+CAMPAIGN_MIN_EMAILS = int(os.getenv("CAMPAIGN_MIN_EMAILS", "3"))
+
+CAMPAIGN_REASONING_PREFIX = "Campaign match"
+# Only the start of a body is hashed; templates diverge early if at all.
+SIGNATURE_TEXT_CHARS = 4000
+# 16 bands of 4 rows make pairs at 0.7 similarity candidates 99% of the
+# time and pairs at 0.3 about 12% of the time.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+# Per LSH bucket, only the newest candidates are compared.
+MAX_BUCKET_CANDIDATES = 64
+MAX_SENDER_DOMAINS = 10
+
+_word_re = re.compile(r"\w+")
+_digits_re = re.compile(r"\d+")
+_url_re = re.compile(r"https?://[^\s<>\"')\]]+")
+# Multiply-shift hash functions; fixed seed so signatures are comparable
+# across restarts.
+_random = np.random.default_rng(20240601)
+_MULTIPLIERS = _random.integers(1, 2 ** 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _random.integers(0, 2 ** 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _text_for_signature(subject: str, body: str) -> str:
+    body = body or ""
+    if "<" in body and ">" in body:
+        body = html_to_text(body)[0]
+    # Link paths and digit runs are per-recipient tracking tokens, codes and
+    # order numbers.
+    text = _url_re.sub(lambda match: urlsplit(match.group()).hostname or "", f"{subject or ''}\n{body}")
+    return _digits_re.sub("0", text[:SIGNATURE_TEXT_CHARS].lower())
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """MinHash signature of the word bigrams in text, or None for too little text."""
+    words = _word_re.findall(text)
+    if len(words) < CAMPAIGN_MIN_TOKENS:
+        return None
+    shingles = {f"{first} {second}" for first, second in zip(words, words[1:])}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    # uint64 arithmetic wraps, which is what multiply-shift hashing wants.
+    return ((hashes[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)).min(axis=0)
+
+
+class CampaignRecipient:
+    """One user's copies of a campaign; users only ever see their own."""
+
+    def __init__(self):
+        self.emails = 0
+        self.subject: Optional[str] = None
+        self.temp_email_ids: Set[int] = set()
+        self.sender_domains: List[str] = []
+        self.first_seen = datetime.utcnow()
+        self.last_seen = self.first_seen
+
+    def add(self, subject: str, temp_email_id: int, domain: str):
+        self.emails += 1
+        self.subject = subject
+        self.temp_email_ids.add(temp_email_id)
+        if domain and domain not in self.sender_domains and len(self.sender_domains) < MAX_SENDER_DOMAINS:
+            self.sender_domains.append(domain)
+        self.last_seen = datetime.utcnow()
+
+
+class Campaign:
+    def __init__(self, campaign_id: int, purpose: Optional[str], now: float):
+        self.id = campaign_id
+        self.purpose = purpose
+        self.updated_at = now
+        self.emails = 0
+        self.recipients: Dict[int, CampaignRecipient] = {}
+        self.decision: Optional[Dict[str, Any]] = None
+        self.pending: Optional[asyncio.Future] = None
+
+    def summary(self, user_id: int) -> Dict[str, Any]:
+        recipient = self.recipients[user_id]
+        return {
+            "id": self.id,
+            "subject": recipient.subject,
+            "emails": recipient.emails,
+            "addresses": len(recipient.temp_email_ids),
+            "sender_domains": list(recipient.sender_domains),
+            # The decision reused for this user's copies.
+            "action": self.decision["action"] if self.decision else None,
+            "first_seen": recipient.first_seen,
+            "last_seen": recipient.last_seen
+        }
+
+
+class CampaignMatch:
+    def __init__(self, campaign: Campaign, recipient: CampaignRecipient, similarity: Optional[float]):
+        self.campaign = campaign
+        self.recipient = recipient
+        self.similarity = similarity  # None for the first email of a campaign
+        # Set when this email is the one asking the model for the campaign.
+        self.pending: Optional[asyncio.Future] = None
+
+
+class _Entry(NamedTuple):
+    id: int
+    signature: np.ndarray
+    campaign: Campaign
+    added_at: float
+
+
+class CampaignIndex:
+    """Groups near-duplicate inbound mail into campaigns.
+
+    Each email gets a MinHash signature, and locality-sensitive hashing on
+    bands of it finds earlier emails likely to be similar; those are then
+    compared on the full signature. Only mail from the last
+    CAMPAIGN_WINDOW_SECONDS is indexed. The first model decision made for a
+    campaign is reused for the rest of it, and copies arriving while that
+    decision is in flight wait for it instead of asking again.
+
+    The index lives in process memory, like the classification cache.
+    """
+
+    def __init__(self, window_seconds: int = CAMPAIGN_WINDOW_SECONDS, max_entries: int = CAMPAIGN_INDEX_SIZE,
+                 min_similarity: float = CAMPAIGN_MIN_SIMILARITY):
+        self.window = window_seconds
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self._entries: Deque[_Entry] = deque()
+        self._buckets: Dict[tuple, Dict[int, _Entry]] = {}
+        self._campaigns: "OrderedDict[int, Campaign]" = OrderedDict()
+        self._campaign_ids = itertools.count(1)
+        self._entry_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.matches = 0
+        self.reused = 0
+        self.waited = 0
+
+    def observe(self, sender_email: str, subject: str, body: str, purpose: Optional[str],
+                user_id: int, temp_email_id: int) -> Optional[CampaignMatch]:
+        """Index an inbound email and return the campaign it belongs to."""
+        signature = minhash(_text_for_signature(subject, body))
+        if signature is None:
+            return None
+        purpose = (purpose or "").strip().lower() or None
+        now = time.monotonic()
+        domain = (sender_email or "").rsplit("@", 1)[-1].strip("> ").lower()
+
+        with self._lock:
+            self._expire(now)
+            best, similarity = self._nearest(signature, purpose)
+            if best is None:
+                campaign = Campaign(next(self._campaign_ids), purpose, now)
+                self._campaigns[campaign.id] = campaign
+            else:
+                campaign = best.campaign
+                self.matches += 1
+            if similarity != 1.0 or best.added_at < now - self.window / 2:
+                # Exact repeats only refresh the entry before it ages out.
+                self._add(_Entry(next(self._entry_ids), signature, campaign, now))
+
+            campaign.emails += 1
+            campaign.updated_at = now
+            recipient = campaign.recipients.get(user_id)
+            if recipient is None:
+                recipient = campaign.recipients[user_id] = CampaignRecipient()
+            recipient.add(subject, temp_email_id, domain)
+            self._campaigns.move_to_end(campaign.id)
+        return CampaignMatch(campaign, recipient, similarity)
+
+    async def reuse(self, match: Optional[CampaignMatch], deadline: float) -> Optional[Dict[str, Any]]:
+        """The campaign's decision, waiting for one in flight if need be.
+
+        None means the caller should classify the email itself and report
+        the outcome with record().
+        """
+        if match is None:
+            return None
+        campaign = match.campaign
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            decision = campaign.decision
+            pending = campaign.pending
+            if decision is None and (pending is None or pending.done() or pending.get_loop() is not loop):
+                match.pending = campaign.pending = loop.create_future()
+                return None
+
+        if decision is None:
+            with self._lock:
+                self.waited += 1
+            try:
+                decision = await asyncio.wait_for(asyncio.shield(pending), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                return None
+            if decision is None:
+                return None
+
+        with self._lock:
+            self.reused += 1
+        return {
+            "action": decision["action"],
+            "confidence": decision["confidence"],
+            # The log is the user's, so it counts only their copies.
+            "reasoning": f"{CAMPAIGN_REASONING_PREFIX} (#{campaign.id}, {match.recipient.emails} similar emails): "
+                         f"{decision['reasoning']}"
+        }
+
+    def record(self, match: Optional[CampaignMatch], result: Optional[Dict[str, Any]]):
+        """Report how an email that reuse() let through was classified."""
+        if match is None:
+            return
+        campaign = match.campaign
+        with self._lock:
+            if result and not result.get("degraded") and campaign.decision is None:
+                campaign.decision = {
+                    "action": result["action"],
+                    "confidence": result.get("confidence"),
+                    "reasoning": result.get("reasoning")
+                }
+            if campaign.pending is match.pending:
+                campaign.pending = None
+        if match.pending is not None and not match.pending.done():
+            # Waiters classify for themselves if this one failed.
+            match.pending.set_result(campaign.decision)
+
+    def campaigns_for_user(self, user_id: int, min_emails: int = CAMPAIGN_MIN_EMAILS) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._expire(time.monotonic())
+            campaigns = [
+                campaign.summary(user_id) for campaign in self._campaigns.values()
+                if user_id in campaign.recipients and campaign.recipients[user_id].emails >= min_emails
+            ]
+        campaigns.sort(key=lambda campaign: campaign["last_seen"], reverse=True)
+        return campaigns
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "window_seconds": self.window,
+                "min_similarity": self.min_similarity,
+                "indexed": len(self._entries),
+                "campaigns": len(self._campaigns),
+                "multi_email_campaigns": sum(1 for campaign in self._campaigns.values() if campaign.emails > 1),
+                "matches": self.matches,
+                "reused_decisions": self.reused,
+                "waited_for_decision": self.waited
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._campaigns.clear()
+
+    @staticmethod
+    def _band_keys(signature: np.ndarray):
+        return [(band, rows.tobytes()) for band, rows in enumerate(np.split(signature, LSH_BANDS))]
+
+    def _nearest(self, signature: np.ndarray, purpose: Optional[str]):
+        best, best_similarity = None, None
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            for entry in itertools.islice(reversed(bucket.values()), MAX_BUCKET_CANDIDATES):
+                # The model is told the address's purpose, so its decision
+                # only carries over between addresses with the same one.
+                if entry.campaign.purpose != purpose:
+                    continue
+                similarity = float(np.count_nonzero(entry.signature == signature)) / MINHASH_PERMUTATIONS
+                if similarity >= self.min_similarity and (best_similarity is None or similarity > best_similarity):
+                    best, best_similarity = entry, similarity
+                    if similarity == 1.0:
+                        return best, similarity
+        return best, best_similarity
+
+    def _add(self, entry: _Entry):
+        self._entries.append(entry)
+        for key in self._band_keys(entry.signature):
+            self._buckets.setdefault(key, {})[entry.id] = entry
+        while len(self._entries) > self.max_entries:
+            self._remove(self._entries.popleft())
+
+    def _remove(self, entry: _Entry):
+        for key in self._band_keys(entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.pop(entry.id, None)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _expire(self, now: float):
+        cutoff = now - self.window
+        while self._entries and self._entries[0].added_at < cutoff:
+            self._remove(self._entries.popleft())
+        while self._campaigns:
+            campaign = next(iter(self._campaigns.values()))
+            if campaign.updated_at >= cutoff:
+                break
+            del self._campaigns[campaign.id]
+
+
+campaign_index = CampaignIndex()
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after failure_threshold consecutive failures.
+
+    While open, allow() refuses calls for reset_seconds; after that a single
+    probe is let through (half-open) and its outcome closes or re-opens the
+    circuit. Thread-safe, since calls are made from executor threads.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30, window: int = 500):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            self.state = "closed"
+
+    def record_failure(self, latency: float, error: str = None):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            self._latencies.append(latency)
+            self.consecutive_failures += 1
+            self.last_error = error
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    print(f"Circuit breaker '{self.name}' opened: {error}")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            state = self.state
+            if state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                state = "half_open"
+            return {
+                "state": state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_seconds": self.reset_seconds,
+                "times_opened": self.times_opened,
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+                "latency_ms": {
+                    "p50": _percentile(latencies, 0.50),
+                    "p95": _percentile(latencies, 0.95),
+                    "p99": _percentile(latencies, 0.99),
+                    "max": round(latencies[-1] * 1000, 1) if latencies else None
+                }
+            }
+
+
+def _percentile(ordered, fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai_classifier import AIEmailClassifier, ClassificationRequest, CLASSIFIER_TIMEOUT_SECONDS
+
+# Emails per completion call; 1 turns batching off.
+CLASSIFIER_BATCH_SIZE = max(1, int(os.getenv("CLASSIFIER_BATCH_SIZE", "8")))
+# How long the first email of a batch waits for company.
+CLASSIFIER_BATCH_WINDOW_MS = float(os.getenv("CLASSIFIER_BATCH_WINDOW_MS", "50"))
+
+
+class ClassificationBatcher:
+    """Groups concurrent classify() calls into classify_batch() requests.
+
+    A batch is sent once it holds max_size emails or window_ms after its first
+    email arrived, whichever comes first. Cache hits skip the batch entirely.
+    """
+
+    def __init__(self, classifier: AIEmailClassifier, run_blocking: Callable[..., Awaitable[Any]],
+                 max_size: int = CLASSIFIER_BATCH_SIZE, window_ms: float = CLASSIFIER_BATCH_WINDOW_MS):
+        self.classifier = classifier
+        self.run_blocking = run_blocking
+        self.max_size = max_size
+        self.window = window_ms / 1000
+        self._pending: List[Tuple[ClassificationRequest, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_emails = 0
+
+    async def classify(self, sender_email: str, subject: str, body: str, temp_email_purpose: str = None,
+                       headers: str = None, deadline: float = None) -> Dict[str, Any]:
+        """deadline is a time.monotonic() value. The result is degraded rather
+        than late, even if the upstream call itself hangs."""
+        deadline = deadline or time.monotonic() + CLASSIFIER_TIMEOUT_SECONDS
+        if self.max_size == 1:
+            work = self.run_blocking(self.classifier.classify_email, sender_email, subject, body,
+                                     temp_email_purpose, headers, deadline)
+        else:
+            work = self._classify_batched(sender_email, subject, body, temp_email_purpose, headers, deadline)
+        try:
+            return await asyncio.wait_for(work, timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            return self.classifier.degraded_result("deadline exceeded")
+
+    async def _classify_batched(self, sender_email: str, subject: str, body: str, temp_email_purpose: str,
+                                headers: str, deadline: float) -> Dict[str, Any]:
+        # The cache lookup can hit the database, so it runs off the loop too.
+        request, cached = await self.run_blocking(self._lookup, sender_email, subject, body,
+                                                  temp_email_purpose, headers)
+        if cached:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future, deadline))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "window_ms": self.window * 1000,
+                "batches": self.batches,
+                "avg_batch_size": round(self.batched_emails / self.batches, 2) if self.batches else 0.0
+            }
+
+    def _lookup(self, *args) -> Tuple[ClassificationRequest, Optional[Dict[str, Any]]]:
+        request = self.classifier.prepare_request(*args)
+        return request, self.classifier.cache.get(request.cache_key)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[ClassificationRequest, asyncio.Future, float]]):
+        with self._lock:
+            self.batches += 1
+            self.batched_emails += len(batch)
+        try:
+            results = await self.run_blocking(
+                self.classifier.classify_batch, [request for request, _, _ in batch], check_cache=False,
+                deadline=min(deadline for _, _, deadline in batch)
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
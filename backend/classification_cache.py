@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import ClassificationCacheEntry
+
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "10000"))
+CLASSIFICATION_CACHE_TTL = int(os.getenv("CLASSIFICATION_CACHE_TTL", "3600"))
+CLASSIFICATION_CACHE_PERSISTENT = os.getenv("CLASSIFICATION_CACHE_PERSISTENT", "false").lower() == "true"
+# The classifier fingerprints the preprocessed body, which the token budget
+# already keeps short; this only bounds hashing for other callers.
+FINGERPRINT_BODY_CHARS = 4000
+
+_whitespace_re = re.compile(r"\s+")
+_digits_re = re.compile(r"\d+")
+
+
+def _normalize(value: Optional[str]) -> str:
+    # Digit runs are order numbers, codes and dates that vary between copies
+    # of the same template.
+    value = _digits_re.sub("#", (value or "").lower())
+    return _whitespace_re.sub(" ", value).strip()
+
+
+def fingerprint(sender_email: str, subject: str, body: str, temp_email_purpose: str = None) -> str:
+    parts = [
+        _normalize(sender_email),
+        _normalize(subject),
+        _normalize((body or "")[:FINGERPRINT_BODY_CHARS]),
+        _normalize(temp_email_purpose)
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ClassificationCache:
+    def __init__(self, max_entries: int = CLASSIFICATION_CACHE_SIZE, ttl_seconds: int = CLASSIFICATION_CACHE_TTL,
+                 persistent: bool = CLASSIFICATION_CACHE_PERSISTENT):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(result)
+                del self._entries[key]
+
+        result = self._get_persistent(key) if self.persistent else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+            self._put(key, result, now)
+        return dict(result)
+
+    def set(self, key: str, result: Dict[str, Any]):
+        result = {
+            "action": result["action"],
+            "confidence": result.get("confidence"),
+            "reasoning": result.get("reasoning")
+        }
+        with self._lock:
+            self._put(key, result, time.monotonic())
+        if self.persistent:
+            self._set_persistent(key, result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.persistent,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0
+            }
+
+    def purge_expired_chunk(self, db: Session, chunk_size: int) -> int:
+        """Delete up to chunk_size persisted entries older than the TTL in one transaction."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        fingerprints = [
+            key for (key,) in db.query(ClassificationCacheEntry.fingerprint).filter(
+                ClassificationCacheEntry.created_at < cutoff
+            ).limit(chunk_size)
+        ]
+        if not fingerprints:
+            return 0
+        # Entries rewritten since they were selected are fresh again.
+        purged = db.query(ClassificationCacheEntry).filter(
+            ClassificationCacheEntry.fingerprint.in_(fingerprints),
+            ClassificationCacheEntry.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return purged
+
+    def _put(self, key: str, result: Dict[str, Any], now: float):
+        self._entries[key] = (now + self.ttl_seconds, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get_persistent(self, key: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            entry = db.query(ClassificationCacheEntry).filter(
+                ClassificationCacheEntry.fingerprint == key,
+                ClassificationCacheEntry.created_at >= datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            ).first()
+            if not entry:
+                return None
+            return {"action": entry.action, "confidence": entry.confidence, "reasoning": entry.reasoning}
+        except Exception as e:
+            print(f"Classification cache read error: {str(e)}")
+            return None
+        finally:
+            db.close()
+
+    def _set_persistent(self, key: str, result: Dict[str, Any]):
+        db = SessionLocal()
+        try:
+            db.merge(ClassificationCacheEntry(
+                fingerprint=key,
+                action=result["action"],
+                confidence=result["confidence"],
+                reasoning=result["reasoning"],
+                created_at=datetime.utcnow()
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Classification cache write error: {str(e)}")
+        finally:
+            db.close()
+
+
+classification_cache = ClassificationCache()
@@ -0,0 +1,145 @@
+import argparse
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import EmailLog, TempEmail, TempEmailStats, User, UserStats
+
+# EmailLog.action_taken -> counter column on both stats tables.
+ACTION_COLUMNS = {
+    "forward": "emails_forwarded",
+    "delete": "emails_deleted",
+    "quarantine": "emails_quarantined",
+    "failed": "emails_failed",
+}
+
+
+def increment(db: Session, model, key: Dict[str, Any], deltas: Dict[str, float], extra: Dict = None):
+    # Relative UPDATEs so concurrent writers never lose each other's counts.
+    values = {getattr(model, column): getattr(model, column) + delta for column, delta in deltas.items()}
+    values.update({getattr(model, column): value for column, value in (extra or {}).items()})
+    updated = db.query(model).filter_by(**key).update(values, synchronize_session=False)
+    if updated:
+        return
+
+    # Stats rows are created alongside users and temp emails, so for them
+    # this only runs on data that predates the stats tables. Counter rows
+    # keyed by something else (like a sender) start here.
+    try:
+        with db.begin_nested():
+            db.add(model(**key, **deltas, **(extra or {})))
+    except IntegrityError:
+        db.query(model).filter_by(**key).update(values, synchronize_session=False)
+
+
+def record_email_log(db: Session, user_id: int, temp_email_id: int, action: str, count: int = 1):
+    """Count an EmailLog write. Call before the commit that inserts the log."""
+    record_email_logs(db, {(user_id, temp_email_id, action): count})
+
+
+def record_email_logs(db: Session, counts: Dict[Tuple[int, int, str], int]):
+    """Count many EmailLog writes, keyed by (user_id, temp_email_id, action)."""
+    now = datetime.utcnow()
+    per_user = {}
+    for (user_id, temp_email_id, action), count in counts.items():
+        column = ACTION_COLUMNS.get(action)
+        if column is None:
+            continue
+        increment(db, TempEmailStats, {"temp_email_id": temp_email_id}, {column: count},
+                   {"user_id": user_id, "last_email_at": now})
+        user_deltas = per_user.setdefault(user_id, {})
+        user_deltas[column] = user_deltas.get(column, 0) + count
+
+    for user_id, deltas in per_user.items():
+        increment(db, UserStats, {"user_id": user_id}, deltas, {"updated_at": now})
+
+
+def record_email_log_changed(db: Session, user_id: int, temp_email_id: int, old_action: str, new_action: str):
+    """Move a logged email from one action's counter to another's, e.g. a
+    forward the outbox gave up on."""
+    deltas = {}
+    for action, delta in ((old_action, -1), (new_action, 1)):
+        column = ACTION_COLUMNS.get(action)
+        if column is not None:
+            deltas[column] = deltas.get(column, 0) + delta
+    if not deltas:
+        return
+    increment(db, TempEmailStats, {"temp_email_id": temp_email_id}, deltas, {"user_id": user_id})
+    increment(db, UserStats, {"user_id": user_id}, deltas, {"updated_at": datetime.utcnow()})
+
+
+def record_temp_emails_created(db: Session, user_id: int, count: int = 1):
+    increment(db, UserStats, {"user_id": user_id}, {"total_temp_emails": count, "active_temp_emails": count},
+               {"updated_at": datetime.utcnow()})
+
+
+def record_temp_emails_deactivated(db: Session, user_id: int, count: int = 1):
+    increment(db, UserStats, {"user_id": user_id}, {"active_temp_emails": -count},
+               {"updated_at": datetime.utcnow()})
+
+
+def rebuild_stats(db: Session) -> int:
+    """Recompute both stats tables from users, temp_emails and email_logs."""
+    db.query(TempEmailStats).delete(synchronize_session=False)
+    db.query(UserStats).delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    user_rows = {user_id: UserStats(user_id=user_id, updated_at=now) for (user_id,) in db.query(User.id)}
+
+    for user_id, total, active in db.query(
+        TempEmail.user_id,
+        func.count(TempEmail.id),
+        func.sum(case((TempEmail.is_active == True, 1), else_=0))
+    ).group_by(TempEmail.user_id):
+        if user_id in user_rows:
+            user_rows[user_id].total_temp_emails = total
+            user_rows[user_id].active_temp_emails = active or 0
+
+    temp_email_rows = {}
+    for temp_email_id, user_id, action, count, last_email_at in db.query(
+        EmailLog.temp_email_id,
+        TempEmail.user_id,
+        EmailLog.action_taken,
+        func.count(EmailLog.id),
+        func.max(EmailLog.created_at)
+    ).join(TempEmail, TempEmail.id == EmailLog.temp_email_id).group_by(
+        EmailLog.temp_email_id, TempEmail.user_id, EmailLog.action_taken
+    ):
+        column = ACTION_COLUMNS.get(action)
+        if column is None:
+            continue
+        row = temp_email_rows.setdefault(temp_email_id, TempEmailStats(temp_email_id=temp_email_id, user_id=user_id))
+        setattr(row, column, (getattr(row, column) or 0) + count)
+        if row.last_email_at is None or (last_email_at and last_email_at > row.last_email_at):
+            row.last_email_at = last_email_at
+        if user_id in user_rows:
+            setattr(user_rows[user_id], column, (getattr(user_rows[user_id], column) or 0) + count)
+
+    db.add_all(user_rows.values())
+    db.add_all(temp_email_rows.values())
+    db.commit()
+    return len(user_rows)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+    from models import Base
+
+    parser = argparse.ArgumentParser(description="Maintain the dashboard stats tables")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist.
+    for index in EmailLog.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        users = rebuild_stats(db)
+        print(f"Rebuilt dashboard stats for {users} users")
+    finally:
+        db.close()
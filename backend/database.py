@@ -1,17 +1,55 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./email_router.db")
+# Defaults to DATABASE_URL with the matching async driver (aiosqlite/asyncpg).
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _engine_options(url: str) -> dict:
+    if _is_sqlite(url):
+        options = {"connect_args": {"check_same_thread": False}}
+        # In-memory databases live in a single connection, so they keep
+        # SQLAlchemy's default singleton pool.
+        if ":memory:" in url or url.rstrip("/").endswith(":"):
+            return options
+    else:
+        options = {"pool_pre_ping": True}
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE
+    )
+    return options
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer, and busy_timeout makes
+    # a second writer wait for the lock instead of failing with "database is
+    # locked". synchronous=NORMAL is durable under WAL except on power loss.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+if _is_sqlite(DATABASE_URL):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -22,4 +60,45 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def _async_url(url: str) -> str:
+    if ASYNC_DATABASE_URL:
+        return ASYNC_DATABASE_URL
+    scheme, _, rest = url.partition("://")
+    if scheme == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme in ("postgresql", "postgres", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_engine():
+    # Created on first use so deployments that never touch the async path do
+    # not need an async driver installed.
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = _async_url(DATABASE_URL)
+        options = _engine_options(url)
+        options.pop("connect_args", None)
+        if _is_sqlite(url) and "pool_size" in options:
+            # aiosqlite defaults to NullPool, which reconnects (and re-runs
+            # the pragmas) for every session.
+            options["poolclass"] = AsyncAdaptedQueuePool
+        _async_engine = create_async_engine(url, **options)
+        if _is_sqlite(url):
+            event.listen(_async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+def get_async_sessionmaker():
+    get_async_engine()
+    return _AsyncSessionLocal
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
@@ -0,0 +1,281 @@
+import math
+import os
+import re
+import threading
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Tokens of email body (plus links and signals) sent to the classifier.
+CLASSIFIER_BODY_TOKEN_BUDGET = int(os.getenv("CLASSIFIER_BODY_TOKEN_BUDGET", "200"))
+CLASSIFIER_MAX_LINKS = int(os.getenv("CLASSIFIER_MAX_LINKS", "5"))
+
+_SKIPPED_TAGS = {"script", "style", "head", "noscript", "template", "svg"}
+_VOID_TAGS = {"br", "img", "hr", "meta", "input", "link", "col", "source", "wbr", "area", "base"}
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6",
+    "blockquote", "section", "article", "header", "footer", "hr", "td"
+}
+
+_token_re = re.compile(r"\w+|[^\w\s]")
+_whitespace_re = re.compile(r"[ \t\r\f\v\u00a0\u200b\u200c\u200d\u034f]+")
+_blank_lines_re = re.compile(r"\n\s*\n+")
+_url_re = re.compile(r"https?://[^\s<>\"')\]]+")
+
+# A reply header ends the new part of a message; everything below it is the
+# quoted thread.
+_reply_header_re = re.compile(
+    r"^(on .{0,200} wrote:|-{2,}\s*original message\s*-{2,}|-{2,}\s*forwarded message\s*-{2,}|from: .+ sent: .+)$",
+    re.IGNORECASE
+)
+_signature_re = re.compile(r"^(-- ?|sent from my \w+.*|get outlook for \w+.*)$", re.IGNORECASE)
+# Outlook puts a rule of underscores above the quoted message's From: line.
+# Anywhere else an underscore rule is just a divider inside the message.
+_underscore_rule_re = re.compile(r"^_{2,}$")
+_boilerplate_re = re.compile(
+    r"unsubscribe|view (this email |it )?in (your |a )?browser|manage (your )?(email )?preferences|"
+    r"privacy policy|all rights reserved|©|\(c\) \d{4}|you are receiving this|"
+    r"you received this|this email was sent to|update your preferences|add us to your address book",
+    re.IGNORECASE
+)
+
+
+class PreparedEmail(NamedTuple):
+    body: str
+    links: Tuple[str, ...]
+    signals: Tuple[str, ...]
+    raw_tokens: int
+    prompt_tokens: int
+
+    def render(self) -> str:
+        sections = []
+        if self.signals:
+            sections.append("Signals: " + "; ".join(self.signals))
+        if self.links:
+            sections.append("Links: " + "; ".join(self.links))
+        sections.append("Body: " + (self.body or "(empty)"))
+        return "\n".join(sections)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: long words split every ~4 characters and each
+    punctuation mark is a token of its own."""
+    if not text:
+        return 0
+    return sum(math.ceil(len(token) / 4) for token in _token_re.findall(text))
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.links: List[Tuple[str, str]] = []
+        self.tracking_pixels = 0
+        self._skip_depth = 0
+        self._hidden_depth = 0
+        self._href: Optional[str] = None
+        self._anchor_text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+            return
+        attributes = dict(attrs)
+        style = (attributes.get("style") or "").replace(" ", "").lower()
+        if self._hidden_depth or "display:none" in style:
+            # Hidden preheaders are filler for inbox previews.
+            if tag not in _VOID_TAGS:
+                self._hidden_depth += 1
+            return
+        if tag == "img":
+            if attributes.get("width") in ("0", "1") or attributes.get("height") in ("0", "1"):
+                self.tracking_pixels += 1
+            elif attributes.get("alt"):
+                self.parts.append(f" {attributes['alt']} ")
+        elif tag == "a" and attributes.get("href"):
+            self._href = attributes["href"]
+            self._anchor_text = []
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._hidden_depth:
+            # Void tags never opened a level (see handle_starttag).
+            if tag not in _VOID_TAGS:
+                self._hidden_depth -= 1
+            return
+        if tag == "a" and self._href is not None:
+            self.links.append((self._href, " ".join("".join(self._anchor_text).split())))
+            self._href = None
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_depth or self._hidden_depth:
+            return
+        self.parts.append(data)
+        if self._href is not None:
+            self._anchor_text.append(data)
+
+
+def html_to_text(html: str) -> Tuple[str, List[Tuple[str, str]], int]:
+    """Returns (text, [(href, anchor text)], tracking pixel count)."""
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception:
+        # html.parser is lenient, but fall back to a crude strip rather than
+        # losing the email.
+        return re.sub(r"<[^>]*>", " ", html), [], 0
+    return "".join(extractor.parts), extractor.links, extractor.tracking_pixels
+
+
+def _quoted_header_follows(lines: List[str], start: int) -> bool:
+    for line in lines[start:]:
+        if line.strip():
+            return line.strip().lower().startswith("from:")
+    return False
+
+
+def strip_quoted_and_signature(text: str) -> str:
+    kept = []
+    lines = text.split("\n")
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if _reply_header_re.match(stripped) or _signature_re.match(stripped):
+            break
+        if _underscore_rule_re.match(stripped) and _quoted_header_follows(lines, index + 1):
+            break
+        if stripped.startswith(">"):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _normalize(text: str) -> str:
+    text = _whitespace_re.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _blank_lines_re.sub("\n", text).strip()
+
+
+def _describe_link(href: str, anchor: str) -> Optional[str]:
+    # Only the host is kept: paths and query strings are per-recipient
+    # tracking tokens that cost tokens and defeat the classification cache.
+    parts = urlsplit(href)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    anchor = anchor[:60]
+    if not anchor or _boilerplate_re.search(anchor) or _url_re.fullmatch(anchor):
+        return host
+    return f"{anchor} ({host})"
+
+
+def _header_signals(headers: Optional[str]) -> List[str]:
+    if not headers:
+        return []
+    signals = []
+    lowered = headers.lower()
+    if "\nlist-unsubscribe:" in "\n" + lowered:
+        signals.append("bulk mail (List-Unsubscribe header)")
+    precedence = re.search(r"^precedence:\s*(\w+)", headers, re.IGNORECASE | re.MULTILINE)
+    if precedence and precedence.group(1).lower() in ("bulk", "list", "junk"):
+        signals.append(f"Precedence: {precedence.group(1).lower()}")
+    auto_submitted = re.search(r"^auto-submitted:\s*([\w-]+)", headers, re.IGNORECASE | re.MULTILINE)
+    if auto_submitted and auto_submitted.group(1).lower() != "no":
+        signals.append(f"Auto-Submitted: {auto_submitted.group(1).lower()}")
+    return signals
+
+
+def _fit_budget(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    used = 0
+    end = 0
+    for match in _token_re.finditer(text):
+        used += math.ceil(len(match.group()) / 4)
+        if used > budget:
+            break
+        end = match.end()
+    return text[:end].rstrip() + " ..."
+
+
+def prepare_email(body: str, headers: Optional[str] = None,
+                  budget: int = CLASSIFIER_BODY_TOKEN_BUDGET) -> PreparedEmail:
+    """Reduce an email body to the text, links and signals worth paying for."""
+    body = body or ""
+    raw_tokens = estimate_tokens(body)
+
+    links: List[Tuple[str, str]] = []
+    tracking_pixels = 0
+    if "<" in body and ">" in body:
+        text, links, tracking_pixels = html_to_text(body)
+    else:
+        text = body
+        links = [(url, "") for url in _url_re.findall(body)]
+        text = _url_re.sub(lambda match: urlsplit(match.group()).hostname or "", text)
+
+    text = strip_quoted_and_signature(text)
+    boilerplate = False
+    kept_lines = []
+    for line in text.split("\n"):
+        if _boilerplate_re.search(line):
+            boilerplate = True
+            continue
+        kept_lines.append(line)
+    text = _normalize("\n".join(kept_lines))
+
+    signals = _header_signals(headers)
+    if boilerplate:
+        signals.append("newsletter footer (unsubscribe/preferences text)")
+    if tracking_pixels:
+        signals.append("tracking pixel")
+
+    described = []
+    for href, anchor in links:
+        description = _describe_link(href, anchor)
+        if description and description not in described:
+            described.append(description)
+        if len(described) >= CLASSIFIER_MAX_LINKS:
+            break
+
+    prepared = PreparedEmail("", tuple(described), tuple(signals), raw_tokens, 0)
+    remaining = max(budget - estimate_tokens(prepared.render()), 0)
+    prepared = prepared._replace(body=_fit_budget(text, remaining))
+    prepared = prepared._replace(prompt_tokens=estimate_tokens(prepared.render()))
+    preprocessing_metrics.record(prepared)
+    return prepared
+
+
+class PreprocessingMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.emails = 0
+        self.raw_tokens = 0
+        self.prompt_tokens = 0
+
+    def record(self, prepared: PreparedEmail):
+        with self._lock:
+            self.emails += 1
+            self.raw_tokens += prepared.raw_tokens
+            self.prompt_tokens += prepared.prompt_tokens
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            emails = self.emails or 1
+            return {
+                "emails": self.emails,
+                "token_budget": CLASSIFIER_BODY_TOKEN_BUDGET,
+                "avg_raw_tokens": round(self.raw_tokens / emails, 1),
+                "avg_prompt_tokens": round(self.prompt_tokens / emails, 1),
+                "avg_tokens_saved": round((self.raw_tokens - self.prompt_tokens) / emails, 1)
+            }
+
+
+preprocessing_metrics = PreprocessingMetrics()
@@ -3,20 +3,25 @@ from sendgrid.helpers.mail import Mail
 import os
 from typing import Dict, Any
 
+# 'inline' sends through SendGrid while the webhook is processed; 'outbox'
+# writes the message to the outbound_emails table for OutboxSender.
+FORWARDING_MODE = os.getenv("FORWARDING_MODE", "inline")
+# Same setting as the outbox sender; the SDK client only takes the host.
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+
 class EmailService:
     def __init__(self):
-        self.sg = sendgrid.SendGridAPIClient(api_key=os.getenv('SENDGRID_API_KEY'))
+        self.sg = sendgrid.SendGridAPIClient(api_key=os.getenv('SENDGRID_API_KEY'), host=SENDGRID_API_URL.split("/v3/", 1)[0])
     
-    def forward_email(self, 
-                     original_sender: str, 
-                     original_subject: str, 
-                     original_body: str, 
-                     temp_email_address: str,
-                     user_main_email: str) -> bool:
-        try:
-            forwarded_subject = f"[Forwarded from {temp_email_address}] {original_subject}"
-            
-            forwarded_body = f"""
+    def build_forward_message(self,
+                              original_sender: str,
+                              original_subject: str,
+                              original_body: str,
+                              temp_email_address: str,
+                              user_main_email: str) -> Dict[str, Any]:
+        forwarded_subject = f"[Forwarded from {temp_email_address}] {original_subject}"
+        
+        forwarded_body = f"""
 This email was forwarded from your temporary email address: {temp_email_address}
 
 Original Sender: {original_sender}
@@ -28,12 +33,30 @@ Original Subject: {original_subject}
 ---
 This message was automatically forwarded by AI Email Router.
 """
+        
+        return {
+            "from_email": f"noreply@{os.getenv('DOMAIN', 'example.com')}",
+            "to_email": user_main_email,
+            "subject": forwarded_subject,
+            "html_content": forwarded_body.replace('\n', '<br>')
+        }
+    
+    def forward_email(self, 
+                     original_sender: str, 
+                     original_subject: str, 
+                     original_body: str, 
+                     temp_email_address: str,
+                     user_main_email: str) -> bool:
+        try:
+            forwarded = self.build_forward_message(
+                original_sender, original_subject, original_body, temp_email_address, user_main_email
+            )
             
             message = Mail(
-                from_email=f"noreply@{os.getenv('DOMAIN', 'example.com')}",
-                to_emails=user_main_email,
-                subject=forwarded_subject,
-                html_content=forwarded_body.replace('\n', '<br>')
+                from_email=forwarded["from_email"],
+                to_emails=forwarded["to_email"],
+                subject=forwarded["subject"],
+                html_content=forwarded["html_content"]
             )
             
             response = self.sg.send(message)
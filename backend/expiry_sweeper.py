@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from database import get_async_sessionmaker
+from models import TempEmail
+from routing_table import routing_table
+from classification_cache import classification_cache
+import dashboard_stats
+
+EXPIRY_SWEEP_INTERVAL = int(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+EXPIRY_SWEEP_CHUNK = int(os.getenv("EXPIRY_SWEEP_CHUNK", "500"))
+
+last_sweep: Dict[str, Any] = {
+    "finished_at": None, "swept": 0, "duration_ms": 0.0, "total_swept": 0,
+    "cache_purged": 0, "total_cache_purged": 0
+}
+
+
+def sweep_chunk(db: Session, chunk_size: int = EXPIRY_SWEEP_CHUNK) -> int:
+    """Deactivate up to chunk_size expired addresses in one short transaction."""
+    now = datetime.utcnow()
+    candidate_ids = [
+        temp_email_id for (temp_email_id,) in db.query(TempEmail.id).filter(
+            TempEmail.is_active == True,
+            TempEmail.expires_at < now
+        ).order_by(TempEmail.expires_at).limit(chunk_size)
+    ]
+    if not candidate_ids:
+        return 0
+
+    # Re-checking is_active means an address deactivated by hand in the
+    # meantime is neither flipped nor counted again.
+    statement = update(TempEmail).where(
+        TempEmail.id.in_(candidate_ids),
+        TempEmail.is_active == True
+    ).values(is_active=False)
+    if db.get_bind().dialect.update_returning:
+        swept = db.execute(statement.returning(TempEmail.user_id, TempEmail.address)).all()
+    else:
+        swept = db.query(TempEmail.user_id, TempEmail.address).filter(
+            TempEmail.id.in_(candidate_ids),
+            TempEmail.is_active == True
+        ).all()
+        db.execute(statement)
+
+    for user_id, count in Counter(user_id for user_id, _ in swept).items():
+        dashboard_stats.record_temp_emails_deactivated(db, user_id, count)
+    db.commit()
+
+    for _, address in swept:
+        routing_table.invalidate_address(address)
+    return len(swept)
+
+
+def sweep_expired(db: Session, chunk_size: int = EXPIRY_SWEEP_CHUNK) -> int:
+    total = 0
+    while True:
+        swept = sweep_chunk(db, chunk_size)
+        total += swept
+        if swept < chunk_size:
+            return total
+
+
+async def _run_in_chunks(Session, chunk_func, chunk_size: int) -> int:
+    # One transaction per chunk, yielding to the loop in between, so the
+    # write lock is never held for a whole backlog.
+    total = 0
+    while True:
+        async with Session() as db:
+            done = await db.run_sync(chunk_func, chunk_size)
+        total += done
+        if done < chunk_size:
+            return total
+        await asyncio.sleep(0)
+
+
+async def run_periodic_sweep(interval: int = EXPIRY_SWEEP_INTERVAL, chunk_size: int = EXPIRY_SWEEP_CHUNK):
+    Session = get_async_sessionmaker()
+    while True:
+        started = time.perf_counter()
+        total = 0
+        purged = 0
+        try:
+            total = await _run_in_chunks(Session, sweep_chunk, chunk_size)
+            if total:
+                print(f"Expiry sweep deactivated {total} addresses")
+            # Expired rows are never read again, but nothing else deletes them.
+            if classification_cache.persistent:
+                purged = await _run_in_chunks(Session, classification_cache.purge_expired_chunk, chunk_size)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Expiry sweep error: {str(e)}")
+        last_sweep.update(
+            finished_at=datetime.utcnow().isoformat(),
+            swept=total,
+            duration_ms=round((time.perf_counter() - started) * 1000, 3),
+            total_swept=last_sweep["total_swept"] + total,
+            cache_purged=purged,
+            total_cache_purged=last_sweep["total_cache_purged"] + purged
+        )
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Deactivate expired temp email addresses")
+    parser.add_argument("--chunk-size", type=int, default=EXPIRY_SWEEP_CHUNK)
+    args = parser.parse_args()
+
+    for index in TempEmail.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        print(f"Deactivated {sweep_expired(db, args.chunk_size)} expired addresses")
+    finally:
+        db.close()
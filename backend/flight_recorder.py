@@ -0,0 +1,190 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+# Requests slower than this are kept, newest FLIGHT_RECORDER_SIZE of them.
+FLIGHT_RECORDER_SLOW_MS = float(os.getenv("FLIGHT_RECORDER_SLOW_MS", "1000"))
+FLIGHT_RECORDER_SIZE = int(os.getenv("FLIGHT_RECORDER_SIZE", "50"))
+# Per request; beyond this only the count and total time are kept.
+FLIGHT_RECORDER_MAX_STATEMENTS = int(os.getenv("FLIGHT_RECORDER_MAX_STATEMENTS", "100"))
+SQL_TEXT_CHARS = 300
+
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar(
+    "flight_recorder_trace", default=None
+)
+
+
+class RequestTrace:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.status: Optional[int] = None
+        self.first_byte: Optional[float] = None
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # Statement text only: parameters carry mail content.
+        self.statements: List[Tuple[str, float]] = []
+        # name -> [count, total seconds, max seconds]
+        self.spans: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add_statement(self, statement: str, seconds: float):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+            if len(self.statements) < FLIGHT_RECORDER_MAX_STATEMENTS:
+                self.statements.append((statement[:SQL_TEXT_CHARS], seconds))
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [1, seconds, seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+                span[2] = max(span[2], seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "method": self.method,
+                "path": self.path,
+                "status": self.status,
+                "started_at": self.started_at,
+                "duration_ms": round(self.duration * 1000, 2),
+                "time_to_first_byte_ms": round(self.first_byte * 1000, 2) if self.first_byte is not None else None,
+                "sql": {
+                    "count": self.sql_count,
+                    "total_ms": round(self.sql_seconds * 1000, 2),
+                    "statements": [
+                        {"sql": statement, "duration_ms": round(seconds * 1000, 3)}
+                        for statement, seconds in self.statements
+                    ],
+                    "truncated": self.sql_count > len(self.statements)
+                },
+                # Concurrent emails in one request overlap, so span totals
+                # can exceed the request's duration.
+                "spans": {
+                    name: {"count": count, "total_ms": round(total * 1000, 2), "max_ms": round(longest * 1000, 2)}
+                    for name, (count, total, longest) in sorted(self.spans.items())
+                }
+            }
+
+
+class FlightRecorder:
+    """Keeps the recent requests that took longer than FLIGHT_RECORDER_SLOW_MS.
+
+    Every request gets a trace of its SQL statements (from engine events) and
+    of the pipeline stages timed with metrics timers; only slow ones are kept.
+    Work handed to executor threads is only seen through the stage that
+    awaits it.
+    """
+
+    def __init__(self, slow_ms: float = FLIGHT_RECORDER_SLOW_MS, size: int = FLIGHT_RECORDER_SIZE):
+        self.slow_seconds = slow_ms / 1000
+        self._traces: Deque[RequestTrace] = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.slow_requests = 0
+
+    def finish(self, trace: RequestTrace):
+        trace.duration = time.perf_counter() - trace.start
+        slow = trace.duration >= self.slow_seconds
+        with self._lock:
+            self.requests += 1
+            if slow:
+                self.slow_requests += 1
+                self._traces.append(trace)
+
+    def slowest(self, limit: int = FLIGHT_RECORDER_SIZE) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = sorted(self._traces, key=lambda trace: trace.duration, reverse=True)[:limit]
+        return [trace.to_dict() for trace in traces]
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "slow_ms": self.slow_seconds * 1000,
+                "requests": self.requests,
+                "slow_requests": self.slow_requests,
+                "kept": len(self._traces)
+            }
+
+
+flight_recorder = FlightRecorder()
+
+
+class FlightRecorderMiddleware:
+    """ASGI middleware tracing each HTTP request for the flight recorder."""
+
+    def __init__(self, app, recorder: FlightRecorder = flight_recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                trace.first_byte = time.perf_counter() - trace.start
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_trace.reset(token)
+            self.recorder.finish(trace)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_trace.get() is not None:
+        conn.info.setdefault("flight_recorder_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current_trace.get()
+    starts = conn.info.get("flight_recorder_start")
+    if trace is not None and starts:
+        trace.add_statement(statement, time.perf_counter() - starts.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute.
+    if (_current_trace.get() is not None and context.connection is not None
+            and context.connection.info.get("flight_recorder_start")):
+        context.connection.info["flight_recorder_start"].pop()
+
+
+def _record_timer(histogram, labels, seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span("/".join(labels) or histogram.name, seconds)
+
+
+metrics.timer_hooks.append(_record_timer)
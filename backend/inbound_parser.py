@@ -0,0 +1,298 @@
+import codecs
+import json
+import os
+import re
+from email.utils import getaddresses, parseaddr
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from multipart.multipart import MultipartParser, parse_options_header
+
+# Longest string kept from any inbound field (bodies, subjects, headers).
+# Anything past it is dropped while parsing, so it never reaches
+# classification or logging.
+INBOUND_MAX_FIELD_CHARS = int(os.getenv("INBOUND_MAX_FIELD_CHARS", "100000"))
+# Upper bound on one event after truncation; guards against payloads made of
+# many small fields instead of a few large ones.
+INBOUND_MAX_EVENT_CHARS = int(os.getenv("INBOUND_MAX_EVENT_CHARS", "1000000"))
+# Limits on a whole Inbound Parse request; past them it is rejected. SendGrid
+# accepts messages up to 30 MB, and a message has a few dozen parts at most.
+INBOUND_MAX_BODY_BYTES = int(os.getenv("INBOUND_MAX_BODY_BYTES", str(40 * 1024 * 1024)))
+INBOUND_MAX_PARTS = int(os.getenv("INBOUND_MAX_PARTS", "200"))
+MAX_PART_HEADER_BYTES = 8192
+
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_HIGH_SURROGATE = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}')
+_SURROGATE_PAIR = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}')
+
+
+class JsonArraySplitter:
+    """Incrementally splits a top-level JSON array of objects into the raw
+    text of each object, truncating long string values along the way.
+
+    feed() returns the objects completed by each chunk, so only the object
+    currently being read is ever buffered.
+    """
+
+    def __init__(self, max_string_chars: int = INBOUND_MAX_FIELD_CHARS,
+                 max_object_chars: int = INBOUND_MAX_EVENT_CHARS):
+        self.max_string_chars = max_string_chars
+        self.max_object_chars = max_object_chars
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._carry = ""
+        self._started = False
+        self._finished = False
+        self._parts: List[str] = []
+        self._size = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_chars = 0
+
+    def feed(self, chunk: bytes) -> List[str]:
+        text = self._carry + self._decoder.decode(chunk)
+        self._carry = ""
+        return self._consume(text)
+
+    def close(self) -> List[str]:
+        objects = self._consume(self._carry + self._decoder.decode(b"", final=True), final=True)
+        if not self._finished:
+            raise ValueError("Unterminated JSON array")
+        return objects
+
+    def _consume(self, text: str, final: bool = False) -> List[str]:
+        objects = []
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if self._finished:
+                if text[pos:].strip():
+                    raise ValueError("Unexpected data after JSON array")
+                return objects
+
+            if self._depth == 0:
+                char = text[pos]
+                pos += 1
+                if char.isspace():
+                    continue
+                if not self._started:
+                    if char != "[":
+                        raise ValueError("Expected a JSON array")
+                    self._started = True
+                elif char == "]":
+                    self._finished = True
+                elif char == "{":
+                    self._depth = 1
+                    self._append("{")
+                elif char != ",":
+                    raise ValueError("Expected a JSON object")
+                continue
+
+            if self._in_string:
+                match = _STRING_SPECIAL.search(text, pos)
+                end = match.start() if match else length
+                self._append_string(text[pos:end])
+                pos = end
+                if not match:
+                    continue
+                if text[pos] == '"':
+                    self._append('"')
+                    self._in_string = False
+                    pos += 1
+                    continue
+                # An escape is kept or dropped whole; a surrogate pair counts
+                # as one escape so truncation never splits it.
+                if _HIGH_SURROGATE.match(text, pos):
+                    if pos + 12 > length and not final:
+                        self._carry = text[pos:]
+                        return objects
+                    width = 12 if _SURROGATE_PAIR.match(text, pos) else 6
+                else:
+                    width = 6 if text[pos + 1:pos + 2] == "u" else 2
+                    if pos + width > length and not final:
+                        self._carry = text[pos:]
+                        return objects
+                self._append_string(text[pos:pos + width], chars=1)
+                pos += width
+                continue
+
+            match = _STRUCTURE.search(text, pos)
+            end = match.start() if match else length
+            self._append(text[pos:end])
+            pos = end
+            if not match:
+                continue
+            char = text[pos]
+            pos += 1
+            self._append(char)
+            if char == '"':
+                self._in_string = True
+                self._string_chars = 0
+            elif char in "{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    objects.append("".join(self._parts))
+                    self._parts = []
+                    self._size = 0
+        return objects
+
+    def _append(self, text: str):
+        if not text:
+            return
+        self._size += len(text)
+        if self._size > self.max_object_chars:
+            raise ValueError("Webhook event too large")
+        self._parts.append(text)
+
+    def _append_string(self, text: str, chars: Optional[int] = None):
+        chars = len(text) if chars is None else chars
+        room = self.max_string_chars - self._string_chars
+        if room <= 0:
+            return
+        if chars > room:
+            text = text[:room]
+            chars = room
+        self._string_chars += chars
+        self._append(text)
+
+
+async def iter_json_events(stream: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the objects of a JSON array request body as they arrive."""
+    splitter = JsonArraySplitter()
+    async for chunk in stream:
+        for raw in splitter.feed(chunk):
+            yield json.loads(raw)
+    for raw in splitter.close():
+        yield json.loads(raw)
+
+
+class InboundParseForm:
+    """A SendGrid Inbound Parse (multipart/form-data) request body.
+
+    Text fields are capped at INBOUND_MAX_FIELD_CHARS while streaming.
+    Attachment contents are discarded and only their metadata is kept. A
+    body with more than INBOUND_MAX_PARTS parts or INBOUND_MAX_BODY_BYTES
+    bytes raises ValueError.
+    """
+
+    def __init__(self, content_type: str):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("Missing multipart boundary")
+        self.fields: Dict[str, str] = {}
+        self.attachments: List[Dict[str, Any]] = []
+        self._raw_fields: Dict[str, bytearray] = {}
+        self._part: Dict[str, Any] = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._parts = 0
+        self._body_bytes = 0
+        # UTF-8 takes at most four bytes per character.
+        self._max_field_bytes = INBOUND_MAX_FIELD_CHARS * 4
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+        })
+
+    async def parse(self, stream: AsyncIterator[bytes]):
+        async for chunk in stream:
+            self._body_bytes += len(chunk)
+            if self._body_bytes > INBOUND_MAX_BODY_BYTES:
+                raise ValueError("Multipart body too large")
+            self._parser.write(chunk)
+        self._parser.finalize()
+
+        charsets = {}
+        try:
+            charsets = json.loads(bytes(self._raw_fields.get("charsets", b"")) or b"{}")
+        except ValueError:
+            pass
+        for name, data in self._raw_fields.items():
+            charset = charsets.get(name, "utf-8") if isinstance(charsets, dict) else "utf-8"
+            try:
+                value = bytes(data).decode(charset, errors="replace")
+            except LookupError:
+                value = bytes(data).decode("utf-8", errors="replace")
+            self.fields[name] = value[:INBOUND_MAX_FIELD_CHARS]
+        self._raw_fields.clear()
+        return self
+
+    def events(self) -> List[Dict[str, Any]]:
+        """One inbound event per envelope recipient, in the JSON webhook shape."""
+        envelope = {}
+        try:
+            envelope = json.loads(self.fields.get("envelope") or "{}")
+        except ValueError:
+            pass
+        if not isinstance(envelope, dict):
+            envelope = {}
+
+        recipients = envelope.get("to") or [address for _, address in getaddresses([self.fields.get("to", "")])]
+        # The header From is what rules and users recognise; the envelope
+        # sender is usually a bounce address.
+        sender = parseaddr(self.fields.get("from", ""))[1] or envelope.get("from") or ""
+        return [
+            {
+                "event": "inbound",
+                "to": [{"email": recipient}],
+                "from": sender,
+                "subject": self.fields.get("subject", ""),
+                "text": self.fields.get("text", ""),
+                "html": self.fields.get("html", ""),
+                "headers": self.fields.get("headers", ""),
+                "attachments": [dict(attachment) for attachment in self.attachments]
+            }
+            for recipient in recipients if recipient
+        ]
+
+    def _on_part_begin(self):
+        self._parts += 1
+        if self._parts > INBOUND_MAX_PARTS:
+            raise ValueError("Too many multipart parts")
+        self._part = {"headers": {}}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+        if len(self._header_name) > MAX_PART_HEADER_BYTES:
+            raise ValueError("Multipart header too large")
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+        if len(self._header_value) > MAX_PART_HEADER_BYTES:
+            raise ValueError("Multipart header too large")
+
+    def _on_header_end(self):
+        self._part["headers"][self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._part["headers"].get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        self._part["name"] = name
+        if b"filename" in options:
+            self._part["attachment"] = {
+                "name": name,
+                "filename": options[b"filename"].decode("utf-8", errors="replace"),
+                "content_type": self._part["headers"].get(b"content-type", b"").decode("latin-1"),
+                "size": 0
+            }
+            self.attachments.append(self._part["attachment"])
+        else:
+            self._raw_fields[name] = bytearray()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        attachment = self._part.get("attachment")
+        if attachment is not None:
+            attachment["size"] += end - start
+            return
+        buffer = self._raw_fields[self._part["name"]]
+        room = self._max_field_bytes - len(buffer)
+        if room > 0:
+            buffer += data[start:min(end, start + room)]
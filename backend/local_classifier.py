@@ -0,0 +1,274 @@
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import not_, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import EmailLog
+
+# 'off' disables the model, 'shadow' scores every email but still asks the
+# LLM and records agreement, 'active' skips the LLM when the model is sure.
+LOCAL_CLASSIFIER_MODE = os.getenv("LOCAL_CLASSIFIER_MODE", "off")
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.95"))
+LOCAL_CLASSIFIER_MIN_EXAMPLES = int(os.getenv("LOCAL_CLASSIFIER_MIN_EXAMPLES", "500"))
+LOCAL_CLASSIFIER_RETRAIN_INTERVAL = int(os.getenv("LOCAL_CLASSIFIER_RETRAIN_INTERVAL", "600"))
+LOCAL_CLASSIFIER_SNAPSHOT_PATH = os.getenv("LOCAL_CLASSIFIER_SNAPSHOT_PATH", "./local_classifier.npz")
+LOCAL_CLASSIFIER_FEATURE_BITS = int(os.getenv("LOCAL_CLASSIFIER_FEATURE_BITS", "18"))
+
+CLASSES = ("forward", "delete")
+LOCAL_REASONING_PREFIX = "Local classifier"
+# EmailLog only keeps a 200 character preview, so prediction looks at the
+# same slice of the body the model was trained on.
+BODY_CHARS = 200
+TRAINING_BATCH = 5000
+
+# Logs written by user rules, by this model, by the sender reputation index,
+# by campaign reuse or by the failure fallback say nothing about how the LLM
+# judges an email.
+_EXCLUDED_REASONING = (
+    "Matched user rule", LOCAL_REASONING_PREFIX, "AI classification failed", "Sender reputation", "Sender override",
+    "Campaign match"
+)
+
+_token_re = re.compile(r"[a-z0-9][a-z0-9'_-]{1,30}")
+
+
+def extract_features(sender_email: str, subject: str, body: str) -> List[str]:
+    sender = (sender_email or "").lower().strip()
+    features = [f"from:{sender}"]
+    if "@" in sender:
+        features.append(f"domain:{sender.rsplit('@', 1)[1].strip('> ')}")
+    features.extend(f"s:{token}" for token in _token_re.findall((subject or "").lower()))
+    features.extend(f"b:{token}" for token in _token_re.findall((body or "")[:BODY_CHARS].lower()))
+    return features
+
+
+class NaiveBayesModel:
+    """Multinomial naive Bayes over hashed token features."""
+
+    def __init__(self, feature_bits: int = LOCAL_CLASSIFIER_FEATURE_BITS, alpha: float = 1.0):
+        self.n_features = 1 << feature_bits
+        self.alpha = alpha
+        self.feature_counts = np.zeros((len(CLASSES), self.n_features), dtype=np.float64)
+        self.class_counts = np.zeros(len(CLASSES), dtype=np.float64)
+        self.last_log_id = 0
+        self._log_likelihood = None
+        self._log_prior = None
+
+    @property
+    def examples(self) -> int:
+        return int(self.class_counts.sum())
+
+    def hash_features(self, features: List[str]) -> np.ndarray:
+        # crc32 rather than hash(): snapshots must mean the same thing in
+        # every process.
+        mask = self.n_features - 1
+        return np.fromiter(
+            (zlib.crc32(feature.encode("utf-8")) & mask for feature in features),
+            dtype=np.int64,
+            count=len(features)
+        )
+
+    def partial_fit(self, features: List[str], action: str, weight: float = 1.0):
+        class_index = CLASSES.index(action)
+        np.add.at(self.feature_counts[class_index], self.hash_features(features), weight)
+        self.class_counts[class_index] += 1
+        self._log_likelihood = None
+
+    def copy(self) -> "NaiveBayesModel":
+        model = NaiveBayesModel(feature_bits=self.n_features.bit_length() - 1, alpha=self.alpha)
+        model.feature_counts = self.feature_counts.copy()
+        model.class_counts = self.class_counts.copy()
+        model.last_log_id = self.last_log_id
+        return model
+
+    def prepare(self):
+        """Compute the log probabilities predict() uses, if stale."""
+        if self._log_likelihood is None:
+            totals = self.feature_counts.sum(axis=1, keepdims=True)
+            self._log_likelihood = np.log(self.feature_counts + self.alpha) - np.log(totals + self.alpha * self.n_features)
+            self._log_prior = np.log((self.class_counts + 1) / (self.class_counts.sum() + len(CLASSES)))
+
+    def predict(self, features: List[str]) -> Dict[str, Any]:
+        self.prepare()
+        indices = self.hash_features(features)
+        scores = self._log_prior + self._log_likelihood[:, indices].sum(axis=1)
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return {"action": CLASSES[best], "confidence": float(probabilities[best])}
+
+    def save(self, path: str):
+        # A file of its own per save: workers sharing the snapshot path
+        # would otherwise write into each other's temporary file.
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", suffix=".tmp", delete=False) as f:
+            try:
+                np.savez_compressed(
+                    f,
+                    feature_counts=self.feature_counts,
+                    class_counts=self.class_counts,
+                    last_log_id=np.array([self.last_log_id]),
+                    alpha=np.array([self.alpha])
+                )
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: str) -> "NaiveBayesModel":
+        with np.load(path) as data:
+            model = cls(feature_bits=int(data["feature_counts"].shape[1]).bit_length() - 1, alpha=float(data["alpha"][0]))
+            model.feature_counts = data["feature_counts"].astype(np.float64)
+            model.class_counts = data["class_counts"].astype(np.float64)
+            model.last_log_id = int(data["last_log_id"][0])
+        return model
+
+
+class LocalClassifier:
+    def __init__(self, mode: str = LOCAL_CLASSIFIER_MODE, threshold: float = LOCAL_CLASSIFIER_THRESHOLD,
+                 snapshot_path: str = LOCAL_CLASSIFIER_SNAPSHOT_PATH):
+        self.mode = mode
+        self.threshold = threshold
+        self.snapshot_path = snapshot_path
+        self.model = NaiveBayesModel()
+        self._lock = threading.Lock()
+        self.local_decisions = 0
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+        self.shadow_confident = 0
+        self.shadow_confident_agreed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("shadow", "active")
+
+    def load_snapshot(self) -> bool:
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            model = NaiveBayesModel.load(self.snapshot_path)
+        except Exception as e:
+            print(f"Could not load local classifier snapshot: {str(e)}")
+            return False
+        model.prepare()
+        with self._lock:
+            self.model = model
+        return True
+
+    def retrain(self, db: Session) -> int:
+        """Fold EmailLog rows written since the last run into the model.
+
+        Training and the snapshot work on a copy; the lock is only held to
+        swap it in, so predict() never waits on either.
+        """
+        with self._lock:
+            model = self.model.copy()
+        trained = 0
+        while True:
+            last_log_id = model.last_log_id
+            rows = db.query(
+                EmailLog.id, EmailLog.sender_email, EmailLog.subject, EmailLog.body_preview,
+                EmailLog.action_taken, EmailLog.ai_confidence_score
+            ).filter(
+                EmailLog.id > last_log_id,
+                EmailLog.action_taken.in_(CLASSES),
+                not_(or_(*(EmailLog.ai_reasoning.like(f"{prefix}%") for prefix in _EXCLUDED_REASONING)))
+            ).order_by(EmailLog.id).limit(TRAINING_BATCH).all()
+
+            if not rows:
+                break
+
+            examples = [
+                (extract_features(row.sender_email, row.subject, row.body_preview), row.action_taken, row.ai_confidence_score)
+                for row in rows
+            ]
+            for features, action, confidence in examples:
+                model.partial_fit(features, action, weight=confidence if confidence is not None else 1.0)
+            model.last_log_id = rows[-1].id
+            trained += len(rows)
+
+        if trained:
+            model.prepare()
+            with self._lock:
+                self.model = model
+            # Published models are never modified, so this needs no lock.
+            model.save(self.snapshot_path)
+        return trained
+
+    def predict(self, sender_email: str, subject: str, body: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        features = extract_features(sender_email, subject, body)
+        with self._lock:
+            model = self.model
+        examples = model.examples
+        if examples < LOCAL_CLASSIFIER_MIN_EXAMPLES:
+            return None
+        prediction = model.predict(features)
+        prediction["reasoning"] = (
+            f"{LOCAL_REASONING_PREFIX}: {prediction['action']} with p={prediction['confidence']:.3f} "
+            f"(trained on {examples} emails)"
+        )
+        return prediction
+
+    def decide(self, prediction: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Return the prediction if it is confident enough to skip the LLM."""
+        if self.mode != "active" or not prediction or prediction["confidence"] < self.threshold:
+            return None
+        with self._lock:
+            self.local_decisions += 1
+        return prediction
+
+    def record_shadow(self, prediction: Optional[Dict[str, Any]], llm_result: Dict[str, Any]):
+        if not prediction or llm_result.get("action") not in CLASSES:
+            return
+        agreed = prediction["action"] == llm_result["action"]
+        with self._lock:
+            self.shadow_compared += 1
+            self.shadow_agreed += agreed
+            if prediction["confidence"] >= self.threshold:
+                self.shadow_confident += 1
+                self.shadow_confident_agreed += agreed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                "examples": self.model.examples,
+                "last_log_id": self.model.last_log_id,
+                "local_decisions": self.local_decisions,
+                "shadow_compared": self.shadow_compared,
+                "shadow_agreement": round(self.shadow_agreed / self.shadow_compared, 4) if self.shadow_compared else None,
+                "shadow_confident": self.shadow_confident,
+                "shadow_confident_agreement": (
+                    round(self.shadow_confident_agreed / self.shadow_confident, 4) if self.shadow_confident else None
+                )
+            }
+
+
+async def run_periodic_retraining(classifier: "LocalClassifier", interval: int = LOCAL_CLASSIFIER_RETRAIN_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        db = SessionLocal()
+        try:
+            trained = await loop.run_in_executor(None, classifier.retrain, db)
+            if trained:
+                print(f"Local classifier trained on {trained} new emails")
+        except Exception as e:
+            print(f"Local classifier retraining error: {str(e)}")
+        finally:
+            db.close()
+        await asyncio.sleep(interval)
+
+
+local_classifier = LocalClassifier()
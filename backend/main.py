@@ -1,18 +1,33 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 import uvicorn
+import asyncio
 import os
 from dotenv import load_dotenv
 
-from database import engine, get_db
-from models import Base
-from routers import auth, temp_emails, webhooks, dashboard
+from database import engine, get_db, SessionLocal
+from models import Base, ClassificationCacheEntry, EmailLog, OutboundEmail, TempEmail
+from routers import auth, temp_emails, webhooks, dashboard, admin
+from local_classifier import local_classifier, run_periodic_retraining
+from routing_table import routing_table
+from email_service import FORWARDING_MODE
+from ai_classifier import CLASSIFIER_DEGRADED_POLICY
+from outbox import outbox_sender
+from expiry_sweeper import run_periodic_sweep
+import metrics
+from flight_recorder import FlightRecorderMiddleware
+from password_hashing import password_hasher
 
 load_dotenv()
 
 Base.metadata.create_all(bind=engine)
+# create_all skips indexes on tables that already exist.
+for table in (TempEmail.__table__, EmailLog.__table__, ClassificationCacheEntry.__table__, OutboundEmail.__table__):
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 app = FastAPI(
     title="AI Email Router",
@@ -26,7 +41,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # The dashboard pages through email logs with this header.
+    expose_headers=["X-Next-Cursor"],
 )
+# Added last so it wraps everything, including CORS.
+app.add_middleware(FlightRecorderMiddleware)
 
 security = HTTPBearer()
 
@@ -34,6 +53,36 @@ app.include_router(auth.router, prefix="/api/auth", tags=["authentication"])
 app.include_router(temp_emails.router, prefix="/api/temp-emails", tags=["temp-emails"])
 app.include_router(webhooks.router, prefix="/api/webhooks", tags=["webhooks"])
 app.include_router(dashboard.router, prefix="/api/dashboard", tags=["dashboard"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"], include_in_schema=False)
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_workers():
+    db = SessionLocal()
+    try:
+        routing_table.warm(db)
+    finally:
+        db.close()
+    # The queue also holds mail deferred while the classifier is unavailable.
+    if webhooks.WEBHOOK_MODE == "queue" or CLASSIFIER_DEGRADED_POLICY == "queue":
+        webhooks.queue_workers.start()
+    if FORWARDING_MODE == "outbox":
+        outbox_sender.start()
+    background_tasks.append(asyncio.create_task(run_periodic_sweep()))
+    if local_classifier.enabled:
+        local_classifier.load_snapshot()
+        background_tasks.append(asyncio.create_task(run_periodic_retraining(local_classifier)))
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await webhooks.queue_workers.stop()
+    await outbox_sender.stop()
+    password_hasher.shutdown()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
 
 @app.get("/")
 async def root():
@@ -43,6 +92,10 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
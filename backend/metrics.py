@@ -0,0 +1,191 @@
+import bisect
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Off turns every update into a no-op; /metrics then only shows zeros.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Seconds. Stages range from a dict lookup to a model call near the deadline.
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Called as hook(histogram, labels, seconds) after every timed block, e.g. to
+# attach stage timings to the current request.
+timer_hooks: List[Callable[["Histogram", Tuple[str, ...], float], None]] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled metrics report zero before their first update.
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, *labels: str, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(*self.labels, value=elapsed)
+        for hook in timer_hooks:
+            hook(self.histogram, self.labels, elapsed)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, *labels: str, value: float):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(labels)
+            return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Inbound pipeline. Stages: lookup (address resolution), campaign (indexing),
+# rules, reputation, campaign_wait (for a decision shared by a campaign),
+# local_model, llm (batched model call, including waiting for a batch),
+# forward (SendGrid send or outbox message build) and commit (per email, or
+# per batch when writes are batched).
+INBOUND_STAGE_SECONDS = registry.register(Histogram(
+    "inbound_stage_duration_seconds", "Time spent per inbound pipeline stage.", ["stage"]
+))
+INBOUND_EMAIL_SECONDS = registry.register(Histogram(
+    "inbound_email_duration_seconds", "Time to process one inbound email, excluding the batch commit."
+))
+INBOUND_DECISIONS = registry.register(Counter(
+    "inbound_decisions_total", "Inbound emails by what decided their action.", ["source", "action"]
+))
+INBOUND_OUTCOMES = registry.register(Counter(
+    "inbound_outcomes_total", "Inbound emails by final outcome.", ["outcome"]
+))
+INBOUND_IN_FLIGHT = registry.register(Gauge(
+    "inbound_emails_in_flight", "Inbound emails currently being processed."
+))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -31,6 +31,11 @@ class TempEmail(Base):
     user = relationship("User", back_populates="temp_emails")
     email_logs = relationship("EmailLog", back_populates="temp_email")
 
+    __table_args__ = (
+        # Lets the expiry sweeper find expired active addresses without a scan.
+        Index("ix_temp_emails_is_active_expires_at", "is_active", "expires_at"),
+    )
+
 class EmailLog(Base):
     __tablename__ = "email_logs"
     
@@ -45,6 +50,11 @@ class EmailLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     temp_email = relationship("TempEmail", back_populates="email_logs")
+    
+    __table_args__ = (
+        Index("ix_email_logs_temp_email_id_created_at_id", "temp_email_id", "created_at", "id"),
+        Index("ix_email_logs_created_at_id", "created_at", "id"),
+    )
 
 class ForwardingRule(Base):
     __tablename__ = "forwarding_rules"
@@ -56,4 +66,105 @@ class ForwardingRule(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    user = relationship("User", back_populates="forwarding_rules")
\ No newline at end of file
+    user = relationship("User", back_populates="forwarding_rules")
+
+class InboundEvent(Base):
+    __tablename__ = "inbound_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String, unique=True, index=True, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # 'pending', 'processing', 'done', 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_inbound_events_status_available_at", "status", "available_at"),
+    )
+
+class ClassificationCacheEntry(Base):
+    __tablename__ = "classification_cache"
+    
+    fingerprint = Column(String, primary_key=True)
+    action = Column(String, nullable=False)
+    confidence = Column(Float, nullable=True)
+    reasoning = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_temp_emails = Column(Integer, nullable=False, default=0)
+    active_temp_emails = Column(Integer, nullable=False, default=0)
+    emails_forwarded = Column(Integer, nullable=False, default=0)
+    emails_deleted = Column(Integer, nullable=False, default=0)
+    emails_quarantined = Column(Integer, nullable=False, default=0)
+    emails_failed = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class TempEmailStats(Base):
+    __tablename__ = "temp_email_stats"
+    
+    temp_email_id = Column(Integer, ForeignKey("temp_emails.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    emails_forwarded = Column(Integer, nullable=False, default=0)
+    emails_deleted = Column(Integer, nullable=False, default=0)
+    emails_quarantined = Column(Integer, nullable=False, default=0)
+    emails_failed = Column(Integer, nullable=False, default=0)
+    last_email_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_temp_email_stats_user_id_last_email_at", "user_id", "last_email_at"),
+    )
+
+class OutboundEmail(Base):
+    __tablename__ = "outbound_emails"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    from_email = Column(String, nullable=False)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    html_content = Column(Text, nullable=False)
+    # The log row that records this forward; marked failed if delivery is abandoned.
+    email_log_id = Column(Integer, ForeignKey("email_logs.id"), nullable=True)
+    status = Column(String, nullable=False, default="pending")  # 'pending', 'sending', 'sent', 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_outbound_emails_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_outbound_emails_status_created_at", "status", "created_at"),
+    )
+
+class SenderReputation(Base):
+    __tablename__ = "sender_reputation"
+    
+    sender = Column(String, primary_key=True)  # an address, or '@domain' for everything from a domain
+    emails_forwarded = Column(Integer, nullable=False, default=0)
+    emails_deleted = Column(Integer, nullable=False, default=0)
+    emails_quarantined = Column(Integer, nullable=False, default=0)
+    confidence_total = Column(Float, nullable=False, default=0.0)
+    last_seen_at = Column(DateTime, nullable=True)
+
+class SenderOverride(Base):
+    __tablename__ = "sender_overrides"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    sender = Column(String, nullable=False)  # an address, or '@domain'
+    action = Column(String, nullable=False)  # 'forward', 'delete', 'quarantine'
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_sender_overrides_user_id_sender", "user_id", "sender", unique=True),
+    )
@@ -0,0 +1,293 @@
+import asyncio
+import math
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from database import get_async_sessionmaker
+from models import EmailLog, OutboundEmail, TempEmail
+import dashboard_stats
+
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+OUTBOX_CLAIM_BATCH = int(os.getenv("OUTBOX_CLAIM_BATCH", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_HTTP_TIMEOUT = float(os.getenv("OUTBOX_HTTP_TIMEOUT", "10"))
+OUTBOX_MAX_CONNECTIONS = int(os.getenv("OUTBOX_MAX_CONNECTIONS", "20"))
+# Sent and failed messages hold the full body; they are deleted after this.
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "72"))
+OUTBOX_PURGE_CHUNK = int(os.getenv("OUTBOX_PURGE_CHUNK", "1000"))
+OUTBOX_PURGE_INTERVAL = int(os.getenv("OUTBOX_PURGE_INTERVAL", "3600"))
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(OutboundEmail.status == "pending", OutboundEmail.next_attempt_at <= now),
+        and_(OutboundEmail.status == "sending",
+             OutboundEmail.locked_at < now - timedelta(seconds=OUTBOX_LEASE_SECONDS))
+    )
+
+
+def claim_outbound(db: Session, limit: int = OUTBOX_CLAIM_BATCH) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    candidate_ids = [
+        message_id for (message_id,) in db.query(OutboundEmail.id).filter(
+            _claimable(now)
+        ).order_by(OutboundEmail.next_attempt_at, OutboundEmail.id).limit(limit)
+    ]
+
+    claimed_ids = []
+    for message_id in candidate_ids:
+        updated = db.query(OutboundEmail).filter(
+            OutboundEmail.id == message_id,
+            _claimable(now)
+        ).update({
+            OutboundEmail.status: "sending",
+            OutboundEmail.locked_at: now,
+            OutboundEmail.attempts: OutboundEmail.attempts + 1
+        }, synchronize_session=False)
+        if updated:
+            claimed_ids.append(message_id)
+
+    # Routes are cached per worker, so a forward may have been queued after
+    # its address was deactivated or expired. Such messages are never sent.
+    withdrawn_ids = [
+        message_id for (message_id,) in db.query(OutboundEmail.id).join(
+            EmailLog, EmailLog.id == OutboundEmail.email_log_id
+        ).join(TempEmail, TempEmail.id == EmailLog.temp_email_id).filter(
+            OutboundEmail.id.in_(claimed_ids),
+            or_(TempEmail.is_active == False, TempEmail.expires_at < now)
+        )
+    ] if claimed_ids else []
+    if withdrawn_ids:
+        db.query(OutboundEmail).filter(OutboundEmail.id.in_(withdrawn_ids)).update({
+            OutboundEmail.status: "failed",
+            OutboundEmail.locked_at: None,
+            OutboundEmail.last_error: "Address is no longer active"
+        }, synchronize_session=False)
+        _record_forwards_failed(db, withdrawn_ids)
+        withdrawn = set(withdrawn_ids)
+        claimed_ids = [message_id for message_id in claimed_ids if message_id not in withdrawn]
+    db.commit()
+
+    if not claimed_ids:
+        return []
+    return [
+        {
+            "id": message.id,
+            "from_email": message.from_email,
+            "to_email": message.to_email,
+            "subject": message.subject,
+            "html_content": message.html_content,
+            "attempts": message.attempts
+        }
+        for message in db.query(OutboundEmail).filter(OutboundEmail.id.in_(claimed_ids))
+    ]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header: delay-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    if not math.isfinite(seconds):
+        return None
+    return max(seconds, 0.0)
+
+
+def backoff_delay(attempts: int, retry_after: Optional[float] = None) -> float:
+    # Full jitter keeps retries from many workers from lining up.
+    delay = random.uniform(0, min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0))))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def record_results(db: Session, results: List[Tuple[Dict[str, Any], str, Optional[str], Optional[float]]]):
+    """Apply send outcomes: (message, 'sent' | 'retry' | 'failed', error, retry_after)."""
+    now = datetime.utcnow()
+    failed_ids = []
+    for message, outcome, error, retry_after in results:
+        values = {OutboundEmail.locked_at: None, OutboundEmail.last_error: error}
+        if outcome == "sent":
+            values.update({OutboundEmail.status: "sent", OutboundEmail.sent_at: now})
+        elif outcome == "retry" and message["attempts"] < OUTBOX_MAX_ATTEMPTS:
+            values.update({
+                OutboundEmail.status: "pending",
+                OutboundEmail.next_attempt_at: now + timedelta(seconds=backoff_delay(message["attempts"], retry_after))
+            })
+        else:
+            values[OutboundEmail.status] = "failed"
+            failed_ids.append(message["id"])
+        db.query(OutboundEmail).filter(OutboundEmail.id == message["id"]).update(values, synchronize_session=False)
+    if failed_ids:
+        _record_forwards_failed(db, failed_ids)
+    db.commit()
+
+
+def _record_forwards_failed(db: Session, message_ids: List[int]):
+    """Mark the log rows of abandoned messages failed and move their counts."""
+    for log_id, temp_email_id, user_id in db.query(EmailLog.id, EmailLog.temp_email_id, TempEmail.user_id).join(
+        TempEmail, TempEmail.id == EmailLog.temp_email_id
+    ).join(OutboundEmail, OutboundEmail.email_log_id == EmailLog.id).filter(OutboundEmail.id.in_(message_ids)):
+        # Conditional, so a log is only ever moved once.
+        updated = db.query(EmailLog).filter(
+            EmailLog.id == log_id,
+            EmailLog.action_taken == "forward"
+        ).update({EmailLog.action_taken: "failed"}, synchronize_session=False)
+        if updated:
+            dashboard_stats.record_email_log_changed(db, user_id, temp_email_id, "forward", "failed")
+
+
+def purge_finished(db: Session, older_than_hours: int = OUTBOX_RETENTION_HOURS,
+                   chunk_size: int = OUTBOX_PURGE_CHUNK) -> int:
+    """Delete sent and failed messages older than the retention, one chunk per transaction."""
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    total = 0
+    while True:
+        message_ids = [
+            message_id for (message_id,) in db.query(OutboundEmail.id).filter(
+                OutboundEmail.status.in_(["sent", "failed"]),
+                OutboundEmail.created_at < cutoff
+            ).limit(chunk_size)
+        ]
+        if not message_ids:
+            return total
+        total += db.query(OutboundEmail).filter(OutboundEmail.id.in_(message_ids)).delete(synchronize_session=False)
+        db.commit()
+        if len(message_ids) < chunk_size:
+            return total
+
+
+def outbox_stats(db: Session) -> Dict[str, Any]:
+    counts = dict(
+        db.query(OutboundEmail.status, func.count(OutboundEmail.id)).group_by(OutboundEmail.status).all()
+    )
+    oldest_pending = db.query(func.min(OutboundEmail.created_at)).filter(
+        OutboundEmail.status.in_(["pending", "sending"])
+    ).scalar()
+    return {
+        "pending": counts.get("pending", 0),
+        "sending": counts.get("sending", 0),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "lag_seconds": round((datetime.utcnow() - oldest_pending).total_seconds(), 3) if oldest_pending else 0.0
+    }
+
+
+class OutboxSender:
+    def __init__(self, api_url: str = SENDGRID_API_URL, api_key: str = None,
+                 concurrency: int = OUTBOX_CONCURRENCY, transport: httpx.AsyncBaseTransport = None):
+        self.api_url = api_url
+        self.api_key = api_key or os.getenv("SENDGRID_API_KEY")
+        self.concurrency = concurrency
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.task: Optional[asyncio.Task] = None
+        self.purge_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task:
+            return
+        # One keep-alive pool for the life of the process.
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=OUTBOX_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=OUTBOX_MAX_CONNECTIONS,
+                                max_keepalive_connections=OUTBOX_MAX_CONNECTIONS),
+            transport=self.transport
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.task = asyncio.create_task(self._run())
+        self.purge_task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        for task in (self.task, self.purge_task):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.task = self.purge_task = None
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Outbox sender error: {str(e)}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    async def _purge_loop(self):
+        Session = get_async_sessionmaker()
+        while True:
+            await asyncio.sleep(OUTBOX_PURGE_INTERVAL)
+            try:
+                async with Session() as db:
+                    purged = await db.run_sync(purge_finished)
+                if purged:
+                    print(f"Outbox purge deleted {purged} finished messages")
+            except Exception as e:
+                print(f"Outbox purge error: {str(e)}")
+
+    async def run_once(self) -> int:
+        Session = get_async_sessionmaker()
+        async with Session() as db:
+            messages = await db.run_sync(claim_outbound)
+        if not messages:
+            return 0
+
+        # Forwarded bodies differ per recipient, so each message is its own
+        # API call; they share the client's keep-alive connections.
+        results = await asyncio.gather(*(self._send(message) for message in messages))
+        async with Session() as db:
+            await db.run_sync(record_results, results)
+        return len(messages)
+
+    async def _send(self, message: Dict[str, Any]):
+        payload = {
+            "personalizations": [{"to": [{"email": message["to_email"]}]}],
+            "from": {"email": message["from_email"]},
+            "subject": message["subject"],
+            "content": [{"type": "text/html", "value": message["html_content"]}]
+        }
+        async with self.semaphore:
+            try:
+                response = await self.client.post(self.api_url, json=payload)
+            except httpx.HTTPError as e:
+                return message, "retry", f"{type(e).__name__}: {str(e)}", None
+
+        if response.status_code in (200, 202):
+            return message, "sent", None, None
+        error = f"SendGrid returned {response.status_code}: {response.text[:500]}"
+        if response.status_code == 429 or response.status_code >= 500:
+            return message, "retry", error, parse_retry_after(response.headers.get("Retry-After"))
+        return message, "failed", error, None
+
+
+outbox_sender = OutboxSender()
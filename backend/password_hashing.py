@@ -0,0 +1,129 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+# bcrypt cost factor; each step doubles the work. Hashes made with another
+# cost are rehashed on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes doing bcrypt, and how many requests may wait for one before new
+# ones are turned away with 429. Other routes never wait on this pool.
+PASSWORD_HASH_WORKERS = max(1, int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))))
+PASSWORD_HASH_QUEUE_SIZE = max(0, int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "16")))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# Run in the worker processes.
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class HasherOverloaded(Exception):
+    pass
+
+
+class HasherUnavailable(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt in a dedicated process pool with a bounded backlog.
+
+    At most workers + queue_size hash operations are admitted at once; past
+    that, callers get HasherOverloaded immediately instead of queueing
+    behind a burst of logins.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.restarts = 0
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs threads (the
+                # event loop's executors, SQLAlchemy pools) is not safe.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(valid, new hash or None); a new hash means the stored one is outdated."""
+        valid, new_hash = await self._run(_verify_and_update, password, hashed_password)
+        if new_hash:
+            with self._lock:
+                self.rehashed += 1
+        return valid, new_hash
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise HasherOverloaded("Too many password operations in progress")
+            self.in_flight += 1
+        try:
+            # A worker that dies (OOM kill, crash) breaks the whole pool;
+            # replace it and retry once rather than failing every later call.
+            for _ in range(2):
+                executor = self.start()
+                try:
+                    return await asyncio.wrap_future(executor.submit(func, *args))
+                except BrokenProcessPool:
+                    self._discard(executor)
+            raise HasherUnavailable("Password hashing workers are failing")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is not executor:
+                return  # Another call already replaced it.
+            self._executor = None
+            self.restarts += 1
+        print("Password hashing pool broke; starting a new one")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rounds": BCRYPT_ROUNDS,
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "restarts": self.restarts
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+# Each process caches on its own, so a change made elsewhere (another
+# worker, a direct SQL update) is seen after at most this long. 0 disables
+# the cache.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+
+class Principal(NamedTuple):
+    """The user columns request handlers read, detached from any session."""
+    id: int
+    email: str
+    is_active: bool
+    created_at: datetime
+
+
+class PrincipalCache:
+    """Maps access tokens to the user they authenticate.
+
+    Entries are keyed by the token's jti (its subject for tokens issued
+    before jti was added) and live for PRINCIPAL_CACHE_TTL, never past the
+    token's own expiry. invalidate_user() drops a user's entries at once.
+    """
+
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_SIZE, ttl_seconds: int = PRINCIPAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Principal]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, principal: Principal, token_expires_at: Optional[float] = None):
+        """token_expires_at is the token's exp claim (seconds since the epoch)."""
+        ttl = self.ttl_seconds
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, principal)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        """Call after a user is deactivated or their account changes."""
+        with self._lock:
+            stale = [key for key, (_, principal) in self._entries.items() if principal.id == user_id]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations
+            }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,212 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter still works within one process.
+    fcntl = None
+
+# Account limits for the model we call; 0 disables that bucket.
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "3500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "90000"))
+# Share of each bucket only high-priority requests may use, so verification
+# codes are not stuck behind a newsletter burst.
+OPENAI_PRIORITY_RESERVE = float(os.getenv("OPENAI_PRIORITY_RESERVE", "0.2"))
+# Every worker process on the host that points at the same file shares one
+# budget.
+OPENAI_RATE_LIMIT_FILE = os.getenv(
+    "OPENAI_RATE_LIMIT_FILE", os.path.join(tempfile.gettempdir(), "email_router_openai_ratelimit.json")
+)
+
+# Longest single sleep, so refunds from other workers are noticed quickly.
+MAX_POLL_SECONDS = 0.25
+
+_duration_re = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+_priority_re = re.compile(
+    r"verif|confirm|one[- ]time|\botp\b|passcode|security code|\bcode\b|password|sign[- ]?in|log[- ]?in|"
+    r"2fa|two[- ]factor|activate|magic link",
+    re.IGNORECASE
+)
+
+
+def request_priority(subject: str, text: str = "") -> str:
+    """'high' for mail that looks like a verification/sign-in step a user is waiting on."""
+    return "high" if _priority_re.search(subject or "") or _priority_re.search((text or "")[:500]) else "normal"
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset headers ('1s', '6m0s', '20ms') or plain seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _duration_re.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared through a
+    lock-protected state file so every worker process draws on one quota.
+    """
+
+    def __init__(self, path: str = OPENAI_RATE_LIMIT_FILE, rpm: int = OPENAI_RPM_LIMIT,
+                 tpm: int = OPENAI_TPM_LIMIT, reserve: float = OPENAI_PRIORITY_RESERVE):
+        self.path = path
+        self.rpm = rpm
+        self.tpm = tpm
+        self.reserve = reserve
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.rate_limited = 0
+
+    def acquire(self, tokens: int, priority: str = "normal", deadline: float = None) -> bool:
+        """Block until one request of ~tokens fits. False if it would pass the deadline (time.monotonic()).
+
+        Without limits configured only a 429's back-off is waited out.
+        """
+        waited = 0.0
+        while True:
+            wait = self._update(lambda state, now: self._take(state, now, tokens, priority))
+            if wait <= 0:
+                with self._stats_lock:
+                    self.acquired += 1
+                    if waited:
+                        self.waits += 1
+                        self.wait_seconds += waited
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                with self._stats_lock:
+                    self.timeouts += 1
+                return False
+            sleep = min(wait, MAX_POLL_SECONDS)
+            time.sleep(sleep)
+            waited += sleep
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Give back (or take) the difference once the real usage is known."""
+        if not self.tpm or actual_tokens is None or actual_tokens == estimated_tokens:
+            return
+
+        def refund(state, now):
+            state["tokens"] = min(self.tpm, state["tokens"] + estimated_tokens - actual_tokens)
+            return 0
+        self._update(refund)
+
+    def observe(self, headers: Mapping[str, str]):
+        """Align the shared buckets with what the API reports as remaining."""
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is None and remaining_tokens is None:
+            return
+
+        def align(state, now):
+            # Only ever lower: the server also counts other hosts' traffic.
+            if remaining_requests is not None and self.rpm:
+                state["requests"] = min(state["requests"], float(remaining_requests))
+            if remaining_tokens is not None and self.tpm:
+                state["tokens"] = min(state["tokens"], float(remaining_tokens))
+            return 0
+        try:
+            self._update(align)
+        except ValueError:
+            pass
+
+    def penalize(self, headers: Mapping[str, str]) -> float:
+        """After a 429, stop every worker until the API says to retry."""
+        with self._stats_lock:
+            self.rate_limited += 1
+        delay = (parse_duration(headers.get("retry-after"))
+                 or max(parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                        parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0)
+                 or 1.0)
+
+        def block(state, now):
+            state["blocked_until"] = max(state["blocked_until"], now + delay)
+            return 0
+        self._update(block)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        state = self._update(lambda state, now: dict(state))
+        with self._stats_lock:
+            return {
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "priority_reserve": self.reserve,
+                "available_requests": round(state.get("requests", 0), 1),
+                "available_tokens": round(state.get("tokens", 0), 1),
+                "blocked_for_seconds": round(max(state.get("blocked_until", 0) - time.time(), 0), 3),
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "avg_wait_ms": round(self.wait_seconds / self.waits * 1000, 1) if self.waits else 0.0,
+                "deadline_timeouts": self.timeouts,
+                "rate_limited_responses": self.rate_limited
+            }
+
+    def _take(self, state: Dict[str, float], now: float, tokens: int, priority: str) -> float:
+        if state["blocked_until"] > now:
+            return state["blocked_until"] - now
+        floor = 0.0 if priority == "high" else self.reserve
+        waits = []
+        if self.rpm:
+            waits.append(self._shortfall(state["requests"], 1, self.rpm, floor))
+        if self.tpm:
+            # A request larger than the whole bucket still has to go through.
+            waits.append(self._shortfall(state["tokens"], min(tokens, self.tpm), self.tpm, floor))
+        wait = max(waits, default=0.0)
+        if wait <= 0:
+            state["requests"] -= 1
+            state["tokens"] -= tokens
+        return wait
+
+    @staticmethod
+    def _shortfall(available: float, needed: float, limit: int, floor: float) -> float:
+        missing = min(needed + floor * limit, limit) - available
+        return missing / (limit / 60) if missing > 0 else 0.0
+
+    def _update(self, change):
+        # Wall-clock time, since the state is shared between processes.
+        with self._thread_lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                with os.fdopen(os.dup(fd), "r+") as handle:
+                    now = time.time()
+                    state = self._refill(handle.read(), now)
+                    result = change(state, now)
+                    handle.seek(0)
+                    handle.write(json.dumps(state))
+                    handle.truncate()
+                return result
+            finally:
+                os.close(fd)
+
+    def _refill(self, raw: str, now: float) -> Dict[str, float]:
+        try:
+            state = json.loads(raw)
+            elapsed = max(now - state["updated_at"], 0)
+        except (ValueError, KeyError, TypeError):
+            state = {"requests": self.rpm, "tokens": self.tpm, "blocked_until": 0.0}
+            elapsed = 0
+        state["requests"] = min(self.rpm, state["requests"] + elapsed * self.rpm / 60)
+        state["tokens"] = min(self.tpm, state["tokens"] + elapsed * self.tpm / 60)
+        state["updated_at"] = now
+        return state
+
+
+openai_rate_limiter = RateLimiter()
@@ -0,0 +1,116 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from datetime import datetime
+import os
+import secrets
+
+from database import get_db, get_async_db
+from models import User
+from flight_recorder import flight_recorder, FLIGHT_RECORDER_SIZE
+from principal_cache import principal_cache
+from password_hashing import password_hasher
+from sampling_profiler import sampling_profiler, ProfilerBusy, PROFILE_MAX_SECONDS
+from ai_classifier import CLASSIFIER_DEGRADED_POLICY
+from classification_cache import classification_cache
+from local_classifier import local_classifier
+from email_preprocessor import preprocessing_metrics
+from routing_table import routing_table
+from outbox import outbox_stats
+from sender_reputation import reputation_index
+from campaign_index import campaign_index
+from routers.webhooks import get_batcher, get_classifier
+import work_queue
+import expiry_sweeper
+
+# Operator endpoints are off unless a token is configured.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+security = HTTPBearer(auto_error=False)
+
+def require_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/slow-requests")
+def get_slow_requests(limit: int = Query(20, ge=1, le=FLIGHT_RECORDER_SIZE)):
+    return {
+        "recorder": flight_recorder.stats(),
+        "requests": flight_recorder.slowest(limit)
+    }
+
+@router.delete("/slow-requests")
+def clear_slow_requests():
+    flight_recorder.clear()
+    return {"message": "Flight recorder cleared"}
+
+@router.post("/profile", response_class=PlainTextResponse)
+def run_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    include_idle: bool = False
+):
+    # A sync route: sampling blocks one threadpool thread, not the event loop.
+    try:
+        stacks = sampling_profiler.profile(seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    filename = f"profile-{datetime.utcnow():%Y%m%dT%H%M%S}.collapsed"
+    return PlainTextResponse(
+        sampling_profiler.collapsed(stacks),
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Profile-Samples": str(sampling_profiler.last_profile["samples"])
+        }
+    )
+
+@router.post("/users/{user_id}/deactivate")
+def deactivate_user(user_id: int, db: Session = Depends(get_db)):
+    updated = db.query(User).filter(User.id == user_id).update({"is_active": False}, synchronize_session=False)
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found")
+    db.commit()
+    # Other worker processes see it once their cached entry expires.
+    principal_cache.invalidate_user(user_id)
+    return {"message": "User deactivated"}
+
+@router.get("/auth/stats")
+def get_auth_stats():
+    return {"principal_cache": principal_cache.stats(), "password_hashing": password_hasher.stats()}
+
+@router.get("/queue/stats")
+async def get_queue_stats(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(work_queue.queue_stats)
+
+@router.get("/outbox/stats")
+async def get_outbox_stats(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(outbox_stats)
+
+@router.get("/expiry/stats")
+def get_expiry_stats():
+    return expiry_sweeper.last_sweep
+
+@router.get("/classifier/stats")
+def get_classifier_stats():
+    return {
+        "cache": classification_cache.stats(),
+        "local_model": local_classifier.stats(),
+        "preprocessing": preprocessing_metrics.stats(),
+        "batching": get_batcher().stats(),
+        "breaker": get_classifier().breaker.stats(),
+        "rate_limit": get_classifier().rate_limiter.stats(),
+        "degraded_policy": CLASSIFIER_DEGRADED_POLICY,
+        "sender_reputation": reputation_index.stats(),
+        "campaigns": campaign_index.stats(),
+        "routing": routing_table.stats()
+    }
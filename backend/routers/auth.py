@@ -1,33 +1,46 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import os
+import uuid
 
-from database import get_db
-from models import User
+from database import get_db, get_async_db
+from models import User, UserStats
 from schemas import UserCreate, UserLogin, Token, User as UserSchema
+from principal_cache import Principal, principal_cache
+from password_hashing import HasherOverloaded, HasherUnavailable, password_hasher
 
 router = APIRouter()
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Sent with 429 when the password hashing backlog is full.
+PASSWORD_HASH_RETRY_AFTER = os.getenv("PASSWORD_HASH_RETRY_AFTER", "1")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def hashing_overloaded():
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many authentication requests, try again shortly",
+        headers={"Retry-After": PASSWORD_HASH_RETRY_AFTER},
+    )
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def hashing_unavailable():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is temporarily unavailable, try again shortly",
+        headers={"Retry-After": PASSWORD_HASH_RETRY_AFTER},
+    )
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti names this token in the principal cache.
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -46,43 +59,91 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
+    cache_key = payload.get("jti") or f"sub:{email}"
+    user = principal_cache.get(cache_key)
     if user is None:
-        raise credentials_exception
+        # Tokens issued before uid was added fall back to the email index.
+        user_id = payload.get("uid")
+        if user_id is not None:
+            db_user = db.get(User, user_id)
+        else:
+            db_user = db.query(User).filter(User.email == email).first()
+        if db_user is None:
+            raise credentials_exception
+        user = Principal(db_user.id, db_user.email, db_user.is_active, db_user.created_at)
+        principal_cache.set(cache_key, user, payload.get("exp"))
+    
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
     return user
 
-@router.post("/register", response_model=UserSchema)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
-        raise HTTPException(
-            status_code=400,
-            detail="Email already registered"
-        )
-    
-    hashed_password = get_password_hash(user.password)
+def _find_user(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+def _create_user(db: Session, email: str, hashed_password: str):
     db_user = User(
-        email=user.email,
+        email=email,
         hashed_password=hashed_password
     )
     db.add(db_user)
+    db.flush()
+    db.add(UserStats(user_id=db_user.id))
     db.commit()
     db.refresh(db_user)
     return db_user
 
+def _update_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(User).filter(User.id == user_id).update({"hashed_password": hashed_password}, synchronize_session=False)
+    db.commit()
+
+# Both routes are async so bcrypt waits in its own process pool rather than
+# holding one of the threads that serve every sync route.
+@router.post("/register", response_model=UserSchema)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.run_sync(_find_user, user.email)
+    if db_user:
+        raise HTTPException(
+            status_code=400,
+            detail="Email already registered"
+        )
+    # Release the pooled connection while waiting on bcrypt.
+    await db.commit()
+    
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except HasherOverloaded:
+        raise hashing_overloaded()
+    except HasherUnavailable:
+        raise hashing_unavailable()
+    return await db.run_sync(_create_user, user.email, hashed_password)
+
 @router.post("/login", response_model=Token)
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.run_sync(_find_user, user.email)
+    # Release the pooled connection while waiting on bcrypt.
+    await db.commit()
+    valid = new_hash = None
+    if db_user:
+        try:
+            valid, new_hash = await password_hasher.verify(user.password, db_user.hashed_password)
+        except HasherOverloaded:
+            raise hashing_overloaded()
+        except HasherUnavailable:
+            raise hashing_unavailable()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = create_access_token(data={"sub": db_user.email})
+    if new_hash:
+        # Stored with an outdated cost (or scheme); replaced transparently.
+        await db.run_sync(_update_password_hash, db_user.id, new_hash)
+    
+    access_token = create_access_token(data={"sub": db_user.email, "uid": db_user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserSchema)
-def read_users_me(current_user: User = Depends(get_current_user)):
+def read_users_me(current_user: Principal = Depends(get_current_user)):
     return current_user
\ No newline at end of file
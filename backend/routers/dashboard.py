@@ -1,57 +1,198 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from typing import List
+from sqlalchemy import desc, tuple_
+from typing import List, Optional
+from datetime import datetime
+import base64
+import csv
+import io
+import json
 
-from database import get_db
-from models import User, TempEmail, EmailLog
+from database import get_db, SessionLocal
+from models import TempEmail, EmailLog, UserStats, TempEmailStats, SenderOverride
 from schemas import DashboardStats, EmailLog as EmailLogSchema
+from schemas import SenderOverride as SenderOverrideSchema, SenderOverrideCreate
 from routers.auth import get_current_user
+from principal_cache import Principal
+from sender_reputation import REPUTATION_ACTION_COLUMNS, reputation_index
+from campaign_index import campaign_index
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 500
+EXPORT_COLUMNS = (
+    "id", "temp_email_id", "sender_email", "subject", "body_preview",
+    "action_taken", "ai_confidence_score", "ai_reasoning", "created_at"
+)
+
 @router.get("/stats", response_model=DashboardStats)
 def get_dashboard_stats(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    total_temp_emails = db.query(TempEmail).filter(
-        TempEmail.user_id == current_user.id
-    ).count()
-    
-    active_temp_emails = db.query(TempEmail).filter(
-        TempEmail.user_id == current_user.id,
-        TempEmail.is_active == True
-    ).count()
-    
-    emails_forwarded = db.query(func.count(EmailLog.id)).join(TempEmail).filter(
-        TempEmail.user_id == current_user.id,
-        EmailLog.action_taken == "forward"
-    ).scalar()
+    # Counters are maintained by dashboard_stats alongside every write, so
+    # this is a primary-key read however long the user's history is.
+    stats = db.get(UserStats, current_user.id)
     
-    emails_deleted = db.query(func.count(EmailLog.id)).join(TempEmail).filter(
-        TempEmail.user_id == current_user.id,
-        EmailLog.action_taken == "delete"
-    ).scalar()
+    # The ten newest logs can only come from the ten addresses that most
+    # recently received mail, and the (temp_email_id, created_at, id) index
+    # lets the database stop after ten rows of each. Unlike the totals this
+    # stays a query: copying log rows into UserStats would add a write to
+    # every inbound email for a list only the dashboard reads.
+    recent_temp_email_ids = [temp_email_id for (temp_email_id,) in db.query(TempEmailStats.temp_email_id).filter(
+        TempEmailStats.user_id == current_user.id,
+        TempEmailStats.last_email_at != None
+    ).order_by(desc(TempEmailStats.last_email_at)).limit(10)]
     
-    recent_activity = db.query(EmailLog).join(TempEmail).filter(
-        TempEmail.user_id == current_user.id
-    ).order_by(desc(EmailLog.created_at)).limit(10).all()
+    recent_activity = db.query(EmailLog).filter(
+        EmailLog.temp_email_id.in_(recent_temp_email_ids)
+    ).order_by(desc(EmailLog.created_at), desc(EmailLog.id)).limit(10).all() if recent_temp_email_ids else []
     
     return DashboardStats(
-        total_temp_emails=total_temp_emails,
-        active_temp_emails=active_temp_emails,
-        emails_forwarded=emails_forwarded or 0,
-        emails_deleted=emails_deleted or 0,
+        total_temp_emails=stats.total_temp_emails if stats else 0,
+        active_temp_emails=stats.active_temp_emails if stats else 0,
+        emails_forwarded=stats.emails_forwarded if stats else 0,
+        emails_deleted=stats.emails_deleted if stats else 0,
         recent_activity=recent_activity
     )
 
+def encode_cursor(created_at: datetime, log_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{log_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def user_logs_query(db: Session, user_id: int, *columns):
+    return db.query(*(columns or (EmailLog,))).join(TempEmail).filter(
+        TempEmail.user_id == user_id
+    ).order_by(desc(EmailLog.created_at), desc(EmailLog.id))
+
 @router.get("/emails", response_model=List[EmailLogSchema])
 def get_email_logs(
-    current_user: User = Depends(get_current_user),
+    response: Response,
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
-    limit: int = 50
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    query = user_logs_query(db, current_user.id)
+    if cursor:
+        # Keyset pagination: seek past the last (created_at, id) already
+        # returned instead of counting rows with OFFSET.
+        query = query.filter(tuple_(EmailLog.created_at, EmailLog.id) < tuple_(*decode_cursor(cursor)))
+    
+    logs = query.limit(limit).all()
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(logs[-1].created_at, logs[-1].id)
+    return logs
+
+@router.get("/emails/export")
+def export_email_logs(
+    current_user: Principal = Depends(get_current_user),
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")
+):
+    user_id = current_user.id
+    
+    def stream_rows():
+        # The request-scoped session is gone by the time the body streams,
+        # so the generator owns its session.
+        db = SessionLocal()
+        try:
+            query = user_logs_query(db, user_id, *(getattr(EmailLog, column) for column in EXPORT_COLUMNS))
+            # yield_per streams from a server-side cursor instead of loading
+            # the whole history.
+            rows = query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+            
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(EXPORT_COLUMNS)
+                for index, row in enumerate(rows, start=1):
+                    writer.writerow(row)
+                    if index % EXPORT_BATCH_SIZE == 0:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                chunk = []
+                for row in rows:
+                    chunk.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str))
+                    if len(chunk) == EXPORT_BATCH_SIZE:
+                        yield "\n".join(chunk) + "\n"
+                        chunk = []
+                if chunk:
+                    yield "\n".join(chunk) + "\n"
+        finally:
+            db.close()
+    
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=email_logs.{export_format}"}
+    )
+
+@router.get("/campaigns")
+def get_campaigns(current_user: Principal = Depends(get_current_user)):
+    # Near-duplicate mail that reached this user's addresses recently,
+    # counted over the user's own copies only.
+    return campaign_index.campaigns_for_user(current_user.id)
+
+@router.get("/sender-overrides", response_model=List[SenderOverrideSchema])
+def get_sender_overrides(
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return db.query(SenderOverride).filter(
+        SenderOverride.user_id == current_user.id
+    ).order_by(SenderOverride.sender).all()
+
+@router.put("/sender-overrides", response_model=SenderOverrideSchema)
+def set_sender_override(
+    override: SenderOverrideCreate,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    sender = override.sender.strip().lower()
+    local_part, _, domain = sender.rpartition("@")
+    if not domain or "@" in local_part or (not local_part and not sender.startswith("@")):
+        raise HTTPException(status_code=400, detail="sender must be an email address or '@domain'")
+    if override.action not in REPUTATION_ACTION_COLUMNS:
+        raise HTTPException(status_code=400, detail="action must be forward, delete or quarantine")
+    
+    db_override = db.query(SenderOverride).filter(
+        SenderOverride.user_id == current_user.id,
+        SenderOverride.sender == sender
+    ).first()
+    if db_override:
+        db_override.action = override.action
+    else:
+        db_override = SenderOverride(user_id=current_user.id, sender=sender, action=override.action)
+        db.add(db_override)
+    db.commit()
+    db.refresh(db_override)
+    reputation_index.invalidate_user(current_user.id)
+    return db_override
+
+@router.delete("/sender-overrides/{override_id}")
+def delete_sender_override(
+    override_id: int,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
-    return db.query(EmailLog).join(TempEmail).filter(
-        TempEmail.user_id == current_user.id
-    ).order_by(desc(EmailLog.created_at)).limit(limit).all()
\ No newline at end of file
+    deleted = db.query(SenderOverride).filter(
+        SenderOverride.id == override_id,
+        SenderOverride.user_id == current_user.id
+    ).delete(synchronize_session=False)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Sender override not found")
+    db.commit()
+    reputation_index.invalidate_user(current_user.id)
+    return {"message": "Sender override deleted"}
@@ -1,4 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List
 import uuid
@@ -6,51 +8,84 @@ import os
 from datetime import datetime, timedelta
 
 from database import get_db
-from models import User, TempEmail
-from schemas import TempEmailCreate, TempEmail as TempEmailSchema
+from models import TempEmail, TempEmailStats
+from schemas import TempEmailCreate, TempEmailBulkCreate, TempEmail as TempEmailSchema
 from routers.auth import get_current_user
+from principal_cache import Principal
+from routing_table import routing_table
+import dashboard_stats
 
 router = APIRouter()
 
+TEMP_EMAIL_BULK_MAX = int(os.getenv("TEMP_EMAIL_BULK_MAX", "10000"))
+# Insert attempts before giving up on address collisions.
+MAX_INSERT_ATTEMPTS = 3
+
 def generate_temp_email(domain: str) -> str:
-    unique_id = str(uuid.uuid4())[:8]
+    # 48 random bits: collisions stay negligible well past millions of
+    # addresses, and the unique index catches the rare one.
+    unique_id = uuid.uuid4().hex[:12]
     return f"temp-{unique_id}@{domain}"
 
-@router.post("/", response_model=TempEmailSchema)
-def create_temp_email(
-    temp_email: TempEmailCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+def _insert_temp_emails(db: Session, user_id: int, count: int, purpose, expires_at) -> list:
     domain = os.getenv("DOMAIN", "example.com")
+    if expires_at is None:
+        expires_at = datetime.utcnow() + timedelta(days=30)
     
-    max_attempts = 10
-    for _ in range(max_attempts):
-        address = generate_temp_email(domain)
-        existing = db.query(TempEmail).filter(TempEmail.address == address).first()
-        if not existing:
+    for _ in range(MAX_INSERT_ATTEMPTS):
+        addresses = set()
+        while len(addresses) < count:
+            addresses.add(generate_temp_email(domain))
+        rows = [
+            {"user_id": user_id, "address": address, "purpose": purpose,
+             "expires_at": expires_at, "is_active": True, "created_at": datetime.utcnow()}
+            for address in addresses
+        ]
+        try:
+            with db.begin_nested():
+                # Plain rows rather than ORM objects, which the commit below
+                # would expire and reload one by one for the response.
+                created = db.execute(insert(TempEmail).returning(
+                    TempEmail.id, TempEmail.address, TempEmail.user_id, TempEmail.purpose,
+                    TempEmail.expires_at, TempEmail.is_active, TempEmail.created_at
+                ), rows).all()
             break
+        except IntegrityError:
+            continue
     else:
         raise HTTPException(status_code=500, detail="Could not generate unique email address")
     
-    if temp_email.expires_at is None:
-        temp_email.expires_at = datetime.utcnow() + timedelta(days=30)
-    
-    db_temp_email = TempEmail(
-        user_id=current_user.id,
-        address=address,
-        purpose=temp_email.purpose,
-        expires_at=temp_email.expires_at
-    )
-    
-    db.add(db_temp_email)
+    db.execute(insert(TempEmailStats), [
+        {"temp_email_id": temp_email.id, "user_id": user_id} for temp_email in created
+    ])
+    dashboard_stats.record_temp_emails_created(db, user_id, len(created))
     db.commit()
-    db.refresh(db_temp_email)
-    return db_temp_email
+    for temp_email in created:
+        routing_table.invalidate_address(temp_email.address)
+    return created
+
+@router.post("/", response_model=TempEmailSchema)
+def create_temp_email(
+    temp_email: TempEmailCreate,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return _insert_temp_emails(db, current_user.id, 1, temp_email.purpose, temp_email.expires_at)[0]
+
+@router.post("/bulk", response_model=List[TempEmailSchema])
+def create_temp_emails_bulk(
+    request: TempEmailBulkCreate,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if not 1 <= request.count <= TEMP_EMAIL_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {TEMP_EMAIL_BULK_MAX}")
+    
+    return _insert_temp_emails(db, current_user.id, request.count, request.purpose, request.expires_at)
 
 @router.get("/", response_model=List[TempEmailSchema])
 def list_temp_emails(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     return db.query(TempEmail).filter(TempEmail.user_id == current_user.id).all()
@@ -58,7 +93,7 @@ def list_temp_emails(
 @router.get("/{temp_email_id}", response_model=TempEmailSchema)
 def get_temp_email(
     temp_email_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     temp_email = db.query(TempEmail).filter(
@@ -74,7 +109,7 @@ def get_temp_email(
 @router.delete("/{temp_email_id}")
 def deactivate_temp_email(
     temp_email_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     temp_email = db.query(TempEmail).filter(
@@ -85,7 +120,10 @@ def deactivate_temp_email(
     if not temp_email:
         raise HTTPException(status_code=404, detail="Temp email not found")
     
-    temp_email.is_active = False
+    if temp_email.is_active:
+        temp_email.is_active = False
+        dashboard_stats.record_temp_emails_deactivated(db, current_user.id)
     db.commit()
+    routing_table.invalidate_address(temp_email.address)
     
     return {"message": "Temp email deactivated successfully"}
\ No newline at end of file
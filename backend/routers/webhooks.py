@@ -1,107 +1,355 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import json
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import os
+import time
 from datetime import datetime
 
-from database import get_db
-from models import TempEmail, EmailLog, User, ForwardingRule
-from ai_classifier import AIEmailClassifier
-from email_service import EmailService
+from database import SessionLocal, get_async_db
+from models import EmailLog, OutboundEmail, TempEmail
+from ai_classifier import (AIEmailClassifier, ClassifierUnavailable, CLASSIFIER_DEFER_SECONDS,
+                           CLASSIFIER_DEGRADED_POLICY, CLASSIFIER_TIMEOUT_SECONDS)
+from classification_batcher import ClassificationBatcher
+from local_classifier import local_classifier
+from routing_table import routing_table
+from email_service import EmailService, FORWARDING_MODE
+import inbound_parser
+import work_queue
+import dashboard_stats
+import sender_reputation
+from sender_reputation import reputation_index
+from campaign_index import campaign_index
+from batch_writer import BatchWriter
+from metrics import (INBOUND_DECISIONS, INBOUND_EMAIL_SECONDS, INBOUND_IN_FLIGHT, INBOUND_OUTCOMES,
+                     INBOUND_STAGE_SECONDS)
 
 router = APIRouter()
 
+# 'inline' classifies and forwards before responding; 'queue' only stores the
+# events and lets the background worker pool process them.
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline")
+WEBHOOK_CONCURRENCY = max(1, int(os.getenv("WEBHOOK_CONCURRENCY", "8")))
+WEBHOOK_IO_THREADS = max(1, int(os.getenv("WEBHOOK_IO_THREADS", "32")))
+# Events parsed from a request body before they are processed or queued.
+WEBHOOK_WINDOW_SIZE = max(1, int(os.getenv("WEBHOOK_WINDOW_SIZE", "100")))
+
+# The OpenAI and SendGrid clients are synchronous, so their calls run here
+# instead of on the event loop (and instead of Starlette's shared threadpool,
+# which also serves every sync route).
+blocking_io_executor = ThreadPoolExecutor(
+    max_workers=WEBHOOK_IO_THREADS,
+    thread_name_prefix="webhook-io"
+)
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Like asyncio.to_thread, carry context variables (the flight recorder's
+    # request trace) into the worker thread.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_io_executor, functools.partial(context.run, func, *args, **kwargs))
+
+@functools.lru_cache(maxsize=None)
+def get_classifier() -> AIEmailClassifier:
+    return AIEmailClassifier()
+
+@functools.lru_cache(maxsize=None)
+def get_batcher() -> ClassificationBatcher:
+    # Concurrent unruled emails, from one request or many, share LLM calls.
+    return ClassificationBatcher(get_classifier(), run_blocking)
+
+@functools.lru_cache(maxsize=None)
+def get_email_service() -> EmailService:
+    return EmailService()
+
 @router.post("/sendgrid")
-async def handle_sendgrid_webhook(request: Request, db: Session = Depends(get_db)):
+async def handle_sendgrid_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # SendGrid Inbound Parse posts one message per request as a form.
+        try:
+            form = await inbound_parser.InboundParseForm(request.headers["content-type"]).parse(request.stream())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid webhook payload")
+        events = _iter_list(form.events())
+    else:
+        events = inbound_parser.iter_json_events(request.stream())
+    
+    return await _handle_events(events, db)
+
+async def _iter_list(items):
+    for item in items:
+        yield item
+
+async def _handle_events(events, db: AsyncSession):
+    classifier = get_classifier()
+    email_service = get_email_service()
+    writer = BatchWriter()
+    semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+    enqueued = duplicates = handled = 0
+    
+    async def process_with_limit(event):
+        async with semaphore:
+            # One session per event: a Session must not be shared between
+            # tasks that interleave at await points.
+            db = SessionLocal()
+            try:
+                return await process_inbound_email(event, db, classifier, email_service, writer)
+            finally:
+                db.close()
+    
+    async def handle_window(window):
+        nonlocal enqueued, duplicates, handled
+        handled += len(window)
+        if WEBHOOK_MODE == "queue":
+            counts = await db.run_sync(work_queue.enqueue_events, window)
+            enqueued += counts[0]
+            duplicates += counts[1]
+        else:
+            await asyncio.gather(*(process_with_limit(event) for event in window))
+    
+    # Events are handled in windows as they are parsed, so memory follows the
+    # window size rather than the size of the whole payload.
+    window = []
+    invalid = False
     try:
-        body = await request.body()
-        events = json.loads(body.decode('utf-8'))
-        
-        classifier = AIEmailClassifier()
-        email_service = EmailService()
-        
-        processed_count = 0
-        
-        for event in events:
+        async for event in events:
+            if not isinstance(event, dict):
+                invalid = True
+                break
             if event.get('event') == 'inbound':
-                processed = await process_inbound_email(event, db, classifier, email_service)
-                if processed:
-                    processed_count += 1
-        
-        return {"message": f"Processed {processed_count} emails"}
-        
+                window.append(event)
+            if len(window) >= WEBHOOK_WINDOW_SIZE:
+                await handle_window(window)
+                window = []
+    except ValueError:
+        invalid = True
+    
+    try:
+        if window:
+            await handle_window(window)
+        if WEBHOOK_MODE == "queue":
+            response = {"message": f"Queued {enqueued} emails", "duplicates": duplicates}
+        else:
+            # Every log row from the request lands in a single commit.
+            processed_count = await db.run_sync(writer.flush)
+            response = {"message": f"Processed {processed_count} emails"}
+            if writer.deferred:
+                deferred, _ = await db.run_sync(work_queue.enqueue_events, writer.deferred, CLASSIFIER_DEFER_SECONDS)
+                response["deferred"] = deferred
     except Exception as e:
         print(f"Webhook error: {str(e)}")
         raise HTTPException(status_code=500, detail="Webhook processing failed")
+    
+    if invalid:
+        # Queued events are deduplicated when SendGrid redelivers, but
+        # inline ones would be forwarded and logged twice: once any were
+        # handled, acknowledge them and report the unreadable rest instead.
+        if WEBHOOK_MODE == "queue" or not handled:
+            raise HTTPException(status_code=400, detail="Invalid webhook payload")
+        response["rejected"] = f"Payload was malformed after {handled} inbound events; the rest was skipped"
+    return response
+
+async def process_queued_event(event: dict, db: Session, writer: BatchWriter):
+    # Errors propagate so the worker pool can schedule a retry.
+    return await _process_inbound_email(event, db, get_classifier(), get_email_service(), writer, queued=True)
 
-async def process_inbound_email(event: dict, db: Session, classifier: AIEmailClassifier, email_service: EmailService):
+queue_workers = work_queue.QueueWorkerPool(process_queued_event)
+
+async def process_inbound_email(event: dict, db: Session, classifier: AIEmailClassifier, email_service: EmailService,
+                                writer: BatchWriter = None):
     try:
-        to_email = event.get('to', [{}])[0].get('email', '').lower()
-        from_email = event.get('from', '')
-        subject = event.get('subject', '')
-        text_body = event.get('text', '')
-        html_body = event.get('html', '')
-        
-        body = html_body if html_body else text_body
-        
-        temp_email = db.query(TempEmail).filter(
-            TempEmail.address == to_email,
-            TempEmail.is_active == True
-        ).first()
-        
-        if not temp_email:
-            return False
-        
-        if temp_email.expires_at and temp_email.expires_at < datetime.utcnow():
-            temp_email.is_active = False
-            db.commit()
-            return False
-        
-        user = db.query(User).filter(User.id == temp_email.user_id).first()
-        if not user:
-            return False
-        
-        forwarding_rules = db.query(ForwardingRule).filter(
-            ForwardingRule.user_id == user.id,
-            ForwardingRule.is_active == True
-        ).all()
-        
-        rule_result = classifier.apply_user_rules(from_email, subject, body, forwarding_rules)
-        
-        if rule_result:
-            action = rule_result["action"]
-            confidence = rule_result["confidence"]
-            reasoning = rule_result["reasoning"]
+        return await _process_inbound_email(event, db, classifier, email_service, writer)
+    except Exception as e:
+        print(f"Error processing email: {str(e)}")
+        await run_blocking(db.rollback)
+        return False
+
+# Outcomes for which process_inbound_email reports the email as not handled.
+_UNHANDLED_OUTCOMES = ("unrouted", "expired", "deferred")
+
+async def _process_inbound_email(event: dict, db: Session, classifier: AIEmailClassifier, email_service: EmailService,
+                                 writer: BatchWriter = None, queued: bool = False):
+    INBOUND_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        outcome = await _route_inbound_email(event, db, classifier, email_service, writer, queued)
+        return outcome not in _UNHANDLED_OUTCOMES
+    finally:
+        INBOUND_IN_FLIGHT.dec()
+        INBOUND_EMAIL_SECONDS.observe(value=time.perf_counter() - start)
+        INBOUND_OUTCOMES.inc(outcome)
+
+async def _route_inbound_email(event: dict, db: Session, classifier: AIEmailClassifier, email_service: EmailService,
+                               writer: BatchWriter, queued: bool) -> str:
+    deadline = time.monotonic() + CLASSIFIER_TIMEOUT_SECONDS
+    to_email = event.get('to', [{}])[0].get('email', '').lower()
+    from_email = event.get('from', '')
+    subject = event.get('subject', '')
+    text_body = event.get('text', '')
+    html_body = event.get('html', '')
+    
+    body = html_body if html_body else text_body
+    
+    now = datetime.utcnow()
+    route, rule_result, sender_result, campaign = await run_blocking(
+        _read_route, db, classifier, now, to_email, from_email, subject, body
+    )
+    if not route:
+        return "unrouted"
+    if _route_expired(route, now):
+        return "expired"
+    
+    if rule_result:
+        source = "rule"
+        action = rule_result["action"]
+        confidence = rule_result["confidence"]
+        reasoning = rule_result["reasoning"]
+    else:
+        ai_result = sender_result
+        if ai_result:
+            source = "override" if ai_result["reasoning"].startswith(sender_reputation.OVERRIDE_REASONING_PREFIX) \
+                else "reputation"
         else:
-            ai_result = classifier.classify_email(from_email, subject, body, temp_email.purpose)
-            action = ai_result["action"]
-            confidence = ai_result["confidence"]
-            reasoning = ai_result["reasoning"]
-        
-        success = True
-        if action == "forward":
-            success = email_service.forward_email(
+            source = "campaign"
+            # Copies of a campaign share the first decision made for it.
+            with INBOUND_STAGE_SECONDS.time("campaign_wait"):
+                ai_result = await campaign_index.reuse(campaign, deadline)
+        if not ai_result:
+            try:
+                source = "local"
+                local_prediction = None
+                if local_classifier.enabled:
+                    with INBOUND_STAGE_SECONDS.time("local_model"):
+                        local_prediction = await run_blocking(local_classifier.predict, from_email, subject, body)
+                ai_result = local_classifier.decide(local_prediction)
+                if not ai_result:
+                    source = "ai"
+                    with INBOUND_STAGE_SECONDS.time("llm"):
+                        ai_result = await get_batcher().classify(from_email, subject, body, route.purpose,
+                                                                 event.get('headers'), deadline)
+                    if ai_result.get("degraded"):
+                        source = "fallback"
+                    else:
+                        local_classifier.record_shadow(local_prediction, ai_result)
+            finally:
+                campaign_index.record(campaign, ai_result)
+            if ai_result.get("degraded") and CLASSIFIER_DEGRADED_POLICY == "queue":
+                if queued:
+                    # The worker pool retries it with backoff.
+                    raise ClassifierUnavailable(ai_result["reason"])
+                if writer:
+                    writer.defer(event)
+                else:
+                    await run_blocking(work_queue.enqueue_events, db, [event], CLASSIFIER_DEFER_SECONDS)
+                return "deferred"
+            elif ai_result.get("degraded") and CLASSIFIER_DEGRADED_POLICY == "rules_only":
+                ai_result = dict(ai_result, action="quarantine",
+                                 reasoning=f"AI classification failed: {ai_result['reason']}. "
+                                           "Quarantined: no user rule matched.")
+        action = ai_result["action"]
+        confidence = ai_result["confidence"]
+        reasoning = ai_result["reasoning"]
+    INBOUND_DECISIONS.inc(source, action)
+    
+    success = True
+    outbound = None
+    if action == "forward" and FORWARDING_MODE == "outbox":
+        # Delivery happens later, with retries, in OutboxSender.
+        with INBOUND_STAGE_SECONDS.time("forward"):
+            outbound = email_service.build_forward_message(
                 original_sender=from_email,
                 original_subject=subject,
                 original_body=body,
                 temp_email_address=to_email,
-                user_main_email=user.email
+                user_main_email=route.user_email
             )
-        
-        email_log = EmailLog(
-            temp_email_id=temp_email.id,
-            sender_email=from_email,
-            subject=subject,
-            body_preview=body[:200] if body else "",
-            action_taken=action if success else "failed",
-            ai_confidence_score=confidence,
-            ai_reasoning=reasoning
-        )
-        
-        db.add(email_log)
+    elif action == "forward":
+        # Routes are cached per worker, so the address may have been
+        # deactivated elsewhere since; nothing is sent to it once it is.
+        if not await run_blocking(_address_active, db, route.temp_email_id):
+            return "unrouted"
+        with INBOUND_STAGE_SECONDS.time("forward"):
+            success = await run_blocking(
+                email_service.forward_email,
+                original_sender=from_email,
+                original_subject=subject,
+                original_body=body,
+                temp_email_address=to_email,
+                user_main_email=route.user_email
+            )
+    
+    log_fields = dict(
+        temp_email_id=route.temp_email_id,
+        sender_email=from_email,
+        subject=subject,
+        body_preview=body[:200] if body else "",
+        action_taken=action if success else "failed",
+        ai_confidence_score=confidence,
+        ai_reasoning=reasoning
+    )
+    
+    if writer:
+        writer.add_log(route.user_id, outbound, **log_fields)
+        return log_fields["action_taken"]
+    
+    with INBOUND_STAGE_SECONDS.time("commit"):
+        await run_blocking(_write_log, db, route, outbound, log_fields)
+    
+    return log_fields["action_taken"]
+
+def _route_expired(route, now: datetime) -> bool:
+    # Deactivation is left to the expiry sweeper so this path never writes.
+    return bool(route.expires_at and route.expires_at < now)
+
+def _read_route(db: Session, classifier: AIEmailClassifier, now: datetime, to_email: str, from_email: str,
+                subject: str, body: str):
+    """The blocking part of routing an email, run in the I/O pool: the
+    routing table and the reputation index query on cache misses, and the
+    campaign index parses and MinHashes the body.
+    Returns (route, rule result, sender result, campaign match)."""
+    try:
+        with INBOUND_STAGE_SECONDS.time("lookup"):
+            route = routing_table.resolve(db, to_email)
+        rule_result = sender_result = None
+        if route and not _route_expired(route, now):
+            with INBOUND_STAGE_SECONDS.time("rules"):
+                rule_result = classifier.apply_user_rules(from_email, subject, body, route.rules)
+            # Overrides and lopsided sender histories are decided without a model.
+            if not rule_result:
+                with INBOUND_STAGE_SECONDS.time("reputation"):
+                    sender_result = reputation_index.decide(db, route.user_id, from_email)
+        # That was the last read: end the transaction so the pooled connection
+        # is not held while waiting on the model or SendGrid.
         db.commit()
-        
-        return True
-        
-    except Exception as e:
-        print(f"Error processing email: {str(e)}")
-        return False
\ No newline at end of file
+    except Exception:
+        db.rollback()
+        raise
+    campaign = None
+    if route and not _route_expired(route, now):
+        with INBOUND_STAGE_SECONDS.time("campaign"):
+            campaign = campaign_index.observe(from_email, subject, body, route.purpose, route.user_id,
+                                              route.temp_email_id)
+    return route, rule_result, sender_result, campaign
+
+def _address_active(db: Session, temp_email_id: int) -> bool:
+    try:
+        return db.query(TempEmail.id).filter(
+            TempEmail.id == temp_email_id,
+            TempEmail.is_active == True
+        ).first() is not None
+    finally:
+        db.commit()
+
+def _write_log(db: Session, route, outbound: dict, log_fields: dict):
+    log = EmailLog(**log_fields)
+    db.add(log)
+    if outbound:
+        db.flush()
+        db.add(OutboundEmail(**outbound, email_log_id=log.id))
+    dashboard_stats.record_email_log(db, route.user_id, route.temp_email_id, log_fields["action_taken"])
+    sender_reputation.record_email_logs(db, [log_fields])
+    db.commit()
\ No newline at end of file
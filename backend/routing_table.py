@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import ForwardingRule, TempEmail, User
+
+ROUTING_CACHE_TTL = int(os.getenv("ROUTING_CACHE_TTL", "60"))
+ROUTING_NEGATIVE_CACHE_TTL = int(os.getenv("ROUTING_NEGATIVE_CACHE_TTL", "300"))
+ROUTING_NEGATIVE_CACHE_SIZE = int(os.getenv("ROUTING_NEGATIVE_CACHE_SIZE", "100000"))
+# How often a worker checks whether any address was created elsewhere.
+ROUTING_GENERATION_INTERVAL = float(os.getenv("ROUTING_GENERATION_INTERVAL", "1.0"))
+
+
+class RuleSnapshot(NamedTuple):
+    id: int
+    user_id: int
+    keywords: str
+    action: str
+    is_active: bool
+
+
+class Route(NamedTuple):
+    temp_email_id: int
+    address: str
+    user_id: int
+    user_email: str
+    purpose: Optional[str]
+    expires_at: Optional[datetime]
+    rules: Tuple[RuleSnapshot, ...] = ()
+
+
+class RoutingTable:
+    """Per-process map from inbound address to everything needed to route it.
+
+    Entries expire after ROUTING_CACHE_TTL so changes made by other workers
+    are picked up; forwarding re-checks the address before anything is sent,
+    since it may have been deactivated elsewhere in the meantime. Unknown
+    addresses are cached separately; that cache is
+    dropped as soon as the highest temp_emails.id moves, so a freshly
+    created address is never rejected for longer than
+    ROUTING_GENERATION_INTERVAL.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[float, Route]] = {}
+        self._user_rules: Dict[int, Tuple[float, Tuple[RuleSnapshot, ...]]] = {}
+        self._negative = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked_at = 0.0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def warm(self, db: Session) -> int:
+        now = time.monotonic()
+        rules_by_user = {}
+        for rule in db.query(ForwardingRule).filter(ForwardingRule.is_active == True).order_by(ForwardingRule.id):
+            rules_by_user.setdefault(rule.user_id, []).append(self._snapshot_rule(rule))
+
+        rows = db.query(TempEmail, User.email).join(User, User.id == TempEmail.user_id).filter(
+            TempEmail.is_active == True
+        ).all()
+        generation = db.query(func.max(TempEmail.id)).scalar()
+
+        with self._lock:
+            for temp_email, user_email in rows:
+                self._routes[temp_email.address] = (now + ROUTING_CACHE_TTL, self._route(temp_email, user_email))
+            for user_id in {temp_email.user_id for temp_email, _ in rows}:
+                self._user_rules[user_id] = (now + ROUTING_CACHE_TTL, tuple(rules_by_user.get(user_id, ())))
+            self._negative.clear()
+            self._generation = generation
+            self._generation_checked_at = now
+        return len(rows)
+
+    def resolve(self, db: Session, address: str) -> Optional[Route]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._routes.get(address)
+            route = entry[1] if entry and entry[0] > now else None
+            negative_until = self._negative.get(address)
+
+        if route is None and negative_until is not None and negative_until > now and not self._generation_moved(db, now):
+            with self._lock:
+                self.negative_hits += 1
+            return None
+
+        if route is None:
+            with self._lock:
+                self.misses += 1
+            row = db.query(TempEmail, User.email).join(User, User.id == TempEmail.user_id).filter(
+                TempEmail.address == address,
+                TempEmail.is_active == True
+            ).first()
+            if not row:
+                with self._lock:
+                    self._negative[address] = now + ROUTING_NEGATIVE_CACHE_TTL
+                    self._negative.move_to_end(address)
+                    while len(self._negative) > ROUTING_NEGATIVE_CACHE_SIZE:
+                        self._negative.popitem(last=False)
+                return None
+            route = self._route(*row)
+            with self._lock:
+                self._routes[address] = (now + ROUTING_CACHE_TTL, route)
+                self._negative.pop(address, None)
+        else:
+            with self._lock:
+                self.hits += 1
+
+        return route._replace(rules=self._rules_for(db, route.user_id, now))
+
+    def invalidate_address(self, address: str):
+        with self._lock:
+            self._routes.pop(address, None)
+            self._negative.pop(address, None)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+            self._user_rules.clear()
+            self._negative.clear()
+            self._generation = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "routes": len(self._routes),
+                "negative_entries": len(self._negative),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses
+            }
+
+    def _rules_for(self, db: Session, user_id: int, now: float) -> Tuple[RuleSnapshot, ...]:
+        with self._lock:
+            entry = self._user_rules.get(user_id)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        rules = tuple(
+            self._snapshot_rule(rule) for rule in db.query(ForwardingRule).filter(
+                ForwardingRule.user_id == user_id,
+                ForwardingRule.is_active == True
+            ).order_by(ForwardingRule.id)
+        )
+        with self._lock:
+            self._user_rules[user_id] = (now + ROUTING_CACHE_TTL, rules)
+        return rules
+
+    def _generation_moved(self, db: Session, now: float) -> bool:
+        with self._lock:
+            if now - self._generation_checked_at < ROUTING_GENERATION_INTERVAL:
+                return False
+            self._generation_checked_at = now
+            previous = self._generation
+
+        generation = db.query(func.max(TempEmail.id)).scalar()
+        with self._lock:
+            self._generation = generation
+            if generation != previous:
+                self._negative.clear()
+                return True
+        return False
+
+    @staticmethod
+    def _route(temp_email: TempEmail, user_email: str) -> Route:
+        return Route(
+            temp_email_id=temp_email.id,
+            address=temp_email.address,
+            user_id=temp_email.user_id,
+            user_email=user_email,
+            purpose=temp_email.purpose,
+            expires_at=temp_email.expires_at
+        )
+
+    @staticmethod
+    def _snapshot_rule(rule: ForwardingRule) -> RuleSnapshot:
+        return RuleSnapshot(rule.id, rule.user_id, rule.keywords, rule.action, rule.is_active)
+
+
+routing_table = RoutingTable()
@@ -0,0 +1,121 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+RULE_CACHE_SIZE = 4096
+
+_TERMINAL = ""
+
+
+def _trie_pattern(node: dict) -> str:
+    # A trie-shaped alternation lets the regex engine follow one branch per
+    # character instead of retrying every keyword at every position.
+    alternatives = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char != _TERMINAL]
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1 and _TERMINAL not in node:
+        return alternatives[0]
+    group = "(?:" + "|".join(alternatives) + ")"
+    # Greedy optional: at any position the longest keyword wins.
+    return group + "?" if _TERMINAL in node else group
+
+
+class CompiledRuleSet:
+    """All of a user's active rules folded into a single regex.
+
+    Matches the semantics of checking each rule in order with
+    ``keyword in content``: the first rule (by list order) with any keyword
+    occurring anywhere in the content wins.
+    """
+
+    def __init__(self, forwarding_rules: list):
+        self.rules = [(rule.action, rule.keywords) for rule in forwarding_rules if rule.is_active]
+        self.always_matches = None
+
+        priorities = {}
+        for index, (_, keywords) in enumerate(self.rules):
+            for keyword in (kw.strip().lower() for kw in keywords.split(',')):
+                if not keyword:
+                    # An empty keyword is "in" every string.
+                    if self.always_matches is None:
+                        self.always_matches = index
+                    continue
+                priorities.setdefault(keyword, index)
+
+        trie = {}
+        for keyword in priorities:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[_TERMINAL] = True
+
+        # Only the longest keyword starting at a position is reported, so each
+        # keyword also carries the best priority of any keyword that is its
+        # prefix (those occur wherever it does).
+        self.priorities = {}
+        for keyword, priority in priorities.items():
+            for end in range(1, len(keyword)):
+                prefix_priority = priorities.get(keyword[:end])
+                if prefix_priority is not None and prefix_priority < priority:
+                    priority = prefix_priority
+            self.priorities[keyword] = priority
+
+        self.pattern = re.compile(f"(?=({_trie_pattern(trie)}))") if priorities else None
+
+    def match(self, content: str) -> Optional[int]:
+        best = self.always_matches
+        if self.pattern is None or best == 0:
+            return best
+        # Lookahead matches are zero-width, so every position is tried and
+        # overlapping keywords are all seen.
+        for found in self.pattern.finditer(content):
+            priority = self.priorities[found.group(1)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return best
+
+    def apply(self, sender_email: str, subject: str, body: str) -> Optional[Dict[str, Any]]:
+        if not self.rules:
+            return None
+        index = self.match(f"{sender_email} {subject} {body}".lower())
+        if index is None:
+            return None
+        action, keywords = self.rules[index]
+        return {
+            "action": action,
+            "confidence": 1.0,
+            "reasoning": f"Matched user rule: {keywords}"
+        }
+
+
+class RuleSetCache:
+    def __init__(self, max_entries: int = RULE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, forwarding_rules: list) -> CompiledRuleSet:
+        # Rules arrive from the database on every email, so their contents
+        # double as the cache version: any edit produces a new signature and
+        # the next email recompiles.
+        signature = tuple((rule.id, rule.keywords, rule.action, rule.is_active) for rule in forwarding_rules)
+        user_id = forwarding_rules[0].user_id if forwarding_rules else None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        compiled = CompiledRuleSet(forwarding_rules)
+        with self._lock:
+            self._entries[user_id] = (signature, compiled)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compiled
+
+
+compiled_rules = RuleSetCache()
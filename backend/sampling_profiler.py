@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# Leaf frames of threads parked waiting for work; dropped unless idle stacks
+# are asked for, so the profile shows where the busy time goes.
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("base_events.py", "_run_once"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """Statistical profiler over every Python thread in the process.
+
+    The calling thread samples the other threads' stacks with
+    sys._current_frames() every interval, so the profiled code runs
+    unmodified and the cost falls on the profiling thread. Only one profile
+    runs at a time. Output is in the collapsed-stack format read by
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_profile: Optional[Dict[str, float]] = None
+
+    def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> Counter:
+        """Sample for seconds; returns collapsed stack -> sample count."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            return self._sample(min(seconds, PROFILE_MAX_SECONDS), interval, include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> Counter:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        start = time.monotonic()
+        deadline = start + seconds
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                code = frame.f_code
+                if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(frames))] += 1
+            samples += 1
+            if time.monotonic() + interval > deadline:
+                break
+            time.sleep(interval)
+        self.last_profile = {
+            "seconds": round(time.monotonic() - start, 3),
+            "interval": interval,
+            "samples": samples,
+            "stacks": len(stacks)
+        }
+        return stacks
+
+    @staticmethod
+    def collapsed(stacks: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+sampling_profiler = SamplingProfiler()
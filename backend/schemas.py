@@ -27,6 +27,9 @@ class TempEmailBase(BaseModel):
 class TempEmailCreate(TempEmailBase):
     pass
 
+class TempEmailBulkCreate(TempEmailBase):
+    count: int
+
 class TempEmail(TempEmailBase):
     id: int
     address: str
@@ -69,6 +72,21 @@ class ForwardingRule(ForwardingRuleBase):
     class Config:
         from_attributes = True
 
+class SenderOverrideBase(BaseModel):
+    sender: str  # an address, or '@domain'
+    action: str
+
+class SenderOverrideCreate(SenderOverrideBase):
+    pass
+
+class SenderOverride(SenderOverrideBase):
+    id: int
+    user_id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 class Token(BaseModel):
     access_token: str
     token_type: str
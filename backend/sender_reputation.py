@@ -0,0 +1,307 @@
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, not_, or_
+from sqlalchemy.orm import Session
+
+from models import EmailLog, SenderOverride, SenderReputation
+from local_classifier import LOCAL_REASONING_PREFIX
+from campaign_index import CAMPAIGN_REASONING_PREFIX
+import dashboard_stats
+
+# 'off' only keeps the index up to date, 'active' lets it skip the LLM.
+# Per-user overrides apply in both modes.
+SENDER_REPUTATION_MODE = os.getenv("SENDER_REPUTATION_MODE", "active")
+SENDER_REPUTATION_MIN_EMAILS = int(os.getenv("SENDER_REPUTATION_MIN_EMAILS", "20"))
+# A whole domain needs more history than one address: shared mail providers
+# carry every kind of mail.
+SENDER_REPUTATION_DOMAIN_MIN_EMAILS = int(os.getenv("SENDER_REPUTATION_DOMAIN_MIN_EMAILS", "100"))
+# Share of past emails that must agree. Deleting wanted mail costs more than
+# forwarding an unwanted newsletter, so delete and quarantine need a more
+# lopsided history than forward.
+SENDER_REPUTATION_FORWARD_RATIO = float(os.getenv("SENDER_REPUTATION_FORWARD_RATIO", "0.95"))
+SENDER_REPUTATION_DELETE_RATIO = float(os.getenv("SENDER_REPUTATION_DELETE_RATIO", "0.99"))
+SENDER_REPUTATION_MIN_CONFIDENCE = float(os.getenv("SENDER_REPUTATION_MIN_CONFIDENCE", "0.8"))
+SENDER_REPUTATION_CACHE_TTL = int(os.getenv("SENDER_REPUTATION_CACHE_TTL", "300"))
+SENDER_REPUTATION_CACHE_SIZE = int(os.getenv("SENDER_REPUTATION_CACHE_SIZE", "100000"))
+# Mailbox providers anyone can sign up with: their domain says nothing about
+# the sender, so only addresses there are judged.
+SENDER_REPUTATION_SHARED_DOMAINS = frozenset(
+    domain.strip().lower() for domain in os.getenv(
+        "SENDER_REPUTATION_SHARED_DOMAINS",
+        "gmail.com,googlemail.com,yahoo.com,ymail.com,outlook.com,hotmail.com,live.com,msn.com,aol.com,"
+        "icloud.com,me.com,mac.com,proton.me,protonmail.com,gmx.com,gmx.de,gmx.net,web.de,mail.com,"
+        "yandex.ru,mail.ru,zoho.com,qq.com,163.com"
+    ).split(",") if domain.strip()
+)
+
+REPUTATION_REASONING_PREFIX = "Sender reputation"
+OVERRIDE_REASONING_PREFIX = "Sender override"
+
+# Only independent judgements build reputation: user rules and overrides are
+# one user's preference, failures say nothing, and counting the index's own
+# (or a reused campaign) decisions would let it reinforce itself.
+_EXCLUDED_REASONING = (
+    "Matched user rule", LOCAL_REASONING_PREFIX, "AI classification failed",
+    REPUTATION_REASONING_PREFIX, OVERRIDE_REASONING_PREFIX, CAMPAIGN_REASONING_PREFIX
+)
+
+# EmailLog.action_taken -> SenderReputation counter column.
+REPUTATION_ACTION_COLUMNS = {
+    "forward": "emails_forwarded",
+    "delete": "emails_deleted",
+    "quarantine": "emails_quarantined",
+}
+_PAST_TENSE = {"forward": "forwarded", "delete": "deleted", "quarantine": "quarantined"}
+
+
+class Reputation(NamedTuple):
+    sender: str
+    emails_forwarded: int
+    emails_deleted: int
+    emails_quarantined: int
+    confidence_total: float
+
+    @property
+    def total(self) -> int:
+        return self.emails_forwarded + self.emails_deleted + self.emails_quarantined
+
+
+def sender_keys(sender_email: str) -> List[str]:
+    """The index keys for a sender: the address, then '@domain'."""
+    address = parseaddr(sender_email or "")[1].strip().lower()
+    if "@" not in address:
+        return []
+    return [address, "@" + address.rsplit("@", 1)[1]]
+
+
+def _shared_domain(key: str) -> bool:
+    return key.startswith("@") and key[1:] in SENDER_REPUTATION_SHARED_DOMAINS
+
+
+def reputation_keys(sender_email: str) -> List[str]:
+    """sender_keys() without the domain of a shared mailbox provider."""
+    return [key for key in sender_keys(sender_email) if not _shared_domain(key)]
+
+
+def counts_toward_reputation(fields: Dict[str, Any]) -> bool:
+    return (fields.get("action_taken") in REPUTATION_ACTION_COLUMNS
+            and not (fields.get("ai_reasoning") or "").startswith(_EXCLUDED_REASONING))
+
+
+def record_email_logs(db: Session, logs: Iterable[Dict[str, Any]]):
+    """Fold EmailLog rows into the index. Call before the commit that inserts them."""
+    deltas: Dict[str, Dict[str, float]] = {}
+    for fields in logs:
+        if not counts_toward_reputation(fields):
+            continue
+        column = REPUTATION_ACTION_COLUMNS[fields["action_taken"]]
+        for key in reputation_keys(fields["sender_email"]):
+            delta = deltas.setdefault(key, {"confidence_total": 0.0})
+            delta[column] = delta.get(column, 0) + 1
+            delta["confidence_total"] += fields.get("ai_confidence_score") or 0.0
+
+    now = datetime.utcnow()
+    # Sorted so concurrent batches take row locks in the same order.
+    for key in sorted(deltas):
+        dashboard_stats.increment(db, SenderReputation, {"sender": key}, deltas[key], {"last_seen_at": now})
+
+
+def rebuild_reputation(db: Session) -> int:
+    """Recompute the index from email_logs."""
+    db.query(SenderReputation).delete(synchronize_session=False)
+
+    rows: Dict[str, SenderReputation] = {}
+    for sender_email, action, count, confidence_total, last_seen_at in db.query(
+        EmailLog.sender_email,
+        EmailLog.action_taken,
+        func.count(EmailLog.id),
+        func.coalesce(func.sum(EmailLog.ai_confidence_score), 0.0),
+        func.max(EmailLog.created_at)
+    ).filter(
+        EmailLog.action_taken.in_(REPUTATION_ACTION_COLUMNS),
+        or_(EmailLog.ai_reasoning.is_(None),
+            not_(or_(*(EmailLog.ai_reasoning.like(f"{prefix}%") for prefix in _EXCLUDED_REASONING))))
+    ).group_by(EmailLog.sender_email, EmailLog.action_taken):
+        for key in reputation_keys(sender_email):
+            row = rows.setdefault(key, SenderReputation(
+                sender=key, emails_forwarded=0, emails_deleted=0, emails_quarantined=0, confidence_total=0.0
+            ))
+            column = REPUTATION_ACTION_COLUMNS[action]
+            setattr(row, column, getattr(row, column) + count)
+            row.confidence_total += confidence_total
+            if row.last_seen_at is None or (last_seen_at and last_seen_at > row.last_seen_at):
+                row.last_seen_at = last_seen_at
+
+    db.add_all(rows.values())
+    db.commit()
+    return len(rows)
+
+
+class SenderReputationIndex:
+    """Decides known senders without the LLM.
+
+    A user's own overrides win outright. Otherwise the sender's address, then
+    its domain, is looked up in sender_reputation, and a decision is made
+    only if enough past emails agree. Lookups are cached per process for
+    SENDER_REPUTATION_CACHE_TTL, so counts may lag slightly behind the table.
+    """
+
+    def __init__(self, mode: str = SENDER_REPUTATION_MODE):
+        self.mode = mode
+        self._reputations: "OrderedDict[str, Tuple[float, Optional[Reputation]]]" = OrderedDict()
+        self._overrides: Dict[int, Tuple[float, Dict[str, str]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reputation_decisions = 0
+        self.override_decisions = 0
+
+    def decide(self, db: Session, user_id: int, sender_email: str) -> Optional[Dict[str, Any]]:
+        keys = sender_keys(sender_email)
+        if not keys:
+            return None
+
+        overrides = self._overrides_for(db, user_id)
+        for key in keys:
+            action = overrides.get(key)
+            if action:
+                with self._lock:
+                    self.override_decisions += 1
+                return {
+                    "action": action,
+                    "confidence": 1.0,
+                    "reasoning": f"{OVERRIDE_REASONING_PREFIX}: always {action} mail from {key}"
+                }
+
+        if self.mode != "active":
+            return None
+        keys = [key for key in keys if not _shared_domain(key)]
+        reputations = self._lookup(db, keys)
+        for key, min_emails in zip(keys, (SENDER_REPUTATION_MIN_EMAILS, SENDER_REPUTATION_DOMAIN_MIN_EMAILS)):
+            reputation = reputations.get(key)
+            if reputation is None or reputation.total < min_emails:
+                continue
+            decision = self._judge(reputation)
+            if decision:
+                with self._lock:
+                    self.reputation_decisions += 1
+            # An address with a mixed record of its own is not judged by its
+            # domain.
+            return decision
+        return None
+
+    def invalidate_user(self, user_id: int):
+        """Call after a user's sender overrides change."""
+        with self._lock:
+            self._overrides.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._reputations.clear()
+            self._overrides.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "cached_senders": len(self._reputations),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reputation_decisions": self.reputation_decisions,
+                "override_decisions": self.override_decisions
+            }
+
+    @staticmethod
+    def _judge(reputation: Reputation) -> Optional[Dict[str, Any]]:
+        total = reputation.total
+        if reputation.confidence_total / total < SENDER_REPUTATION_MIN_CONFIDENCE:
+            return None
+        count, action = max(
+            (reputation.emails_forwarded, "forward"),
+            (reputation.emails_deleted, "delete"),
+            (reputation.emails_quarantined, "quarantine")
+        )
+        ratio = count / total
+        required = SENDER_REPUTATION_FORWARD_RATIO if action == "forward" else SENDER_REPUTATION_DELETE_RATIO
+        if ratio < required:
+            return None
+        return {
+            "action": action,
+            "confidence": round(ratio, 4),
+            "reasoning": f"{REPUTATION_REASONING_PREFIX}: {count} of {total} emails from {reputation.sender} "
+                         f"were {_PAST_TENSE[action]}"
+        }
+
+    def _lookup(self, db: Session, keys: List[str]) -> Dict[str, Optional[Reputation]]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._reputations.get(key)
+                if entry and entry[0] > now:
+                    found[key] = entry[1]
+            if len(found) == len(keys):
+                self.hits += 1
+                return found
+            self.misses += 1
+
+        missing = [key for key in keys if key not in found]
+        rows = {
+            row.sender: Reputation(row.sender, row.emails_forwarded, row.emails_deleted,
+                                   row.emails_quarantined, row.confidence_total)
+            for row in db.query(SenderReputation).filter(SenderReputation.sender.in_(missing))
+        }
+        with self._lock:
+            for key in missing:
+                # Unknown senders are cached too, so a new sender costs one
+                # query per TTL rather than one per email.
+                found[key] = rows.get(key)
+                self._reputations[key] = (now + SENDER_REPUTATION_CACHE_TTL, found[key])
+                self._reputations.move_to_end(key)
+            while len(self._reputations) > SENDER_REPUTATION_CACHE_SIZE:
+                self._reputations.popitem(last=False)
+        return found
+
+    def _overrides_for(self, db: Session, user_id: int) -> Dict[str, str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._overrides.get(user_id)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        overrides = {
+            sender: action for sender, action in db.query(SenderOverride.sender, SenderOverride.action).filter(
+                SenderOverride.user_id == user_id
+            )
+        }
+        with self._lock:
+            self._overrides[user_id] = (now + SENDER_REPUTATION_CACHE_TTL, overrides)
+        return overrides
+
+
+reputation_index = SenderReputationIndex()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+    from models import Base
+
+    parser = argparse.ArgumentParser(description="Maintain the sender reputation index")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        senders = rebuild_reputation(db)
+        print(f"Rebuilt sender reputation for {senders} addresses and domains")
+    finally:
+        db.close()
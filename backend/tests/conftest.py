@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+from upstream_stubs import start_openai_stub, start_sendgrid_stub
+
+
+@pytest.fixture(scope="session")
+def upstreams():
+    """Local OpenAI and SendGrid stand-ins, wired in before the app is imported."""
+    openai_stub = start_openai_stub()
+    sendgrid_stub = start_sendgrid_stub()
+    tmp_dir = tempfile.mkdtemp()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp_dir, 'test.db')}",
+        "OPENAI_BASE_URL": f"{openai_stub.url}/v1",
+        "SENDGRID_API_URL": f"{sendgrid_stub.url}/v3/mail/send",
+        "OPENAI_API_KEY": "sk-test",
+        "SENDGRID_API_KEY": "SG.test",
+        "OPENAI_RATE_LIMIT_FILE": os.path.join(tmp_dir, "ratelimit.json"),
+        # No budget configured: a 429 must still be waited out, not retried at once.
+        "OPENAI_RPM_LIMIT": "0",
+        "OPENAI_TPM_LIMIT": "0",
+        "CLASSIFIER_TIMEOUT_SECONDS": "3",
+        "LOCAL_CLASSIFIER_SNAPSHOT_PATH": os.path.join(tmp_dir, "local_classifier.npz"),
+    })
+    try:
+        yield openai_stub, sendgrid_stub
+    finally:
+        openai_stub.stop()
+        sendgrid_stub.stop()
+
+
+@pytest.fixture(scope="session")
+def client(upstreams):
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db(client):
+    """A session on the test database; the app's startup has created the tables."""
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def new_user(db):
+    """Creates a user with an address and returns (user, temp_email, auth headers)."""
+    import uuid
+
+    from models import TempEmail, TempEmailStats, User, UserStats
+    from routers.auth import create_access_token
+
+    def create(purpose=None):
+        name = uuid.uuid4().hex[:8]
+        user = User(email=f"{name}@example.com", hashed_password="x")
+        db.add(user)
+        db.flush()
+        db.add(UserStats(user_id=user.id, total_temp_emails=1, active_temp_emails=1))
+        temp_email = TempEmail(user_id=user.id, address=f"temp-{name}@example.com", purpose=purpose)
+        db.add(temp_email)
+        db.flush()
+        db.add(TempEmailStats(temp_email_id=temp_email.id, user_id=user.id))
+        db.commit()
+        token = create_access_token(data={"sub": user.email, "uid": user.id})
+        return user, temp_email, {"Authorization": f"Bearer {token}"}
+
+    return create
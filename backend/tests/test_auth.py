@@ -0,0 +1,78 @@
+"""Principal cache and account state on authenticated requests."""
+import pytest
+
+
+@pytest.fixture
+def admin_headers(monkeypatch):
+    import routers.admin
+
+    monkeypatch.setattr(routers.admin, "ADMIN_TOKEN", "admin-secret")
+    return {"Authorization": "Bearer admin-secret"}
+
+
+def test_register_and_login(client):
+    credentials = {"email": "signup@example.com", "password": "correct horse"}
+    assert client.post("/api/auth/register", json=credentials).status_code == 200
+
+    assert client.post("/api/auth/login", json=dict(credentials, password="wrong")).status_code == 401
+    token = client.post("/api/auth/login", json=credentials).json()["access_token"]
+    me = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert me.status_code == 200 and me.json()["email"] == "signup@example.com"
+
+
+def test_principal_is_cached_per_token(client, db, new_user):
+    from models import User
+    from principal_cache import principal_cache
+
+    user, _, headers = new_user()
+    hits = principal_cache.stats()["hits"]
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert principal_cache.stats()["hits"] == hits + 1
+
+    # A change made behind the cache's back is not seen until it expires...
+    db.query(User).filter(User.id == user.id).update({User.is_active: False})
+    db.commit()
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+
+
+def test_deactivated_user_is_refused_at_once(client, new_user, admin_headers):
+    user, _, headers = new_user()
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+
+    # ...but deactivation through the API drops the cached principal.
+    assert client.post(f"/api/admin/users/{user.id}/deactivate", headers=admin_headers).status_code == 200
+    response = client.get("/api/auth/me", headers=headers)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Inactive user"
+
+
+def test_invalid_token_is_rejected(client):
+    assert client.get("/api/auth/me", headers={"Authorization": "Bearer not-a-jwt"}).status_code == 401
+
+
+def test_invalidate_user_only_drops_that_user():
+    from datetime import datetime
+
+    from principal_cache import Principal, PrincipalCache
+
+    cache = PrincipalCache(ttl_seconds=60)
+    cache.set("a1", Principal(1, "a@example.com", True, datetime.utcnow()))
+    cache.set("a2", Principal(1, "a@example.com", True, datetime.utcnow()))
+    cache.set("b1", Principal(2, "b@example.com", True, datetime.utcnow()))
+
+    cache.invalidate_user(1)
+
+    assert cache.get("a1") is None and cache.get("a2") is None
+    assert cache.get("b1").id == 2
+
+
+def test_cached_principal_never_outlives_its_token():
+    import time
+    from datetime import datetime
+
+    from principal_cache import Principal, PrincipalCache
+
+    cache = PrincipalCache(ttl_seconds=60)
+    cache.set("expired", Principal(1, "a@example.com", True, datetime.utcnow()), token_expires_at=time.time() - 1)
+    assert cache.get("expired") is None
@@ -0,0 +1,77 @@
+"""Circuit breaker state changes."""
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.record_failure(0.01, "upstream error")
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=30)
+    fail(breaker, 2)
+    breaker.record_success(0.01)
+    fail(breaker, 2)
+    assert breaker.state == "closed" and breaker.allow()
+
+    fail(breaker, 1)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    fail(breaker, 1)
+
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.stats()["state"] == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    fail(breaker, 1)
+    clock[0] += 30
+    assert breaker.allow()
+
+    breaker.record_success(0.01)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_period(clock):
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_seconds=30)
+    fail(breaker, 5)
+    clock[0] += 30
+    assert breaker.allow()
+
+    fail(breaker, 1)
+    assert breaker.state == "open"
+    assert breaker.stats()["times_opened"] == 2
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_stats_report_latency_percentiles():
+    breaker = CircuitBreaker("test")
+    for latency in range(1, 101):
+        breaker.record_success(latency / 1000)
+    latency_ms = breaker.stats()["latency_ms"]
+    assert latency_ms == {"p50": 51.0, "p95": 96.0, "p99": 100.0, "max": 100.0}
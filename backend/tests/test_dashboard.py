@@ -0,0 +1,76 @@
+"""Keyset pagination of email logs and per-user campaign summaries."""
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def dashboard(client):
+    import routers.dashboard
+
+    return routers.dashboard
+
+
+def test_cursor_round_trip(dashboard):
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert dashboard.decode_cursor(dashboard.encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+# Not base64, cut short, and a valid timestamp with a non-numeric id.
+@pytest.mark.parametrize("cursor", ["garbage", "MjAyNC0wMS0wMVQwMDow", "MjAyNC0wMS0wMVQwMDowMDowMHxub3Q="])
+def test_invalid_cursor_is_a_400(dashboard, cursor):
+    with pytest.raises(HTTPException) as raised:
+        dashboard.decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+
+def test_pages_cover_every_log_once(client, db, new_user):
+    from models import EmailLog
+
+    user, temp_email, headers = new_user()
+    _, other_temp_email, _ = new_user()
+    # Shared timestamps: the id breaks ties between pages.
+    timestamps = [datetime(2024, 1, 1, 0, 0, second // 3) for second in range(10)]
+    db.add_all(EmailLog(temp_email_id=temp_email.id, sender_email="a@b.com", subject=f"log {n}",
+                        action_taken="forward", created_at=created_at) for n, created_at in enumerate(timestamps))
+    db.add(EmailLog(temp_email_id=other_temp_email.id, sender_email="a@b.com", subject="someone else's",
+                    action_taken="forward", created_at=timestamps[0]))
+    db.commit()
+
+    subjects, cursor = [], None
+    while True:
+        response = client.get("/api/dashboard/emails", headers=headers,
+                              params={"limit": 4, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        subjects += [log["subject"] for log in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert subjects == [f"log {n}" for n in reversed(range(10))]
+
+
+def test_bad_cursor_on_the_endpoint(client, new_user):
+    _, _, headers = new_user()
+    response = client.get("/api/dashboard/emails", headers=headers, params={"cursor": "garbage"})
+    assert response.status_code == 400
+
+
+def test_campaigns_only_count_the_users_own_copies(client, new_user):
+    from campaign_index import campaign_index
+
+    first, first_address, first_headers = new_user()
+    second, second_address, second_headers = new_user()
+    body = "Our summer collection is here with new arrivals in every size and colour, " \
+           "free delivery on all orders and easy returns within thirty days of purchase."
+    for user, address, sender in [(first, first_address, "news@shop.example.com")] * 3 + \
+                                 [(second, second_address, "promo@other.example.com")] * 4:
+        campaign_index.observe(sender, "Summer collection", body, None, user.id, address.id)
+
+    (mine,) = client.get("/api/dashboard/campaigns", headers=first_headers).json()
+    (theirs,) = client.get("/api/dashboard/campaigns", headers=second_headers).json()
+
+    assert mine["id"] == theirs["id"]
+    assert (mine["emails"], mine["addresses"], mine["sender_domains"]) == (3, 1, ["shop.example.com"])
+    assert (theirs["emails"], theirs["addresses"], theirs["sender_domains"]) == (4, 1, ["other.example.com"])
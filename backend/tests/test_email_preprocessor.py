@@ -0,0 +1,22 @@
+"""Trimming quoted replies and signatures before classification."""
+from email_preprocessor import strip_quoted_and_signature
+
+
+def test_underscore_divider_keeps_the_rest_of_the_body():
+    text = "Order confirmed\n____________\nItems: 2 shirts\nTotal: $40"
+    assert strip_quoted_and_signature(text) == text
+
+
+def test_outlook_reply_separator_cuts_the_quoted_message():
+    text = "Thanks, see you then\n________________________________\n\nFrom: Alice\nSent: Monday\nSubject: Lunch"
+    assert strip_quoted_and_signature(text) == "Thanks, see you then"
+
+
+def test_signature_and_reply_headers_cut_the_body():
+    assert strip_quoted_and_signature("Hi\n-- \nBob\nAcme") == "Hi"
+    assert strip_quoted_and_signature("Yes\nSent from my iPhone") == "Yes"
+    assert strip_quoted_and_signature("Sure\nOn Mon, Alice wrote:\n> Lunch?") == "Sure"
+
+
+def test_quoted_lines_are_dropped():
+    assert strip_quoted_and_signature("> old\nnew\n> older") == "new"
@@ -0,0 +1,143 @@
+"""Streaming JSON splitter and Inbound Parse multipart limits."""
+import asyncio
+import json
+
+import pytest
+
+from inbound_parser import InboundParseForm, JsonArraySplitter
+
+
+def split(payload: str, chunk_size: int, **limits):
+    splitter = JsonArraySplitter(**limits)
+    data = payload.encode("utf-8")
+    objects = []
+    for start in range(0, len(data), chunk_size):
+        objects.extend(splitter.feed(data[start:start + chunk_size]))
+    return objects + splitter.close()
+
+
+EVENTS = [
+    {"event": "inbound", "subject": "café ☃ \U0001F600", "text": 'quote " and \\ backslash'},
+    {"nested": {"list": [1, {"deep": "]}"}], "empty": {}}},
+    {"escapes": "line\nbreak\ttab \u0001 😀"},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 100000])
+def test_splits_across_any_chunk_boundary(chunk_size):
+    payload = json.dumps(EVENTS)
+    assert [json.loads(raw) for raw in split(payload, chunk_size)] == EVENTS
+    # Unescaped UTF-8 splits multi-byte characters across chunks.
+    payload = json.dumps(EVENTS, ensure_ascii=False)
+    assert [json.loads(raw) for raw in split(payload, chunk_size)] == EVENTS
+
+
+def test_objects_are_returned_as_soon_as_they_complete():
+    splitter = JsonArraySplitter()
+    assert splitter.feed(b'[{"a": 1}, {"b"') == ['{"a": 1}']
+    assert splitter.feed(b': 2}]') == ['{"b": 2}']
+    assert splitter.close() == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_long_strings_are_truncated(chunk_size):
+    payload = json.dumps([{"text": "x" * 50, "subject": "short"}])
+    (raw,) = split(payload, chunk_size, max_string_chars=10)
+    assert json.loads(raw) == {"text": "x" * 10, "subject": "short"}
+
+
+def test_truncation_keeps_escapes_whole():
+    # Keys are strings too, so this one stays under the cap.
+    payload = json.dumps([{"t": "ab\U0001F600\U0001F600cd"}])
+    for chunk_size in (1, 3, 1000):
+        (raw,) = split(payload, chunk_size, max_string_chars=3)
+        # The pair counts as one character and is never cut in half.
+        assert json.loads(raw) == {"t": "ab\U0001F600"}
+
+
+def test_oversized_event_is_rejected():
+    payload = json.dumps([{"field%d" % n: "v" for n in range(100)}])
+    with pytest.raises(ValueError, match="too large"):
+        split(payload, 64, max_object_chars=200)
+
+
+@pytest.mark.parametrize("payload, message", [
+    ('{"a": 1}', "Expected a JSON array"),
+    ('[1, 2]', "Expected a JSON object"),
+    ('[{"a": 1}', "Unterminated"),
+    ('[{"a": 1}] x', "after JSON array"),
+])
+def test_malformed_payloads_are_rejected(payload, message):
+    with pytest.raises(ValueError, match=message):
+        split(payload, 4)
+
+
+BOUNDARY = "xYzZY"
+
+
+def multipart(fields, files=(), boundary=BOUNDARY):
+    body = b""
+    for name, value in fields:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n").encode() + value + b"\r\n"
+    for name, filename, value in files:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: application/pdf\r\n\r\n").encode() + value + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+def parse(body: bytes, chunk_size: int = 1000):
+    async def stream():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    form = InboundParseForm(f"multipart/form-data; boundary={BOUNDARY}")
+    return asyncio.run(form.parse(stream()))
+
+
+def test_multipart_form_becomes_one_event_per_recipient():
+    body = multipart([
+        ("from", b"Shop <store@shop.example.com>"),
+        ("subject", "Café".encode("latin-1")),
+        ("charsets", b'{"subject": "iso-8859-1"}'),
+        ("envelope", b'{"to": ["a@example.com", "b@example.com"], "from": "bounce@shop.example.com"}'),
+        ("text", b"Hello"),
+    ], files=[("attachment1", "invoice.pdf", b"%PDF" * 100)])
+
+    events = parse(body, chunk_size=7).events()
+
+    assert [event["to"] for event in events] == [[{"email": "a@example.com"}], [{"email": "b@example.com"}]]
+    assert events[0]["from"] == "store@shop.example.com"
+    assert events[0]["subject"] == "Café"
+    assert events[0]["attachments"] == [
+        {"name": "attachment1", "filename": "invoice.pdf", "content_type": "application/pdf", "size": 400}
+    ]
+
+
+def test_multipart_field_is_capped(monkeypatch):
+    import inbound_parser
+
+    monkeypatch.setattr(inbound_parser, "INBOUND_MAX_FIELD_CHARS", 5)
+    form = parse(multipart([("text", b"0123456789" * 10)]))
+    assert form.fields["text"] == "01234"
+
+
+def test_multipart_part_count_is_capped(monkeypatch):
+    import inbound_parser
+
+    monkeypatch.setattr(inbound_parser, "INBOUND_MAX_PARTS", 3)
+    with pytest.raises(ValueError, match="Too many multipart parts"):
+        parse(multipart([(f"field{n}", b"v") for n in range(4)]))
+
+
+def test_multipart_body_size_is_capped(monkeypatch):
+    import inbound_parser
+
+    monkeypatch.setattr(inbound_parser, "INBOUND_MAX_BODY_BYTES", 100)
+    with pytest.raises(ValueError, match="Multipart body too large"):
+        parse(multipart([("text", b"x" * 200)]), chunk_size=50)
+
+
+def test_multipart_header_is_capped():
+    body = (f"--{BOUNDARY}\r\nX-Padding: ").encode() + b"a" * 10000 + b"\r\n\r\nv\r\n" + f"--{BOUNDARY}--\r\n".encode()
+    with pytest.raises(ValueError, match="Multipart header too large"):
+        parse(body)
@@ -0,0 +1,149 @@
+"""Outbox delivery: Retry-After handling, backoff, and abandoned forwards."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def outbox(upstreams):
+    # Imported once the test database is configured.
+    import outbox
+
+    return outbox
+
+
+@pytest.mark.parametrize("value, seconds", [("120", 120), ("0", 0), ("-5", 0), ("1.5", 1.5)])
+def test_retry_after_seconds(outbox, value, seconds):
+    assert outbox.parse_retry_after(value) == seconds
+
+
+def test_retry_after_http_date(outbox):
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=90)
+    assert 85 < outbox.parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 90
+    assert outbox.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+@pytest.mark.parametrize("value", [None, "", "soon", "nan", "inf"])
+def test_retry_after_garbage(outbox, value):
+    assert outbox.parse_retry_after(value) is None
+
+
+def test_backoff_is_jittered_and_capped(outbox, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_BASE", 2)
+    monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_MAX", 600)
+    monkeypatch.setattr(outbox.random, "uniform", lambda low, high: high)
+    assert [outbox.backoff_delay(attempts) for attempts in (1, 2, 3, 20)] == [2, 4, 8, 600]
+    # Retry-After is a floor, never shortened by jitter.
+    monkeypatch.setattr(outbox.random, "uniform", lambda low, high: low)
+    assert outbox.backoff_delay(1) == 0
+    assert outbox.backoff_delay(1, retry_after=30) == 30
+
+
+@pytest.fixture
+def forward(db, new_user):
+    """Queues one forward, with its log row, and returns the user and the message id."""
+    import dashboard_stats
+    from models import EmailLog, OutboundEmail
+
+    # Each test sends only the message it queued.
+    db.query(OutboundEmail).update({OutboundEmail.status: "sent"})
+
+    def create():
+        user, temp_email, _ = new_user()
+        log = EmailLog(temp_email_id=temp_email.id, sender_email="store@shop.example.com", subject="Shipped",
+                       action_taken="forward")
+        db.add(log)
+        db.flush()
+        dashboard_stats.record_email_log(db, user.id, temp_email.id, "forward")
+        message = OutboundEmail(from_email="forwarder@example.com", to_email=user.email, subject="Shipped",
+                                html_content="<p>Shipped</p>", email_log_id=log.id)
+        db.add(message)
+        db.commit()
+        return user, temp_email, message.id
+
+    return create
+
+
+def send_all(outbox, responses):
+    """Runs one sender pass against a fake SendGrid answering from responses."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return responses.pop(0)
+
+    async def run():
+        sender = outbox.OutboxSender(api_key="SG.test")
+        sender.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        sender.semaphore = asyncio.Semaphore(1)
+        try:
+            return await sender.run_once()
+        finally:
+            await sender.client.aclose()
+
+    return asyncio.run(run()), requests
+
+
+def test_rate_limited_send_is_retried_after_retry_after(db, outbox, forward):
+    from models import OutboundEmail
+
+    _, _, message_id = forward()
+    processed, requests = send_all(outbox, [httpx.Response(429, headers={"Retry-After": "120"})])
+
+    assert processed == 1 and len(requests) == 1
+    message = db.get(OutboundEmail, message_id)
+    assert message.status == "pending"
+    assert message.next_attempt_at >= datetime.utcnow() + timedelta(seconds=115)
+    assert "429" in message.last_error
+
+
+def test_sent_message(db, outbox, forward):
+    from models import OutboundEmail
+
+    user, _, message_id = forward()
+    _, requests = send_all(outbox, [httpx.Response(202)])
+
+    assert user.email in requests[0].content.decode()
+    message = db.get(OutboundEmail, message_id)
+    assert message.status == "sent" and message.sent_at is not None
+
+
+def test_abandoned_forward_moves_log_and_stats_to_failed(db, outbox, forward):
+    from models import EmailLog, OutboundEmail, UserStats
+
+    user, _, message_id = forward()
+    send_all(outbox, [httpx.Response(400, text="bad request")])
+
+    message = db.get(OutboundEmail, message_id)
+    assert message.status == "failed"
+    assert db.get(EmailLog, message.email_log_id).action_taken == "failed"
+    stats = db.get(UserStats, user.id)
+    assert (stats.emails_forwarded, stats.emails_failed) == (0, 1)
+
+
+def test_retries_stop_after_max_attempts(db, outbox, forward, monkeypatch):
+    from models import OutboundEmail
+
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 1)
+    _, _, message_id = forward()
+    send_all(outbox, [httpx.Response(503)])
+
+    assert db.get(OutboundEmail, message_id).status == "failed"
+
+
+def test_forward_to_deactivated_address_is_not_sent(db, outbox, forward):
+    from models import OutboundEmail
+
+    _, temp_email, message_id = forward()
+    temp_email.is_active = False
+    db.commit()
+
+    processed, requests = send_all(outbox, [])
+
+    assert processed == 0 and requests == []
+    message = db.get(OutboundEmail, message_id)
+    assert message.status == "failed"
+    assert message.last_error == "Address is no longer active"
@@ -0,0 +1,106 @@
+"""Token-bucket arithmetic of the shared OpenAI rate limiter."""
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, parse_duration, request_priority
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def limiter_path(tmp_path):
+    return str(tmp_path / "ratelimit.json")
+
+
+def take(limiter, tokens=1, priority="normal", times=1):
+    # An expired deadline: report instead of sleeping.
+    return [limiter.acquire(tokens, priority, deadline=0) for _ in range(times)]
+
+
+def test_requests_per_minute_bucket_empties_and_refills(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=60, tpm=0, reserve=0)
+    assert all(take(limiter, times=60))
+    assert take(limiter) == [False]
+
+    # 60 per minute is one per second.
+    clock[0] += 1
+    assert take(limiter, times=2) == [True, False]
+    clock[0] += 600
+    assert limiter.stats()["available_requests"] == 60
+
+
+def test_tokens_per_minute_bucket(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=0, tpm=1000, reserve=0)
+    assert take(limiter, tokens=600) == [True]
+    assert take(limiter, tokens=600) == [False]
+    clock[0] += 12  # 200 tokens back
+    assert take(limiter, tokens=600) == [True]
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=0, tpm=1000, reserve=0)
+    assert take(limiter, tokens=5000) == [True]
+    assert limiter.stats()["available_tokens"] == -4000
+
+
+def test_reserve_is_only_for_high_priority(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=10, tpm=0, reserve=0.2)
+    assert all(take(limiter, times=8))
+    assert take(limiter) == [False]
+    assert take(limiter, priority="high", times=3) == [True, True, False]
+
+
+def test_settle_refunds_overestimates(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=0, tpm=1000, reserve=0)
+    take(limiter, tokens=800)
+    limiter.settle(800, 300)
+    assert limiter.stats()["available_tokens"] == 700
+    limiter.settle(300, 500)
+    assert limiter.stats()["available_tokens"] == 500
+
+
+def test_observe_only_lowers_the_buckets(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=100, tpm=1000, reserve=0)
+    limiter.observe({"x-ratelimit-remaining-requests": "40", "x-ratelimit-remaining-tokens": "5000"})
+    stats = limiter.stats()
+    assert stats["available_requests"] == 40
+    assert stats["available_tokens"] == 1000
+
+
+def test_penalize_blocks_until_retry_after(clock, limiter_path):
+    limiter = RateLimiter(limiter_path, rpm=0, tpm=0, reserve=0)
+    assert limiter.penalize({"retry-after": "2"}) == 2
+    assert take(limiter, priority="high") == [False]
+    clock[0] += 2
+    assert take(limiter) == [True]
+
+
+def test_buckets_are_shared_through_the_state_file(clock, limiter_path):
+    first = RateLimiter(limiter_path, rpm=2, tpm=0, reserve=0)
+    second = RateLimiter(limiter_path, rpm=2, tpm=0, reserve=0)
+    assert take(first) == [True]
+    assert take(second) == [True]
+    assert take(first) == [False]
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("1s", 1), ("6m0s", 360), ("20ms", 0.02), ("1h2m3s", 3723), ("2.5", 2.5),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_duration_rejects_garbage(value):
+    assert parse_duration(value) is None
+
+
+def test_request_priority():
+    assert request_priority("Your verification code") == "high"
+    assert request_priority("Weekly digest", "Use this one-time passcode") == "high"
+    assert request_priority("Weekly digest", "Our best decoder rings") == "normal"
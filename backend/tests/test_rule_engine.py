@@ -0,0 +1,77 @@
+"""Compiled rule sets must match the per-rule `keyword in content` loop."""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from rule_engine import CompiledRuleSet, RuleSetCache
+
+
+def rule(keywords, action="delete", is_active=True, rule_id=1):
+    return SimpleNamespace(id=rule_id, user_id=1, keywords=keywords, action=action, is_active=is_active)
+
+
+def reference(forwarding_rules, sender_email, subject, body):
+    content = f"{sender_email} {subject} {body}".lower()
+    for forwarding_rule in forwarding_rules:
+        if not forwarding_rule.is_active:
+            continue
+        for keyword in forwarding_rule.keywords.split(","):
+            if keyword.strip().lower() in content:
+                return forwarding_rule.action
+    return None
+
+
+def applied(forwarding_rules, sender_email, subject, body):
+    result = CompiledRuleSet(forwarding_rules).apply(sender_email, subject, body)
+    return result["action"] if result else None
+
+
+def test_fuzzed_rules_match_the_reference():
+    # A tiny alphabet makes overlapping keywords, shared prefixes and keywords
+    # that contain each other common.
+    generator = random.Random(3000)
+    alphabet = "abAB ."
+
+    def text(max_length):
+        return "".join(generator.choice(alphabet) for _ in range(generator.randint(0, max_length)))
+
+    for case in range(3000):
+        forwarding_rules = [
+            rule(",".join(text(4) for _ in range(generator.randint(1, 4))),
+                 action=generator.choice(["forward", "delete", "quarantine"]) + str(index),
+                 is_active=generator.random() > 0.2, rule_id=index)
+            for index in range(generator.randint(1, 5))
+        ]
+        email = (text(6), text(10), text(20))
+        assert applied(forwarding_rules, *email) == reference(forwarding_rules, *email), (case, forwarding_rules, email)
+
+
+@pytest.mark.parametrize("keywords, content, expected", [
+    ("sale, offer", "big SALE today", "delete"),
+    ("newsletter", "your order", None),
+    ("", "anything", "delete"),
+    ("  ,other", "anything", "delete"),
+])
+def test_single_rule(keywords, content, expected):
+    assert applied([rule(keywords)], "a@b.com", content, "") == expected
+
+
+def test_first_rule_in_order_wins_over_longer_match():
+    forwarding_rules = [rule("order", action="forward", rule_id=1), rule("order shipped", action="delete", rule_id=2)]
+    assert applied(forwarding_rules, "", "your order shipped", "") == "forward"
+    assert applied(list(reversed(forwarding_rules)), "", "your order shipped", "") == "delete"
+
+
+def test_inactive_rules_are_ignored():
+    assert applied([rule("sale", is_active=False)], "", "sale", "") is None
+    assert CompiledRuleSet([rule("sale", is_active=False)]).apply("", "sale", "") is None
+
+
+def test_cache_recompiles_when_rules_change():
+    cache = RuleSetCache()
+    first = cache.get([rule("sale")])
+    assert cache.get([rule("sale")]) is first
+    changed = cache.get([rule("offer")])
+    assert changed is not first
+    assert changed.apply("", "offer", "")["action"] == "delete"
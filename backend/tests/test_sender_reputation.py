@@ -0,0 +1,52 @@
+"""Sender reputation decisions, and shared mailbox domains."""
+import pytest
+
+
+@pytest.fixture
+def reputation(db):
+    import sender_reputation
+    from models import SenderReputation
+
+    db.query(SenderReputation).delete()
+    db.commit()
+    sender_reputation.reputation_index.clear()
+    return sender_reputation
+
+
+def record(db, reputation, sender_email, action, count):
+    reputation.record_email_logs(db, [
+        {"sender_email": sender_email, "action_taken": action, "ai_confidence_score": 0.95,
+         "ai_reasoning": "Looks like a newsletter"}
+    ] * count)
+    db.commit()
+
+
+def test_lopsided_domain_history_decides_other_addresses(db, reputation, new_user):
+    user, _, _ = new_user()
+    record(db, reputation, "promo@deals.example.com", "delete", 150)
+
+    decision = reputation.reputation_index.decide(db, user.id, "weekly@deals.example.com")
+    assert decision["action"] == "delete"
+    assert "@deals.example.com" in decision["reasoning"]
+
+
+def test_shared_mailbox_domain_is_never_judged(db, reputation, new_user):
+    from models import SenderReputation
+
+    user, _, _ = new_user()
+    record(db, reputation, "spammer@gmail.com", "delete", 150)
+
+    assert db.get(SenderReputation, "@gmail.com") is None
+    assert reputation.reputation_index.decide(db, user.id, "friend@gmail.com") is None
+    # The address itself still builds a record of its own.
+    assert reputation.reputation_index.decide(db, user.id, "spammer@gmail.com")["action"] == "delete"
+
+
+def test_user_override_for_shared_domain_still_applies(db, reputation, new_user):
+    from models import SenderOverride
+
+    user, _, _ = new_user()
+    db.add(SenderOverride(user_id=user.id, sender="@gmail.com", action="quarantine"))
+    db.commit()
+
+    assert reputation.reputation_index.decide(db, user.id, "friend@gmail.com")["action"] == "quarantine"
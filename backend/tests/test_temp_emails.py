@@ -0,0 +1,44 @@
+"""Address creation, including retries on address collisions."""
+import itertools
+
+
+def test_bulk_creation(client, db, new_user):
+    from models import UserStats
+
+    user, _, headers = new_user()
+    response = client.post("/api/temp-emails/bulk", headers=headers, json={"count": 25, "purpose": "shopping"})
+
+    assert response.status_code == 200
+    addresses = [temp_email["address"] for temp_email in response.json()]
+    assert len(set(addresses)) == 25
+    db.expire_all()
+    stats = db.get(UserStats, user.id)
+    assert (stats.total_temp_emails, stats.active_temp_emails) == (26, 26)
+
+
+def test_bulk_creation_retries_on_collision(client, new_user, monkeypatch):
+    import routers.temp_emails
+
+    _, existing, headers = new_user()
+    # The first batch collides with an existing address, the second does not.
+    addresses = itertools.chain([existing.address], (f"temp-retry{n}@example.com" for n in itertools.count()))
+    monkeypatch.setattr(routers.temp_emails, "generate_temp_email", lambda domain: next(addresses))
+
+    response = client.post("/api/temp-emails/bulk", headers=headers, json={"count": 3})
+
+    assert response.status_code == 200, response.text
+    assert {temp_email["address"] for temp_email in response.json()} == {
+        f"temp-retry{n}@example.com" for n in (2, 3, 4)
+    }
+
+
+def test_creation_gives_up_after_repeated_collisions(client, new_user, monkeypatch):
+    import routers.temp_emails
+
+    _, existing, headers = new_user()
+    monkeypatch.setattr(routers.temp_emails, "generate_temp_email", lambda domain: existing.address)
+
+    response = client.post("/api/temp-emails/", headers=headers, json={})
+
+    assert response.status_code == 500
+    assert response.json()["detail"] == "Could not generate unique email address"
@@ -0,0 +1,86 @@
+"""Inline webhook pipeline against the local OpenAI and SendGrid stubs."""
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def address(client):
+    from database import SessionLocal
+    from models import TempEmail, TempEmailStats, User, UserStats
+
+    db = SessionLocal()
+    try:
+        user = User(email="owner@example.com", hashed_password="x")
+        db.add(user)
+        db.flush()
+        db.add(UserStats(user_id=user.id))
+        temp_email = TempEmail(user_id=user.id, address="shop@example.com", purpose="shopping")
+        db.add(temp_email)
+        db.flush()
+        db.add(TempEmailStats(temp_email_id=temp_email.id, user_id=user.id))
+        db.commit()
+        return temp_email.address
+    finally:
+        db.close()
+
+
+def inbound(to_email, subject, sender="store@shop.example.com"):
+    return {"event": "inbound", "to": [{"email": to_email}], "from": sender, "subject": subject,
+            "text": f"{subject}. Details are in your account."}
+
+
+def logged_actions(subjects):
+    from database import SessionLocal
+    from models import EmailLog
+
+    db = SessionLocal()
+    try:
+        return dict(db.query(EmailLog.subject, EmailLog.action_taken).filter(EmailLog.subject.in_(subjects)))
+    finally:
+        db.close()
+
+
+def test_classifies_forwards_and_logs(client, upstreams, address):
+    openai_stub, sendgrid_stub = upstreams
+    openai_before = openai_stub.stats()["requests"]
+    sendgrid_before = sendgrid_stub.stats()["requests"]
+    events = [
+        inbound(address, "Your order has shipped"),
+        inbound(address, "Weekend sale on everything"),
+        inbound("nobody@example.com", "Misdirected"),
+    ]
+
+    response = client.post("/api/webhooks/sendgrid", json=events)
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Processed 2 emails"}
+    assert logged_actions(["Your order has shipped", "Weekend sale on everything", "Misdirected"]) == {
+        "Your order has shipped": "forward",
+        "Weekend sale on everything": "delete",
+    }
+    assert openai_stub.stats()["requests"] > openai_before
+    assert sendgrid_stub.stats()["requests"] - sendgrid_before == 1
+
+
+def test_rate_limited_model_is_waited_out(client, upstreams, address):
+    from ai_classifier import CLASSIFIER_TIMEOUT_SECONDS
+
+    openai_stub, _ = upstreams
+    openai_before = openai_stub.stats()["requests"]
+    openai_stub.error_rate, openai_stub.error_status = 1.0, 429
+    try:
+        started = time.monotonic()
+        response = client.post("/api/webhooks/sendgrid", json=[inbound(address, "Security alert for your login",
+                                                                        sender="alerts@bank.example.com")])
+        elapsed = time.monotonic() - started
+    finally:
+        openai_stub.error_rate, openai_stub.error_status = 0.0, 500
+
+    assert response.status_code == 200
+    # Retry-After: 1 within the classifier deadline allows a few calls, not
+    # a tight loop of them.
+    assert openai_stub.stats()["requests"] - openai_before <= CLASSIFIER_TIMEOUT_SECONDS + 1
+    assert elapsed < CLASSIFIER_TIMEOUT_SECONDS + 2
+    # The default degraded policy still forwards.
+    assert logged_actions(["Security alert for your login"]) == {"Security alert for your login": "forward"}
@@ -0,0 +1,116 @@
+"""Durable inbound queue: idempotent enqueue, claims, leases and retries."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def queue(db):
+    import work_queue
+    from models import InboundEvent
+
+    db.query(InboundEvent).delete()
+    db.commit()
+    return work_queue
+
+
+def inbound(n):
+    return {"event": "inbound", "sg_event_id": f"evt-{n}", "to": [{"email": "nobody@example.com"}]}
+
+
+def test_enqueue_skips_duplicates(db, queue):
+    assert queue.enqueue_events(db, [inbound(1), inbound(2), inbound(1)]) == (2, 1)
+    assert queue.enqueue_events(db, [inbound(2), inbound(3)]) == (1, 1)
+
+
+def test_idempotency_key_without_event_id_is_a_content_hash(queue):
+    event = {"event": "inbound", "subject": "Hi"}
+    assert queue.idempotency_key(event) == queue.idempotency_key(dict(reversed(list(event.items()))))
+    assert queue.idempotency_key(event) != queue.idempotency_key(dict(event, subject="Hello"))
+    assert queue.idempotency_key({"sg_event_id": "abc"}) == "sg:abc"
+
+
+def test_claimed_events_are_not_handed_out_twice(db, queue):
+    queue.enqueue_events(db, [inbound(n) for n in range(3)])
+
+    first = queue.claim_events(db, "worker-a", limit=2)
+    second = queue.claim_events(db, "worker-b", limit=5)
+
+    assert len(first) == 2 and len(second) == 1
+    assert {event.id for event in first}.isdisjoint(event.id for event in second)
+    assert all(event.status == "processing" and event.attempts == 1 for event in first + second)
+    assert queue.claim_events(db, "worker-c") == []
+
+
+def test_expired_lease_is_reclaimed(db, queue):
+    from models import InboundEvent
+
+    queue.enqueue_events(db, [inbound(1)])
+    (event,) = queue.claim_events(db, "worker-a")
+    assert queue.claim_events(db, "worker-b") == []
+
+    db.query(InboundEvent).filter(InboundEvent.id == event.id).update({
+        InboundEvent.locked_at: datetime.utcnow() - timedelta(seconds=queue.QUEUE_VISIBILITY_TIMEOUT + 1)
+    })
+    db.commit()
+
+    (reclaimed,) = queue.claim_events(db, "worker-b")
+    assert reclaimed.id == event.id
+    assert reclaimed.locked_by == "worker-b"
+    assert reclaimed.attempts == 2
+
+
+def test_failed_event_backs_off_then_gives_up(db, queue, monkeypatch):
+    from models import InboundEvent
+
+    monkeypatch.setattr(queue, "QUEUE_MAX_ATTEMPTS", 2)
+    queue.enqueue_events(db, [inbound(1)])
+    (event,) = queue.claim_events(db, "worker-a")
+
+    queue.mark_failed(db, event.id, "boom")
+    db.refresh(event)
+    assert event.status == "pending"
+    assert event.last_error == "boom"
+    assert event.available_at > datetime.utcnow() + timedelta(seconds=queue.QUEUE_RETRY_BASE_DELAY - 1)
+    assert queue.claim_events(db, "worker-a") == []
+
+    event.available_at = datetime.utcnow()
+    db.commit()
+    (event,) = queue.claim_events(db, "worker-a")
+    queue.mark_failed(db, event.id, "boom again")
+    db.refresh(event)
+    assert event.status == "failed"
+    assert db.query(InboundEvent).filter(InboundEvent.status == "pending").count() == 0
+
+
+def test_run_once_settles_each_event(db, queue):
+    from models import InboundEvent
+
+    queue.enqueue_events(db, [inbound(1), inbound(2)])
+
+    async def handler(event, read_db, writer):
+        if event["sg_event_id"] == "evt-2":
+            raise RuntimeError("handler failed")
+
+    processed = asyncio.run(queue.QueueWorkerPool(handler).run_once("worker-a"))
+
+    assert processed == 2
+    db.expire_all()
+    statuses = dict(db.query(InboundEvent.idempotency_key, InboundEvent.status))
+    assert statuses == {"sg:evt-1": "done", "sg:evt-2": "pending"}
+
+
+def test_purge_deletes_old_done_events_in_chunks(db, queue):
+    from models import InboundEvent
+
+    queue.enqueue_events(db, [inbound(n) for n in range(5)])
+    old = datetime.utcnow() - timedelta(hours=queue.QUEUE_RETENTION_HOURS + 1)
+    ids = [event_id for (event_id,) in db.query(InboundEvent.id).order_by(InboundEvent.id)]
+    db.query(InboundEvent).filter(InboundEvent.id.in_(ids[:4])).update(
+        {InboundEvent.status: "done", InboundEvent.processed_at: old}, synchronize_session=False
+    )
+    db.commit()
+
+    assert queue.purge_completed(db, chunk_size=3) == 4
+    assert [event_id for (event_id,) in db.query(InboundEvent.id)] == ids[4:]
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from batch_writer import BatchWriter
+from database import SessionLocal, get_async_sessionmaker
+from models import InboundEvent
+
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "4"))
+QUEUE_CLAIM_BATCH = int(os.getenv("QUEUE_CLAIM_BATCH", "10"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1.0"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+QUEUE_RETRY_BASE_DELAY = float(os.getenv("QUEUE_RETRY_BASE_DELAY", "5"))
+QUEUE_VISIBILITY_TIMEOUT = int(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "300"))
+QUEUE_RETENTION_HOURS = int(os.getenv("QUEUE_RETENTION_HOURS", "72"))
+QUEUE_PURGE_CHUNK = int(os.getenv("QUEUE_PURGE_CHUNK", "1000"))
+
+
+def idempotency_key(event: dict) -> str:
+    # SendGrid stamps every event with sg_event_id and keeps it across
+    # redeliveries; fall back to a content hash for payloads without one.
+    sg_event_id = event.get("sg_event_id")
+    if sg_event_id:
+        return f"sg:{sg_event_id}"
+    digest = hashlib.sha256(json.dumps(event, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"sha256:{digest}"
+
+
+def enqueue_events(db: Session, events: List[dict], delay_seconds: float = 0) -> Tuple[int, int]:
+    """Store events durably, skipping ones already queued. Returns (enqueued, duplicates)."""
+    available_at = datetime.utcnow() + timedelta(seconds=delay_seconds)
+
+    by_key = {}
+    for event in events:
+        by_key.setdefault(idempotency_key(event), event)
+
+    existing = {
+        key for (key,) in db.query(InboundEvent.idempotency_key).filter(
+            InboundEvent.idempotency_key.in_(list(by_key))
+        )
+    } if by_key else set()
+
+    new_rows = [
+        InboundEvent(idempotency_key=key, payload=json.dumps(event), available_at=available_at)
+        for key, event in by_key.items()
+        if key not in existing
+    ]
+
+    try:
+        db.add_all(new_rows)
+        db.commit()
+        enqueued = len(new_rows)
+    except IntegrityError:
+        # Another worker enqueued some of the same events concurrently.
+        db.rollback()
+        enqueued = 0
+        for row in new_rows:
+            try:
+                with db.begin_nested():
+                    db.add(InboundEvent(
+                        idempotency_key=row.idempotency_key,
+                        payload=row.payload,
+                        available_at=row.available_at
+                    ))
+                enqueued += 1
+            except IntegrityError:
+                pass
+        db.commit()
+
+    return enqueued, len(events) - enqueued
+
+
+def _claimable(now: datetime):
+    stale_before = now - timedelta(seconds=QUEUE_VISIBILITY_TIMEOUT)
+    return or_(
+        and_(InboundEvent.status == "pending", InboundEvent.available_at <= now),
+        # A worker that died mid-event leaves it in 'processing'; hand it out
+        # again once its lease has expired.
+        and_(InboundEvent.status == "processing", InboundEvent.locked_at < stale_before)
+    )
+
+
+def claim_events(db: Session, worker_id: str, limit: int = QUEUE_CLAIM_BATCH) -> List[InboundEvent]:
+    now = datetime.utcnow()
+    candidate_ids = [
+        event_id for (event_id,) in db.query(InboundEvent.id).filter(
+            _claimable(now)
+        ).order_by(InboundEvent.id).limit(limit)
+    ]
+
+    claimed_ids = []
+    for event_id in candidate_ids:
+        # Conditional update so two workers can never claim the same row.
+        updated = db.query(InboundEvent).filter(
+            InboundEvent.id == event_id,
+            _claimable(now)
+        ).update({
+            InboundEvent.status: "processing",
+            InboundEvent.locked_by: worker_id,
+            InboundEvent.locked_at: now,
+            InboundEvent.attempts: InboundEvent.attempts + 1
+        }, synchronize_session=False)
+        if updated:
+            claimed_ids.append(event_id)
+    db.commit()
+
+    if not claimed_ids:
+        return []
+    return db.query(InboundEvent).filter(InboundEvent.id.in_(claimed_ids)).order_by(InboundEvent.id).all()
+
+
+def mark_done(db: Session, event_id: int):
+    db.query(InboundEvent).filter(InboundEvent.id == event_id).update({
+        InboundEvent.status: "done",
+        InboundEvent.processed_at: datetime.utcnow(),
+        InboundEvent.last_error: None
+    }, synchronize_session=False)
+
+
+def mark_failed(db: Session, event_id: int, error: str):
+    schedule_retry(db, event_id, error)
+    db.commit()
+
+
+def schedule_retry(db: Session, event_id: int, error: str):
+    """mark_failed without the commit, for use inside a larger transaction."""
+    event = db.query(InboundEvent).filter(InboundEvent.id == event_id).first()
+    if not event:
+        return
+
+    if event.attempts >= QUEUE_MAX_ATTEMPTS:
+        event.status = "failed"
+    else:
+        event.status = "pending"
+        event.available_at = datetime.utcnow() + timedelta(
+            seconds=QUEUE_RETRY_BASE_DELAY * (2 ** (event.attempts - 1))
+        )
+    event.locked_by = None
+    event.locked_at = None
+    event.last_error = error[:1000]
+
+
+def purge_completed(db: Session, older_than_hours: int = QUEUE_RETENTION_HOURS,
+                    chunk_size: int = QUEUE_PURGE_CHUNK) -> int:
+    # Keys are kept for as long as SendGrid may redeliver an event. One
+    # transaction per chunk so the write lock is never held for the backlog.
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    total = 0
+    while True:
+        event_ids = [
+            event_id for (event_id,) in db.query(InboundEvent.id).filter(
+                InboundEvent.status == "done",
+                InboundEvent.processed_at < cutoff
+            ).limit(chunk_size)
+        ]
+        if not event_ids:
+            return total
+        total += db.query(InboundEvent).filter(InboundEvent.id.in_(event_ids)).delete(synchronize_session=False)
+        db.commit()
+        if len(event_ids) < chunk_size:
+            return total
+
+
+def queue_stats(db: Session) -> Dict[str, Any]:
+    counts = dict(
+        db.query(InboundEvent.status, func.count(InboundEvent.id)).group_by(InboundEvent.status).all()
+    )
+    oldest_pending = db.query(func.min(InboundEvent.created_at)).filter(
+        InboundEvent.status.in_(["pending", "processing"])
+    ).scalar()
+    lag_seconds = (datetime.utcnow() - oldest_pending).total_seconds() if oldest_pending else 0.0
+
+    return {
+        "pending": counts.get("pending", 0),
+        "processing": counts.get("processing", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "depth": counts.get("pending", 0) + counts.get("processing", 0),
+        "lag_seconds": round(lag_seconds, 3)
+    }
+
+
+class QueueWorkerPool:
+    def __init__(self, handler: Callable[[dict, Session, BatchWriter], Awaitable[Any]], workers: int = QUEUE_WORKERS):
+        self.handler = handler
+        self.workers = workers
+        self.tasks: List[asyncio.Task] = []
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    def start(self):
+        if self.tasks:
+            return
+        for index in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._run(f"{self.worker_prefix}:{index}")))
+        self.tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _run(self, worker_id: str):
+        while True:
+            try:
+                processed = await self.run_once(worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Queue worker {worker_id} error: {str(e)}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
+    async def run_once(self, worker_id: str) -> int:
+        # Writes go through the async session; a sync write on the event loop
+        # would stall every other coroutine while it waits for the SQLite lock.
+        Session = get_async_sessionmaker()
+        async with Session() as db:
+            claimed = await db.run_sync(
+                lambda session: [(event.id, event.payload) for event in claim_events(session, worker_id)]
+            )
+        if not claimed:
+            return 0
+
+        writer = BatchWriter()
+        done, failed = [], []
+
+        async def handle(event_id: int, payload: str):
+            # Claimed events run concurrently so their classifications can
+            # share batched LLM calls; each needs its own read session.
+            read_db = SessionLocal()
+            event_writer = BatchWriter()
+            try:
+                await self.handler(json.loads(payload), read_db, event_writer)
+                writer.extend(event_writer, source=event_id)
+                done.append(event_id)
+            except Exception as e:
+                read_db.rollback()
+                print(f"Queued event {event_id} failed: {str(e)}")
+                failed.append((event_id, str(e)))
+            finally:
+                read_db.close()
+
+        await asyncio.gather(*(handle(event_id, payload) for event_id, payload in claimed))
+
+        def settle(session: Session, lost_event_ids):
+            # Log rows and their 'done' marks commit together. An event is only
+            # replayed if the worker dies before this point or its log row
+            # could not be written (at-least-once).
+            lost = set(lost_event_ids)
+            for event_id in done:
+                if event_id in lost:
+                    schedule_retry(session, event_id, "Email log could not be written")
+                else:
+                    mark_done(session, event_id)
+
+        def finish(session: Session):
+            writer.flush(session, before_commit=settle)
+            for event_id, error in failed:
+                mark_failed(session, event_id, error)
+
+        async with Session() as db:
+            await db.run_sync(finish)
+        return len(claimed)
+
+    async def _purge_loop(self):
+        Session = get_async_sessionmaker()
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                async with Session() as db:
+                    await db.run_sync(purge_completed)
+            except Exception as e:
+                print(f"Queue purge error: {str(e)}")